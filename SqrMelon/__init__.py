@@ -6,13 +6,18 @@ import ctypes
 import functools
 import traceback
 import threading
+from xml.etree import cElementTree
 
+from animationhook import AnimationProcessor
 from camerawidget import Camera
+from capture import PixelBufferRing, CAPTURE_SINKS, createCaptureSink
 from fileutil import FileDialog, FilePath
+from multiplatformutil import isWindows
 from overlays import Overlays
 
 from animationgraph.curveview import CurveEditor
 from profileui import Profiler
+from projectsave import ProjectSnapshot, SaveWorker, autosaveDirectory
 from scene import Scene
 from scenelist import SceneList
 from sceneview3d import SceneView
@@ -28,7 +33,8 @@ import icons
 
 IGNORED_EXTENSIONS = (PROJ_EXT, '.user')
 DEFAULT_PROJECT = 'defaultproject'
-FFMPEG_PATH = 'ffmpeg.exe'
+FFMPEG_PATH = 'ffmpeg.exe' if isWindows() else 'ffmpeg'
+
 
 class PyDebugLog(object):
     """
@@ -110,6 +116,7 @@ class App(QMainWindowState):
         save.setShortcutContext(Qt.ApplicationShortcut)
         save.setIcon(icons.get('icons8-save-50'))
         save.triggered.connect(self.__onCtrlS)
+        self.__projectMenu.addAction('Autosave settings...').triggered.connect(self.__autosaveSettings)
         self.__projectMenu.addSeparator()
         exitAction = self.__projectMenu.addAction('E&xit')
         exitAction.setIcon(icons.get('icons8-exit-50'))
@@ -156,6 +163,17 @@ class App(QMainWindowState):
 
         self.__initializeProject()
 
+        # serializing & writing happens on a worker thread, see projectsave.py
+        self.__saveWorker = SaveWorker(int(gSettings.value('AutosaveBackups', 10)))
+        self.__saveWorker.saved.connect(self.__onSaved)
+        self.__saveWorker.failed.connect(self.__onSaveFailed)
+        self.__autosavedState = None
+        # a save error closeEvent already showed, see __onSaveFailed
+        self.__reportedSaveError = None
+        self.__autosaveTimer = QTimer(self)
+        self.__autosaveTimer.timeout.connect(self.__autosave)
+        self.__startAutosave()
+
         undoStack, cameraUndoStack = self.__graphEditor.undoStacks()
         undo = undoStack.createUndoAction(self, '&Undo')
         undo.setShortcut(QKeySequence.Undo)
@@ -270,6 +288,7 @@ class App(QMainWindowState):
         diag = QDialog()
         fId = gSettings.value('RecordFPS', 2)
         rId = gSettings.value('RecordResolution', 3)
+        sinkName = gSettings.value('RecordOutput', 'jpg')
         layout = QGridLayout()
         diag.setLayout(layout)
         layout.addWidget(QLabel('FPS: '), 0, 0)
@@ -282,34 +301,61 @@ class App(QMainWindowState):
         resolution.addItems(['144', '288', '360', '720', '1080', '2160'])
         resolution.setCurrentIndex(rId)
         layout.addWidget(resolution, 1, 1)
+        layout.addWidget(QLabel('Output: '), 2, 0)
+        output = QComboBox()
+        output.addItems(list(CAPTURE_SINKS.values()))
+        if sinkName in CAPTURE_SINKS:
+            output.setCurrentIndex(list(CAPTURE_SINKS.keys()).index(sinkName))
+        layout.addWidget(output, 2, 1)
         ok = QPushButton('Ok')
         ok.clicked.connect(diag.accept)
         cancel = QPushButton('Cancel')
         cancel.clicked.connect(diag.reject)
-        layout.addWidget(ok, 2, 0)
-        layout.addWidget(cancel, 2, 1)
+        layout.addWidget(ok, 3, 0)
+        layout.addWidget(cancel, 3, 1)
         diag.exec_()
         if diag.result() != QDialog.Accepted:
             return
+        sinkName = list(CAPTURE_SINKS.keys())[output.currentIndex()]
         gSettings.setValue('RecordFPS', fps.currentIndex())
         gSettings.setValue('RecordResolution', resolution.currentIndex())
+        gSettings.setValue('RecordOutput', sinkName)
 
         FPS = int(fps.currentText())
         HEIGHT = int(resolution.currentText())
-        WIDTH = (HEIGHT * 16) / 9
-        FMT = 'jpg'
+        WIDTH = (HEIGHT * 16) // 9
 
-        data = (ctypes.c_ubyte * (WIDTH * HEIGHT * 3))()  # alloc buffer once
         flooredStart = self._timer.secondsToBeats(int(self._timer.beatsToSeconds(self._timer.start) * FPS) / float(FPS))
         duration = self._timer.beatsToSeconds(self._timer.end - flooredStart)
+        startFrame = int(self._timer.beatsToSeconds(self._timer.start) * FPS)
 
         captureDir = currentProjectDirectory().join('capture')
+        sink = createCaptureSink(sinkName, captureDir, FFMPEG_PATH, self.timeSlider.soundtrackPath() or None, -self._timer.beatsToSeconds(flooredStart))
         captureDir.ensureExists(isFolder=True)
 
         progress = QProgressDialog(self)
         progress.setMaximum(int(duration * FPS))
+        try:
+            sink.open(WIDTH, HEIGHT, FPS)
+            try:
+                # frames are read back a few frames late and encoded on worker threads while the GPU renders the next ones
+                reader = PixelBufferRing(WIDTH, HEIGHT, pixelType=sink.pixelType)
+                try:
+                    self.__recordFrames(reader, sink, progress, flooredStart, startFrame, int(duration * FPS), FPS, WIDTH, HEIGHT)
+                finally:
+                    reader.delete()
+            finally:
+                sink.close()
+        except Exception:
+            QMessageBox.critical(self, 'Record failed', traceback.format_exc())
+        finally:
+            progress.close()
+
+    def __recordFrames(self, reader, sink, progress, flooredStart, startFrame, numFrames, FPS, WIDTH, HEIGHT):
+        processor = AnimationProcessor.get(currentProjectDirectory())
+
         prevFrame = 0
-        for frame in range(int(duration * FPS)):
+        for frame in range(numFrames):
             deltaTime = (frame - prevFrame) / float(FPS)
             prevFrame = frame
             progress.setValue(frame)
@@ -318,66 +364,32 @@ class App(QMainWindowState):
                 break
             beats = flooredStart + self._timer.secondsToBeats(frame / float(FPS))
 
-            shot = self.__shotsManager.shotAtTime(beats)
-            if shot is None:
+            evaluation = self.__shotsManager.evaluateFrame(beats)
+            if evaluation.shot is None:
+                # keep video captures as long as the timeline, so the soundtrack stays in sync
+                for data, readFrame in reader.skip(startFrame + frame):
+                    sink.write(readFrame, data)
                 continue
-            sceneFile = currentScenesDirectory().join(shot.sceneName).ensureExt(SCENE_EXT)
+            sceneFile = currentScenesDirectory().join(evaluation.shot.sceneName).ensureExt(SCENE_EXT)
             scene = Scene.getScene(sceneFile, self.__models)
             scene.setSize(WIDTH, HEIGHT)
 
-            uniforms = self.__shotsManager.evaluate(beats)
-            textureUniforms = self.__shotsManager.additionalTextures(beats)
+            uniforms = evaluation.uniforms()
+            textureUniforms = evaluation.textures()
             self.__sceneView._cameraInput.setData(*(uniforms['uOrigin'] + uniforms['uAngles']))  # feed animation into camera so animationprocessor can read it again
             cameraData = self.__sceneView._cameraInput.data()
-
-            modifier = currentProjectDirectory().join('animationprocessor.py')
-            if modifier.exists():
-                execfile(str(modifier), globals(), locals())
+            processor.process(uniforms, cameraData, beats, scene)
 
             for name in self.__sceneView._textures:
                 uniforms[name] = self.__sceneView._textures[name]._id
 
             scene.drawToScreen(self._timer.beatsToSeconds(beats), beats, uniforms, (0, 0, WIDTH, HEIGHT), textureUniforms)
-            scene.colorBuffers[-1][0].use()
-
-            from OpenGL.GL import glGetTexImage, GL_TEXTURE_2D, GL_RGB, GL_UNSIGNED_BYTE
-            glGetTexImage(GL_TEXTURE_2D, 0, GL_RGB, GL_UNSIGNED_BYTE, data)
-
-            captureDir = currentProjectDirectory().join('capture')
-            QImage(data, WIDTH, HEIGHT, QImage.Format_RGB888).mirrored(False, True).save(captureDir.join('dump_%s_%05d.%s' % (FPS, int(self._timer.beatsToSeconds(self._timer.start) * FPS) + frame, FMT)))
-        progress.close()
-
-        convertCaptureDir = currentProjectDirectory().join('convertcapture')
-        convertCaptureDir.ensureExists(isFolder=True)
-
-        with convertCaptureDir.join('convert.bat').edit() as fh:
-            start = ''
-            start2 = ''
-            if int(self._timer.start * FPS) > 0:
-                start = '-start_number {} '.format(int(self._timer.beatsToSeconds(self._timer.start) * FPS))
-                start2 = '-vframes {} '.format(int(self._timer.beatsToSeconds(self._timer.end - self._timer.start) * FPS))
-
-            fh.write('cd "../capture"\n"{}" -framerate {} {}-i dump_{}_%%05d.{} {}-c:v libx264 -r {} -pix_fmt yuv420p "../convertcapture/output.mp4"'.format(FFMPEG_PATH, FPS, start, FPS, FMT,
-                                                                                                                                                                                  start2, FPS))
-        with convertCaptureDir.join('convertGif.bat').edit() as fh:
-            start = ''
-            start2 = ''
-            iln = ''
-            if int(self._timer.start * FPS) > 0:
-                start = '-start_number {} '.format(int(self._timer.beatsToSeconds(self._timer.start) * FPS))
-                start2 = '-vframes {} '.format(int(self._timer.beatsToSeconds(self._timer.end - self._timer.start) * FPS))
-                iln = '-t {:03f} '.format(self._timer.beatsToSeconds(self._timer.end - self._timer.start))
-            fh.write('REM File format is actually %5d but in a .bat file we need to escape % or something, so you can\'t copy paste this into a cmd prompt without fixing up the %%05d to be %5d.\n')
-            fh.write('cd "../capture"\n"{}" -framerate {} {}{}-i dump_{}_%%05d.{} -vf "fps={},scale={}:-1:flags=lanczos,palettegen" palette.png\n'.format(FFMPEG_PATH, FPS, start, iln, FPS, FMT, FPS, HEIGHT))
-            fh.write('"{}" -framerate {} {}-i dump_{}_%%05d.{} -i "palette.png" -filter_complex "fps=12,scale=360:-1:flags=lanczos[x];[x][1:v]paletteuse" {}-r {} "../convertcapture/output.gif"'.format(FFMPEG_PATH, FPS, start, FPS, FMT, start2, FPS))
-
-        sound = self.timeSlider.soundtrackPath()
-        if not sound:
-            return
 
-        with convertCaptureDir.join('merge.bat').edit() as fh:
-            startSeconds = self._timer.beatsToSeconds(self._timer.start)
-            fh.write('{} -i output.mp4 -itsoffset {} -i "{}" -vcodec copy -shortest merged.mp4'.format(FFMPEG_PATH, -startSeconds, sound))
+            for data, readFrame in reader.read(scene.colorBuffers[-1][0], startFrame + frame):
+                sink.write(readFrame, data)
+
+        for data, readFrame in reader.flush():
+            sink.write(readFrame, data)
 
     def __restoreUiLock(self, action):
         state = True if gSettings.value('lockui', '0') == '1' else False
@@ -429,14 +441,95 @@ class App(QMainWindowState):
         else:
             self.__sceneView.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_S, Qt.ControlModifier))
 
-    def saveProject(self):
+    def __snapshot(self, changedOnly=True, backupDirectory=None, announce=True):
+        """
+        Copies everything a save writes, the worker thread does the rest.
+        :rtype: ProjectSnapshot
+        """
         self.__sceneView.saveCameraData()
-        self.__shotsManager.saveAllShots()
-        self._timer.saveState()
-        self.__models.saveToProject()
-        self.__modeler.viewport.saveState()
+        return ProjectSnapshot(currentProjectFilePath(),
+                               self.__shotsManager.snapshot(changedOnly),
+                               self._timer.projectAttributes(),
+                               self.__models.snapshot(),
+                               self.__modeler.viewport.stateAttributes(),
+                               backupDirectory,
+                               announce)
+
+    def saveProject(self, announce=True):
+        self._timer.saveSettings()
+        project = currentProjectFilePath()
+        if not project or not project.exists():
+            # legacy project or no project open
+            return
+        self.__saveWorker.submit(self.__snapshot(announce=announce))
+
+    def __onSaved(self, snapshot):
+        if snapshot.isBackup():
+            self.__statusBar.showMessage('Autosaved to %s' % snapshot.backupDirectory, 5000)
+            return
+        # the project may have been switched while saving
+        if snapshot.projectPath == currentProjectFilePath():
+            self.__shotsManager.markSaved(snapshot.shots.revisions)
+        if snapshot.announce:
+            QMessageBox.information(self, 'Save succesful!', 'Animation, shot & timing changes have been saved.')
+
+    def __onSaveFailed(self, error):
+        if error == self.__reportedSaveError:
+            self.__reportedSaveError = None
+            return
+        QMessageBox.critical(self, 'Save failed', error)
+
+    def __startAutosave(self):
+        minutes = float(gSettings.value('AutosaveMinutes', 5))
+        if minutes > 0:
+            self.__autosaveTimer.start(int(minutes * 60000))
+        else:
+            self.__autosaveTimer.stop()
+
+    def __autosave(self):
+        project = currentProjectFilePath()
+        if not project or not project.exists():
+            return
+        if not self.__saveWorker.isIdle():
+            # don't let backups pile up behind a slow disk
+            return
+        snapshot = self.__snapshot(changedOnly=False, backupDirectory=autosaveDirectory(project), announce=False)
+        state = (project,
+                 sorted(snapshot.shots.revisions.items()),
+                 sorted(snapshot.timerAttributes.items()),
+                 cElementTree.tostring(snapshot.xModels))
+        if state == self.__autosavedState:
+            return
+        self.__autosavedState = state
+        self.__saveWorker.submit(snapshot)
 
-        QMessageBox.information(self, 'Save succesful!', 'Animation, shot & timing changes have been saved.')
+    def __autosaveSettings(self):
+        diag = QDialog(self)
+        layout = QGridLayout()
+        diag.setLayout(layout)
+        layout.addWidget(QLabel('Interval in minutes (0 disables): '), 0, 0)
+        minutes = QSpinBox()
+        minutes.setRange(0, 240)
+        minutes.setValue(int(gSettings.value('AutosaveMinutes', 5)))
+        layout.addWidget(minutes, 0, 1)
+        layout.addWidget(QLabel('Backups to keep: '), 1, 0)
+        backups = QSpinBox()
+        backups.setRange(1, 1000)
+        backups.setValue(int(gSettings.value('AutosaveBackups', 10)))
+        layout.addWidget(backups, 1, 1)
+        ok = QPushButton('Ok')
+        ok.clicked.connect(diag.accept)
+        cancel = QPushButton('Cancel')
+        cancel.clicked.connect(diag.reject)
+        layout.addWidget(ok, 2, 0)
+        layout.addWidget(cancel, 2, 1)
+        diag.exec_()
+        if diag.result() != QDialog.Accepted:
+            return
+        gSettings.setValue('AutosaveMinutes', minutes.value())
+        gSettings.setValue('AutosaveBackups', backups.value())
+        self.__saveWorker.backupsToKeep = backups.value()
+        self.__startAutosave()
 
     def closeEvent(self, event):
         res = QMessageBox.question(self, 'Save before exit?', 'Do you want to save?', QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
@@ -444,7 +537,17 @@ class App(QMainWindowState):
             event.ignore()
             return
         if res == QMessageBox.Yes:
-            self.saveProject()
+            self.saveProject(announce=False)
+        self.__autosaveTimer.stop()
+        # don't exit halfway through writing a file, and don't exit when it failed
+        error = self.__saveWorker.wait()
+        if error is not None:
+            # the failed signal is still queued, don't report it twice
+            self.__reportedSaveError = error
+            QMessageBox.critical(self, 'Save failed', error)
+            self.__startAutosave()
+            event.ignore()
+            return
         super(App, self).hideEvent(event)
 
     def __setCurrentShot(self, *args):
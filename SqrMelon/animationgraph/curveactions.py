@@ -1,5 +1,5 @@
 from mathutil import Vec2
-from animationgraph.curvedata import Key
+from animationgraph.curvedata import Key, batchEdit
 from qtutil import *
 
 
@@ -55,25 +55,27 @@ class DragAction(QUndoCommand):
         """
         Revert key state.
         """
-        i = 0
-        for key in self.__selection:
-            key.setPoint(self.__restoreData[i])
-            i += 1
+        with batchEdit(key.parentCurve() for key in self.__selection):
+            i = 0
+            for key in self.__selection:
+                key.setPoint(self.__restoreData[i])
+                i += 1
 
     def _apply(self):
         """
         Set key state.
         """
-        i = 0
-        for key in self.__selection:
-            x = self.__restoreData[i][0] + self.__delta[0]
-            y = self.__restoreData[i][1] + self.__delta[1]
-            if self.__snap[0]:
-                x = round(x * self.__snap[0]) / float(self.__snap[0])
-            if self.__snap[1]:
-                y = round(y * self.__snap[1]) / float(self.__snap[1])
-            key.setPoint(Vec2(x, y))
-            i += 1
+        with batchEdit(key.parentCurve() for key in self.__selection):
+            i = 0
+            for key in self.__selection:
+                x = self.__restoreData[i][0] + self.__delta[0]
+                y = self.__restoreData[i][1] + self.__delta[1]
+                if self.__snap[0]:
+                    x = round(x * self.__snap[0]) / float(self.__snap[0])
+                if self.__snap[1]:
+                    y = round(y * self.__snap[1]) / float(self.__snap[1])
+                key.setPoint(Vec2(x, y))
+                i += 1
 
     def update(self, event):
         """
@@ -118,12 +120,14 @@ class DeleteAction(QUndoCommand):
         self.__selectionPerChannel = selectionPerChannel
 
     def redo(self):
-        for key in self.__selectionPerChannel:
-            key.delete()
+        with batchEdit(key.parentCurve() for key in self.__selectionPerChannel):
+            for key in self.__selectionPerChannel:
+                key.delete()
 
     def undo(self):
-        for key in self.__selectionPerChannel:
-            key.reInsert()
+        with batchEdit(key.parentCurve() for key in self.__selectionPerChannel):
+            for key in self.__selectionPerChannel:
+                key.reInsert()
 
 
 class InsertKeyAction(QUndoCommand):
@@ -140,12 +144,14 @@ class InsertKeyAction(QUndoCommand):
             self.__keys.append(k)
 
     def redo(self):
-        for key in self.__keys:
-            key.reInsert()
+        with batchEdit(key.parentCurve() for key in self.__keys):
+            for key in self.__keys:
+                key.reInsert()
 
     def undo(self):
-        for key in self.__keys:
-            key.delete()
+        with batchEdit(key.parentCurve() for key in self.__keys):
+            for key in self.__keys:
+                key.delete()
 
 
 class KeyChange(object):
@@ -246,9 +252,11 @@ class EditKeyAction(QUndoCommand):
             key.setValue(value)
 
     def redo(self):
-        for i, key in enumerate(self.__keys):
-            self.__set(key, self.__newValues[i])
+        with batchEdit(key.parentCurve() for key in self.__keys):
+            for i, key in enumerate(self.__keys):
+                self.__set(key, self.__newValues[i])
 
     def undo(self):
-        for i, key in enumerate(self.__keys):
-            self.__set(key, self.__oldValues[i])
+        with batchEdit(key.parentCurve() for key in self.__keys):
+            for i, key in enumerate(self.__keys):
+                self.__set(key, self.__oldValues[i])
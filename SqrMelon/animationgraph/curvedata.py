@@ -1,4 +1,7 @@
 from pycompat import *
+from bisect import bisect_right
+from contextlib import contextmanager
+import numpy
 from mathutil import Vec2
 
 
@@ -50,6 +53,7 @@ class Key(object):
         self.updateTangents()
 
     def updateTangents(self):
+        self.__parent.invalidate()
         if self.__tangentMode == Key.TANGENT_USER:
             return
         if self.__tangentMode == Key.TANGENT_STEPPED:
@@ -69,7 +73,7 @@ class Key(object):
 
     def setTime(self, time):
         self.__point.x = time
-        self.__parent.sortKeys()
+        self.__parent.keyTimeChanged(self)
 
     def value(self):
         return self.__point.y
@@ -83,8 +87,8 @@ class Key(object):
 
     def setPoint(self, point):
         self.__point = Vec2(point)
-        self.__parent.sortKeys()
-        self.__parent.keyChanged(self)
+        # also refreshes the tangents that depend on our value
+        self.__parent.keyTimeChanged(self)
 
     def delete(self):
         self.__parent.deleteKey(self)
@@ -96,13 +100,133 @@ class Key(object):
         return self.__parent
 
 
+class CompiledCurve(object):
+    """
+    Flat array representation of a Curve, optimized for evaluation.
+
+    Key times, values and tangents are stored as NumPy arrays, together with
+    the Hermite coefficients of every segment, so evaluating only needs a
+    bisect to find the segment and a polynomial evaluation.
+    The math is done in the same order as the original per-key evaluation,
+    so results are bit-identical.
+    """
+
+    def __init__(self, keys):
+        self.times = numpy.array([key.time() for key in keys], dtype=numpy.float64)
+        self.values = numpy.array([key.value() for key in keys], dtype=numpy.float64)
+        self.inTangents = numpy.array([key.inTangent.y for key in keys], dtype=numpy.float64)
+        self.outTangents = numpy.array([key.outTangent.y for key in keys], dtype=numpy.float64)
+
+        # per segment data, segment i goes from key i to key i + 1
+        p0 = self.values[:-1]
+        p3 = self.values[1:]
+        # stepped tangents hold the left key value, zero them out to avoid inf - inf warnings
+        self.stepped = self.outTangents[:-1] == float('inf')
+        p1 = numpy.where(self.stepped, 0.0, self.outTangents[:-1])
+        p2 = numpy.where(self.stepped, 0.0, self.inTangents[1:])
+        dy = p3 - p0
+        self.dx = self.times[1:] - self.times[:-1]
+        self.c0 = p1 + p2 - dy - dy
+        self.c1 = dy + dy + dy - p1 - p1 - p2
+        self.c2 = p1
+        self.c3 = p0
+
+        # python lists are a lot faster than numpy arrays for scalar lookups
+        self.__times = self.times.tolist()
+        self.__values = self.values.tolist()
+        self.__segments = [None if stepped else (x0, dx, c0, c1, c2, c3) for stepped, x0, dx, c0, c1, c2, c3 in
+                           zip(self.stepped.tolist(), self.__times, self.dx.tolist(),
+                               self.c0.tolist(), self.c1.tolist(), self.c2.tolist(), self.c3.tolist())]
+
+    def evaluate(self, time):
+        if not self.__times:
+            return 0.0
+
+        if time <= self.__times[0]:
+            return self.__values[0]
+
+        i = bisect_right(self.__times, time)
+        if i == len(self.__times):
+            return self.__values[-1]
+
+        segment = self.__segments[i - 1]
+        # stepped tangents
+        if segment is None:
+            return self.__values[i - 1]
+
+        x0, dx, c0, c1, c2, c3 = segment
+        t = (time - x0) / dx
+        return t * (t * (t * c0 + c1) + c2) + c3
+
+    def sampleMany(self, times):
+        """
+        Vectorized evaluate(), returns a float64 array with a value for each of the given times.
+        """
+        times = numpy.asarray(times, dtype=numpy.float64)
+        numKeys = len(self.times)
+        if numKeys == 0:
+            return numpy.zeros(times.shape, dtype=numpy.float64)
+        if numKeys == 1:
+            return numpy.full(times.shape, self.values[0], dtype=numpy.float64)
+
+        # same as bisect_right for every time, clamped to a valid segment
+        indices = numpy.searchsorted(self.times, times, side='right')
+        segments = numpy.clip(indices - 1, 0, numKeys - 2)
+
+        # out of range segments may divide by 0, but those are masked below
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t = (times - self.times[segments]) / self.dx[segments]
+            result = t * (t * (t * self.c0[segments] + self.c1[segments]) + self.c2[segments]) + self.c3[segments]
+
+        result = numpy.where(self.stepped[segments], self.values[segments], result)
+        result = numpy.where(indices >= numKeys, self.values[-1], result)
+        return numpy.where(times <= self.times[0], self.values[0], result)
+
+
+@contextmanager
+def batchEdit(curves):
+    """
+    Defer key sorting & tangent updates of all given curves until the end of the with-block.
+    """
+    curves = list(set(curves))
+    for curve in curves:
+        curve.beginBatchEdit()
+    try:
+        yield
+    finally:
+        for curve in curves:
+            curve.endBatchEdit()
+
+
 class Curve(object):
     """
     Animation data with Cubic Hermite Spline interpolation.
+
+    Evaluation goes through a CompiledCurve, which is rebuilt lazily
+    after keys were added, removed or changed.
+
+    Keys are kept sorted by time incrementally, an edited key is moved to its
+    new index and only the tangents of the keys around it are updated.
+    Use batchEdit() when changing many keys at once, this defers all
+    sorting and tangent updates until the end of the edit, where only the
+    keys around the edited keys, before and after sorting, are updated.
     """
 
+    # bumped whenever any curve changes, lets evaluation caches detect edits without comparing keys
+    __generation = 0
+
     def __init__(self):
         self.__keys = []
+        # index of every key, rebuilt on demand after the order of the keys changed
+        self.__indices = None
+        self.__compiled = None
+        self.__version = 0
+        self.__batchDepth = 0
+        # keys edited during a batch, keys that lost a neighbour & whether all keys need an update
+        self.__batchKeys = set()
+        self.__batchNeighbours = set()
+        self.__batchResort = False
+        self.__batchAll = False
         self.sortKeys()
 
     def clone(self):
@@ -119,12 +243,17 @@ class Curve(object):
                 return key
 
     def deleteKey(self, key):
-        idx = self.__keys.index(key)
+        idx = self.__indexOf(key)
         self.__keys.pop(idx)
-        if idx != 1 and len(self.__keys):
-            self.__keys[idx - 1].updateTangents()
-        if idx != len(self.__keys):
-            self.__keys[idx].updateTangents()
+        self.__indices = None
+        self.invalidate()
+        neighbours = self.__keys[max(0, idx - 1):idx + 1]
+        if self.__batchDepth:
+            self.__batchKeys.discard(key)
+            self.__batchNeighbours.update(neighbours)
+            return
+        for neighbour in neighbours:
+            neighbour.updateTangents()
 
     def addKeyWithTangents(self,
                            inTangentX, inTangentY,
@@ -132,8 +261,7 @@ class Curve(object):
                            outTangentX, outTangentY,
                            tangentBroken, tangentMode):
         k = Key(time, value, self)
-        self.__keys.append(k)
-        self.sortKeys()
+        self.reInsert(k)
         k.inTangent = Vec2(inTangentX, inTangentY)
         k.outTangent = Vec2(outTangentX, outTangentY)
         k.tangentBroken = tangentBroken
@@ -141,11 +269,46 @@ class Curve(object):
         return k
 
     def reInsert(self, key):
-        self.__keys.append(key)
-        self.sortKeys()
+        self.invalidate()
+        if self.__batchDepth:
+            self.__keys.append(key)
+            if self.__indices is not None:
+                self.__indices[key] = len(self.__keys) - 1
+            self.__batchKeys.add(key)
+            self.__batchResort = True
+            return
+        idx = self.__bisect(key.time())
+        self.__keys.insert(idx, key)
+        self.__indices = None
+        self.__updateTangentsAround(key)
+
+    def keyTimeChanged(self, key):
+        """
+        Move the given key to the right index after its time changed.
+        """
+        self.invalidate()
+        if self.__batchDepth:
+            self.__batchKeys.add(key)
+            self.__batchResort = True
+            return
+        idx = self.__indexOf(key)
+        # the keys around the old position lose a neighbour
+        oldNeighbours = []
+        if idx > 0:
+            oldNeighbours.append(self.__keys[idx - 1])
+        if idx < len(self.__keys) - 1:
+            oldNeighbours.append(self.__keys[idx + 1])
+        self.__keys.pop(idx)
+        self.__keys.insert(self.__bisect(key.time()), key)
+        self.__indices = None
+        self.__updateTangentsAround(key, oldNeighbours)
 
     def keyChanged(self, key):
-        idx = self.__keys.index(key)
+        self.invalidate()
+        if self.__batchDepth:
+            self.__batchKeys.add(key)
+            return
+        idx = self.__indexOf(key)
         first = idx == 0
         last = idx == len(self.__keys) - 1
 
@@ -156,7 +319,12 @@ class Curve(object):
             self.__keys[idx + 1].updateTangents()
 
     def updateTangents(self, key, mode):
-        idx = self.__keys.index(key)
+        self.invalidate()
+        if self.__batchDepth:
+            # keys may not be sorted, endBatchEdit() updates the key & its neighbours
+            self.__batchKeys.add(key)
+            return
+        idx = self.__indexOf(key)
         first = idx == 0
         last = idx == len(self.__keys) - 1
 
@@ -236,9 +404,126 @@ class Curve(object):
 
         assert False, 'Invalid tangent mode for key.'
 
+    def invalidate(self):
+        """
+        Discard the compiled curve, it is rebuilt on the next evaluate().
+        """
+        self.__compiled = None
+        Curve.__generation += 1
+        self.__version = Curve.__generation
+
+    @staticmethod
+    def generation():
+        """
+        A number that changes whenever any curve is edited.
+        """
+        return Curve.__generation
+
+    def version(self):
+        """
+        The generation of the last edit to this curve, unique among all curves.
+        """
+        return self.__version
+
+    def compiled(self):
+        """
+        :rtype: CompiledCurve
+        """
+        if self.__compiled is None:
+            self.__compiled = CompiledCurve(self.__keys)
+        return self.__compiled
+
+    def __bisect(self, time):
+        # bisect_right on the key times
+        lo, hi = 0, len(self.__keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if time < self.__keys[mid].time():
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def __indexMap(self):
+        if self.__indices is None:
+            self.__indices = dict((key, i) for i, key in enumerate(self.__keys))
+        return self.__indices
+
+    def __indexOf(self, key):
+        return self.__indexMap()[key]
+
+    def __neighbourhood(self, keys):
+        # the given keys that are in this curve & the keys next to them
+        indices = self.__indexMap()
+        result = set()
+        for key in keys:
+            idx = indices.get(key, None)
+            if idx is not None:
+                result.update(self.__keys[max(0, idx - 1):idx + 2])
+        return result
+
+    def __updateTangentsAround(self, key, extraKeys=()):
+        """
+        Tangents only depend on the direct neighbours of a key,
+        so after inserting or moving a key only these keys need an update.
+        """
+        idx = self.__indexOf(key)
+        keys = self.__keys[max(0, idx - 1):idx + 2]
+        for extraKey in extraKeys:
+            if extraKey not in keys:
+                keys.append(extraKey)
+        for dirtyKey in keys:
+            dirtyKey.updateTangents()
+
+    def beginBatchEdit(self):
+        self.__batchDepth += 1
+
+    def endBatchEdit(self):
+        assert self.__batchDepth > 0, 'endBatchEdit() called without beginBatchEdit()'
+        self.__batchDepth -= 1
+        if not self.__batchDepth:
+            self.__finishBatch()
+
+    def __finishBatch(self):
+        keys, self.__batchKeys = self.__batchKeys, set()
+        neighbours, self.__batchNeighbours = self.__batchNeighbours, set()
+        resort, self.__batchResort = self.__batchResort, False
+        updateAll, self.__batchAll = self.__batchAll, False
+        if updateAll:
+            self.sortKeys()
+            return
+        if resort:
+            # the keys are still in their order from before the edit, so these are the neighbours that lose a key
+            neighbours |= self.__neighbourhood(keys)
+            # nearly sorted, so this is close to linear
+            self.__keys.sort(key=lambda k: k.time())
+            self.__indices = None
+        # deleted keys may have been edited first
+        dirty = neighbours | self.__neighbourhood(keys)
+        indices = self.__indexMap()
+        dirty = [key for key in dirty if key in indices]
+        for key in dirty:
+            key.updateTangents()
+
+    @contextmanager
+    def batchEdit(self):
+        """
+        Defer key sorting & tangent updates until the end of the with-block.
+        """
+        self.beginBatchEdit()
+        try:
+            yield self
+        finally:
+            self.endBatchEdit()
+
     def sortKeys(self):
-        # TODO: optimize in any way?
+        self.invalidate()
+        if self.__batchDepth:
+            self.__batchAll = True
+            return
         self.__keys.sort(key=lambda k: k.time())
+        # carry the indices of the sort, so the tangent updates don't have to search for their key
+        self.__indices = dict((key, i) for i, key in enumerate(self.__keys))
         for key in self.__keys:
             key.updateTangents()
 
@@ -251,6 +536,8 @@ class Curve(object):
 
     def __setitem__(self, index, pos):
         self.__keys[index] = pos
+        self.__indices = None
+        self.invalidate()
 
     def __len__(self):
         return len(self.__keys)
@@ -259,19 +546,15 @@ class Curve(object):
         """
         Speed up the animation by the given multiplier.
         """
-        # reverse to avoid auto-sorting messing up anything
-        for key in reversed(self.__keys):
-            key.setTime(key.time() / speed)
+        with self.batchEdit():
+            for key in self.__keys:
+                key.setTime(key.time() / speed)
 
     def move(self, deltaTime):
         """
         Move the animation by the given addition.
         """
-        # shifting to the right, reverse application order to avoid auto-sorting messing up anything
-        if deltaTime > 0.0:
-            for key in reversed(self.__keys):
-                key.setTime(key.time() + deltaTime)
-        else:
+        with self.batchEdit():
             for key in self.__keys:
                 key.setTime(key.time() + deltaTime)
 
@@ -289,36 +572,19 @@ class Curve(object):
                 endIdx = i + 1
                 break
         self.__keys = self.__keys[max(startIdx, 0):min(endIdx, len(self.__keys))]
+        self.__indices = None
+        self.invalidate()
 
     def evaluate(self, time):
         """
         Hermite spline interpolation at the given time.
         Times outside the bounds are just clamped to the endpoints.
         """
-        if not self.__keys:
-            return 0.0
+        return self.compiled().evaluate(time)
 
-        if time <= self.__keys[0].time():
-            return self.__keys[0].value()
-
-        for i in range(1, len(self.__keys)):
-            if self.__keys[i].time() > time:
-                p0 = self.__keys[i - 1].point()
-                p1 = self.__keys[i - 1].outTangent.y
-                # stepped tangents
-                if p1 == float('inf'):
-                    return p0.y
-                p2 = self.__keys[i].inTangent.y
-                p3 = self.__keys[i].point()
-
-                dx = p3.x - p0.x
-                dy = p3.y - p0.y
-                c0 = (p1 + p2 - dy - dy)
-                c1 = (dy + dy + dy - p1 - p1 - p2)
-                c2 = p1
-                c3 = p0.y
-
-                t = (time - p0.x) / dx
-                return t * (t * (t * c0 + c1) + c2) + c3
-
-        return self.__keys[-1].value()
+    def sampleMany(self, times):
+        """
+        Evaluate the curve at a whole array of times at once.
+        Returns a NumPy array with the same values evaluate() would return.
+        """
+        return self.compiled().sampleMany(times)
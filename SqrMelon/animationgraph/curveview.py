@@ -7,6 +7,7 @@ import time
 import icons
 import functools
 import re
+import numpy
 from math import log10
 
 from util import gSettings
@@ -509,15 +510,13 @@ class CurveView(QWidget):
                 painter.setPen(self.__COLORS[identifier])
             else:
                 painter.setPen(Qt.red)
-            px, py = None, None
-            x = max(start, curve[0].time())
-            while x < min(end, curve[-1].time()):
-                y = curve.evaluate(x)
-                if py is not None:
-                    painter.drawLine(QPointF(px, py), QPointF(x, y))
-                px = x
-                py = y
-                x += precision
+            first = max(start, curve[0].time())
+            last = min(end, curve[-1].time())
+            if first >= last:
+                continue
+            xs = numpy.append(numpy.arange(first, last, precision), last)
+            ys = curve.sampleMany(xs)
+            painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs.tolist(), ys.tolist())]))
 
     def _drawKeys(self, painter, scaleX, scaleY, rows):
         # draw points
@@ -0,0 +1,111 @@
+"""
+Hosts a project's animationprocessor.py, which adjusts the evaluated uniforms before a frame is drawn.
+
+Scripts define an entry point that edits the uniforms in place:
+    def process(uniforms, camera, beats, scene):
+        uniforms['uV'] = ...
+camera is the scene.CameraTransform of the frame, scene the scene.Scene about to be drawn.
+
+Older scripts without a process function are plain code, run as a whole every frame like before.
+They used to run inside SceneView.paintGL and could reach its globals & locals, now they only get
+uniforms, cameraData, scene & beats. A script using anything else, such as textureUniforms, viewport or self,
+has to be ported to process().
+
+Either way the script is compiled once, and only reloaded after the project folder reports a change.
+A script that raises is skipped until it is saved again, its traceback is printed once.
+"""
+from pycompat import *
+import os
+import ast
+import traceback
+
+from fileutil import FileSystemWatcher
+
+SCRIPT_NAME = 'animationprocessor.py'
+ENTRY_POINT = 'process'
+
+
+class AnimationProcessor(object):
+    """
+    The compiled animationprocessor.py of a project directory, use get() to share one per project.
+    """
+    __cache = {}
+
+    def __init__(self, projectDirectory):
+        self.__path = projectDirectory.join(SCRIPT_NAME)
+        self.__dirty = True
+        # modification time & size of the loaded script
+        self.__stamp = None
+        self.__process = None
+        self.__code = None
+        # watch the folder as well to see the script being created, or replaced by an editor
+        self.__watcher = FileSystemWatcher()
+        self.__watcher.fileChanged.connect(self.__invalidate)
+        self.__watcher.directoryChanged.connect(self.__invalidate)
+        self.__watcher.addPath(projectDirectory)
+
+    @staticmethod
+    def get(projectDirectory):
+        """
+        :rtype: AnimationProcessor
+        """
+        key = str(projectDirectory)
+        if key not in AnimationProcessor.__cache:
+            AnimationProcessor.__cache[key] = AnimationProcessor(projectDirectory)
+        return AnimationProcessor.__cache[key]
+
+    def __invalidate(self, path):
+        self.__dirty = True
+
+    def __load(self):
+        self.__dirty = False
+        stamp = None
+        if self.__path.exists():
+            info = os.stat(self.__path)
+            stamp = info.st_mtime, info.st_size
+            self.__watcher.addPath(self.__path)
+        if stamp == self.__stamp:
+            # something else in the project folder changed
+            return
+        self.__stamp = stamp
+        self.__process = None
+        self.__code = None
+        if stamp is None:
+            return
+
+        try:
+            source = self.__path.content()
+            tree = compile(source, str(self.__path), 'exec', ast.PyCF_ONLY_AST)
+            code = compile(tree, str(self.__path), 'exec')
+            if any(isinstance(node, ast.FunctionDef) and node.name == ENTRY_POINT for node in tree.body):
+                namespace = {'__name__': 'animationprocessor', '__file__': str(self.__path)}
+                exec(code, namespace)
+                self.__process = namespace[ENTRY_POINT]
+            else:
+                self.__code = code
+        except Exception:
+            # skip the script until it is saved again, instead of failing every frame
+            traceback.print_exc()
+
+    def process(self, uniforms, camera, beats, scene):
+        """
+        Runs the script on the uniforms of a frame, which are edited in place.
+        Does nothing if the project has no animationprocessor.py.
+        """
+        if self.__dirty:
+            self.__load()
+        try:
+            if self.__process is not None:
+                self.__process(uniforms, camera, beats, scene)
+            elif self.__code is not None:
+                exec(self.__code, {'__name__': 'animationprocessor',
+                                   '__file__': str(self.__path),
+                                   'uniforms': uniforms,
+                                   'cameraData': camera,
+                                   'scene': scene,
+                                   'beats': beats})
+        except Exception:
+            # skip the script until it is saved again, instead of failing every frame
+            traceback.print_exc()
+            self.__process = None
+            self.__code = None
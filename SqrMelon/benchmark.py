@@ -0,0 +1,273 @@
+"""
+Render benchmark, times the playback hot paths of a project over a fixed set of timestamps.
+
+Measures:
+    evaluate    ShotManager.evaluate & additionalTextures, per call
+    snapshot    ShotManager.snapshot of all shots, what saving costs the GUI thread
+    load        first use of every scene the timestamps show, including shader compilation
+    rebuild     Scene._rebuild of every scene the timestamps show until all its programs are linked, per scene
+    draw        Scene.render up to glFinish, per frame
+    capture     rendering & reading back frames like the record tool, per frame
+
+Every captured frame is hashed so changes to the output are caught as well.
+The program binary cache is disabled so load & rebuild always time real shader compilation.
+Results are written as JSON, pass a previous result to --compare to see what changed.
+
+Uses software OpenGL by default so results do not depend on the GPU and run anywhere:
+    python benchmark.py defaultproject/New.p64 --output after.json --compare before.json
+"""
+from pycompat import *
+import os
+import sys
+import json
+import time
+import timeit
+import hashlib
+import platform
+import argparse
+
+DEFAULT_PROJECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'defaultproject', 'New.p64')
+FORMAT_VERSION = 2
+
+
+def _parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Benchmark rendering a SqrMelon project.')
+    parser.add_argument('project', nargs='?', default=DEFAULT_PROJECT, help='Path to the project file, defaults to the default project.')
+    parser.add_argument('--frames', type=int, default=16, help='Number of timestamps, spread evenly over the shots.')
+    parser.add_argument('--times', type=float, nargs='+', default=None, help='Explicit timestamps in beats instead of --frames.')
+    parser.add_argument('--repeat', type=int, default=5, help='Times to repeat every measurement.')
+    parser.add_argument('--height', type=int, default=270)
+    parser.add_argument('--width', type=int, default=None, help='Horizontal resolution, defaults to 16:9.')
+    parser.add_argument('--output', default='benchmark.json', help='File to write the results to.')
+    parser.add_argument('--compare', default=None, help='Results of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression.')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions, not just on changed images.')
+    parser.add_argument('--hardware', action='store_true', help='Use the GPU instead of software OpenGL.')
+    parser.add_argument('--platform', default=None, help='Qt platform plugin, defaults to offscreen.')
+    args = parser.parse_args(argv)
+    args.software = not args.hardware
+    return args
+
+
+def _statistics(samples):
+    ordered = sorted(samples)
+    return {'median': ordered[len(ordered) // 2],
+            'min': ordered[0],
+            'mean': sum(ordered) / len(ordered),
+            'samples': len(ordered)}
+
+
+def _timed(func, *args):
+    start = timeit.default_timer()
+    func(*args)
+    return timeit.default_timer() - start
+
+
+def _rebuildAll(scene):
+    # the shader pool would hand back the programs it linked before
+    from scene import gShaderPool
+    gShaderPool.clear()
+    start = timeit.default_timer()
+    scene._rebuild(None)
+    scene._pollPrograms(waitForAll=True)
+    return timeit.default_timer() - start
+
+
+def _glString(name):
+    from OpenGL.GL import glGetString
+    value = glGetString(name) or b''
+    if isinstance(value, bytes):
+        value = value.decode('utf8', 'replace')
+    return value
+
+
+def run(args):
+    """
+    Runs the benchmark, returns the results as a JSON serializable dict.
+    """
+    from qtutil import QApplication, QCoreApplication, Qt
+    from OpenGL.GL import glFinish, GL_VENDOR, GL_RENDERER, GL_VERSION
+    from fileutil import FilePath
+    from capture import PixelBufferRing
+    from renderer import OffscreenContext, HeadlessRenderer
+    from shots import ShotManager
+    from shadercache import gProgramBinaryCache
+
+    # a cache filled by an earlier run would skip the compiles we want to time
+    gProgramBinaryCache.enabled = False
+
+    if args.software:
+        QCoreApplication.setAttribute(Qt.AA_UseSoftwareOpenGL)
+    app = QApplication(sys.argv[:1])
+
+    renderer = HeadlessRenderer(FilePath(args.project).abs(), OffscreenContext())
+    width = args.width or (args.height * 16) // 9
+    height = args.height
+    times = args.times
+    if not times:
+        start, end = renderer.timeRange()
+        times = [start + (end - start) * (i + 0.5) / args.frames for i in range(args.frames)]
+
+    timings = {}
+
+    # the editor's shot evaluation, backed by the Qt item model
+    shotManager = ShotManager()
+    samples = []
+    for i in range(args.repeat):
+        for beats in times:
+            samples.append(_timed(shotManager.evaluate, beats) + _timed(shotManager.additionalTextures, beats))
+    timings['evaluate'] = _statistics(samples)
+
+    # saving only copies the shots on the GUI thread, the save worker writes them
+    samples = []
+    for i in range(args.repeat):
+        samples.append(_timed(shotManager.snapshot, False))
+    timings['snapshot'] = _statistics(samples)
+
+    # loading compiles the shaders of each scene
+    scenes = []
+    samples = []
+    for beats in times:
+        loadTime = timeit.default_timer()
+        frame = renderer.prepareFrame(beats, width, height)
+        loadTime = timeit.default_timer() - loadTime
+        if frame is not None and frame[0] not in scenes:
+            scenes.append(frame[0])
+            samples.append(loadTime)
+    if samples:
+        timings['load'] = _statistics(samples)
+
+    samples = []
+    for i in range(args.repeat):
+        for scene in scenes:
+            samples.append(_rebuildAll(scene))
+    if samples:
+        timings['rebuild'] = _statistics(samples)
+
+    # draw every frame once first, so static passes & driver warm up are not measured
+    for beats in times:
+        renderer.renderFrame(beats, width, height)
+    glFinish()
+
+    samples = []
+    for i in range(args.repeat):
+        for beats in times:
+            frame = renderer.prepareFrame(beats, width, height)
+            if frame is None:
+                continue
+            scene, uniforms, textures = frame
+            start = timeit.default_timer()
+            scene.render(renderer.beatsToSeconds(beats), beats, uniforms, textures)
+            glFinish()
+            samples.append(timeit.default_timer() - start)
+    if samples:
+        timings['draw'] = _statistics(samples)
+
+    samples = []
+    hashes = None
+    unstable = set()
+    for i in range(args.repeat):
+        frameHashes = {}
+        reader = PixelBufferRing(width, height)
+        start = timeit.default_timer()
+        finished = []
+        for index, beats in enumerate(times):
+            texture = renderer.renderFrame(beats, width, height)
+            if texture is not None:
+                finished += reader.read(texture, index)
+        finished += reader.flush()
+        samples.append((timeit.default_timer() - start) / len(times))
+        reader.delete()
+
+        for data, index in finished:
+            frameHashes[repr(times[index])] = hashlib.sha1(data).hexdigest()
+        if hashes is None:
+            hashes = frameHashes
+        else:
+            unstable |= set(key for key in hashes if hashes[key] != frameHashes.get(key))
+    timings['capture'] = _statistics(samples)
+
+    results = {'version': FORMAT_VERSION,
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'project': str(FilePath(args.project).abs()),
+               'settings': {'width': width, 'height': height, 'times': times, 'programCache': gProgramBinaryCache.enabled},
+               'repeat': args.repeat,
+               'environment': {'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'glVendor': _glString(GL_VENDOR),
+                               'glRenderer': _glString(GL_RENDERER),
+                               'glVersion': _glString(GL_VERSION)},
+               'timings': timings,
+               'hashes': hashes,
+               'unstableFrames': sorted(unstable)}
+    del app
+    return results
+
+
+def compare(previous, current, tolerance):
+    """
+    Prints the differences between two results.
+    Returns the names of the timings that regressed & the timestamps whose image changed,
+    or None when the results were not measured the same way.
+    """
+    if previous.get('version') != current['version'] or \
+            previous['settings'].get('programCache') != current['settings']['programCache']:
+        print('Results differ in format or program cache state, not comparing.')
+        return None
+    regressions = []
+    print('%-10s %12s %12s %8s' % ('', 'before (ms)', 'after (ms)', 'change'))
+    for name in sorted(current['timings']):
+        after = current['timings'][name]['median']
+        if name not in previous['timings']:
+            print('%-10s %12s %12.3f' % (name, '-', after * 1000.0))
+            continue
+        before = previous['timings'][name]['median']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('%-10s %12.3f %12.3f %+7.1f%%%s' % (name, before * 1000.0, after * 1000.0, change * 100.0, flag))
+
+    changedFrames = []
+    if previous['settings'] != current['settings'] or \
+            previous['environment']['glRenderer'] != current['environment']['glRenderer']:
+        print('Settings or renderer differ, not comparing images.')
+    else:
+        changedFrames = sorted(key for key in current['hashes'] if previous['hashes'].get(key) != current['hashes'][key])
+        for key in changedFrames:
+            print('Image at %s beats changed' % key)
+    return regressions, changedFrames
+
+
+def main(argv=None):
+    args = _parseArgs(sys.argv[1:] if argv is None else argv)
+    from headless import _setupEnvironment
+    _setupEnvironment(args)
+
+    results = run(args)
+
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=4, sort_keys=True)
+
+    for name in sorted(results['timings']):
+        stats = results['timings'][name]
+        print('%-10s median %9.3f ms, min %9.3f ms over %s samples' % (name, stats['median'] * 1000.0, stats['min'] * 1000.0, stats['samples']))
+    if results['unstableFrames']:
+        print('Output differs between repeats at: %s' % ', '.join(results['unstableFrames']))
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as fh:
+        previous = json.load(fh)
+    comparison = compare(previous, results, args.tolerance)
+    if comparison is None:
+        return 1
+    regressions, changedFrames = comparison
+    if changedFrames or (regressions and args.fail_on_regression):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
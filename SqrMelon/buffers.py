@@ -17,10 +17,27 @@ class Texture(object):
     """
 
     FORMAT_RGBA8_UNorm = QOpenGLTexture.RGBA8_UNorm
+    FORMAT_RGB10A2 = QOpenGLTexture.RGB10A2
+    FORMAT_RG11B10F = QOpenGLTexture.RG11B10F
+    FORMAT_R16F = QOpenGLTexture.R16F
+    FORMAT_RG16F = QOpenGLTexture.RG16F
+    FORMAT_RGBA16F = QOpenGLTexture.RGBA16F
     FORMAT_R32F = QOpenGLTexture.R32F
+    FORMAT_RG32F = QOpenGLTexture.RG32F
     FORMAT_RGBA32F = QOpenGLTexture.RGBA32F
     FORMAT_D32F = QOpenGLTexture.D32F
 
+    # color formats by the names templates use, see rendergraph.TARGET_FORMATS
+    FORMATS = {'rgba8': FORMAT_RGBA8_UNorm,
+               'rgb10a2': FORMAT_RGB10A2,
+               'r11g11b10f': FORMAT_RG11B10F,
+               'r16f': FORMAT_R16F,
+               'rg16f': FORMAT_RG16F,
+               'rgba16f': FORMAT_RGBA16F,
+               'r32f': FORMAT_R32F,
+               'rg32f': FORMAT_RG32F,
+               'rgba32f': FORMAT_RGBA32F}
+
 
     def __init__(self, format, width, height, tile=True, img=None):
         """
@@ -52,6 +69,9 @@ class Texture(object):
     def use(self):
         self._tex.bind()
 
+    def delete(self):
+        self._tex.destroy()
+
     def width(self):
         return self._width
 
@@ -122,6 +142,9 @@ class Texture3D(object):
     def id(self):
         return self._id
 
+    def delete(self):
+        glDeleteTextures(1, [self._id])
+
 
 class Cubemap(object):
 
@@ -202,6 +225,36 @@ class RenderBuffer(object):
         glBindRenderbuffer(GL_RENDERBUFFER, self.__id)
 
 
+class UniformBuffer(object):
+    """
+    Uniform buffer object of a fixed byte size.
+
+    Call upload() to replace the contents and bindBase() to expose it to every program using the binding point.
+    """
+
+    def __init__(self, size):
+        self.__id = glGenBuffers(1)
+        self.__size = size
+        self.use()
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+
+    def id(self):
+        return self.__id
+
+    def size(self):
+        return self.__size
+
+    def use(self):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.__id)
+
+    def upload(self, data):
+        self.use()
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.__size, data)
+
+    def bindBase(self, bindingPoint):
+        glBindBufferBase(GL_UNIFORM_BUFFER, bindingPoint, self.__id)
+
+
 class FrameBuffer(object):
     """
     Utility to set up a frame buffer and manage its color & render buffers.
@@ -245,6 +298,9 @@ class FrameBuffer(object):
     def id(self):
         return self.__id
 
+    def delete(self):
+        glDeleteFramebuffers(1, [self.__id])
+
     def addTexture(self, texture):
         # TODO: check if given texture has right channels (depth, rgba, depth-stencil), etc
         assert (texture.width() == self.__width)
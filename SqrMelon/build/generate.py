@@ -8,6 +8,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from build.codeoptimize import optimizeText
 from fileutil import FilePath
 from util import parseXMLWithIncludes, SCENE_EXT, currentScenesDirectory
+from channelio import readChannel
+from rendergraph import TARGET_FORMATS, DEFAULT_FORMAT
 
 gAnimEntriesMax = 0.0
 
@@ -107,7 +109,7 @@ class ShaderPool(object):
 
 
 class FrameBufferPool(object):
-    BLOCK_SIZE = 6
+    BLOCK_SIZE = 7
 
     def __init__(self):
         self.data = []
@@ -116,13 +118,19 @@ class FrameBufferPool(object):
     def hasData(self):
         return self.data
 
-    def add(self, index, numOutputs, width, height, factor, static, is3d):
+    def add(self, index, numOutputs, width, height, factor, static, is3d, format=None):
+        """
+        format is the name of the color format, passes without one use the format of the other passes drawing into the buffer.
+        """
         if index in self.keys:
             idx = self.keys.index(index)
-            assert self.data[idx] == (numOutputs, width, height, factor, static, is3d), '%s != %s' % (self.data[idx], (numOutputs, width, height, factor, static, is3d))
+            assert self.data[idx][:6] == (numOutputs, width, height, factor, static, is3d), '%s != %s' % (self.data[idx][:6], (numOutputs, width, height, factor, static, is3d))
+            if format is not None:
+                assert self.data[idx][6] in (None, format), '%s != %s' % (self.data[idx][6], format)
+                self.data[idx] = self.data[idx][:6] + (format,)
             return idx
         else:
-            self.data.append((numOutputs, width, height, factor, static, is3d))
+            self.data.append((numOutputs, width, height, factor, static, is3d, format))
             self.keys.append(index)
         return len(self.keys) - 1
 
@@ -131,18 +139,19 @@ class FrameBufferPool(object):
         cursor = 0
         for i, data in enumerate(self.data):
             if i == frameBuffer:
-                return cursor + localOutput, self.data[frameBuffer][-1]
+                return cursor + localOutput, self.data[frameBuffer][5]
             cursor += data[0]
 
     def serialize(self):
         allData = []
         totalTextures = 0
         for data in self.data:
-            numOutputs, width, height, factor, static, is3d = data
+            numOutputs, width, height, factor, static, is3d, format = data
+            internalFormat = TARGET_FORMATS[format or DEFAULT_FORMAT]
             if width <= 0 or height <= 0:
-                data = (numOutputs, 0, 0, factor, static, is3d)
+                data = (numOutputs, 0, 0, factor, static, is3d, internalFormat)
             else:
-                data = (numOutputs, width, height, factor, static, is3d)
+                data = (numOutputs, width, height, factor, static, is3d, internalFormat)
             allData += [int(x) for x in data]
             totalTextures += int(data[0])
 
@@ -178,7 +187,7 @@ class FrameBufferPool(object):
             yield '\t\t\tglBindTexture(GL_TEXTURE_2D, gTextures[textureCursor]);\n'
             yield '\t\t\tint w, h;\n'
             yield '\t\t\twidthHeight(i, width, height, w, h);\n'
-            yield '\t\t\tglTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, w, h, 0, GL_RGBA, GL_FLOAT, NULL);\n'
+            yield '\t\t\tglTexImage2D(GL_TEXTURE_2D, 0, gIntData[i * %s + %s], w, h, 0, GL_RGBA, GL_FLOAT, NULL);\n' % (FrameBufferPool.BLOCK_SIZE, gFrameBufferData + 6)
             yield '\t\t\tglTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR);\n'
             yield '\t\t\tglTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR);\n'
             yield '\t\t\tif(gIntData[i * %s + %s] == 0)\n\t\t\t{\n' % (FrameBufferPool.BLOCK_SIZE, gFrameBufferData + 4)
@@ -402,8 +411,12 @@ def run():
             factor = int(xPass.attrib.get('factor', 1))
             static = int(xPass.attrib.get('static', 0))
             is3d = int(xPass.attrib.get('is3d', 0))
+            format = xPass.attrib.get('format', None)
+            if format is not None:
+                format = format.lower()
+                assert format in TARGET_FORMATS, 'Unknown format "%s", expected one of: %s' % (format, ', '.join(sorted(TARGET_FORMATS)))
             if buffer != -1:
-                buffer = framebuffers.add(buffer, outputs, width, height, factor, static, is3d)
+                buffer = framebuffers.add(buffer, outputs, width, height, factor, static, is3d, format)
 
             i = 0
             key = 'input%s' % i
@@ -438,19 +451,12 @@ def run():
                 n = text.addString(n)
                 if n not in animations:
                     animations[n] = []
-                if not xChannel.text:
-                    keyframes = []
-                else:
-                    keyframes = []
-                    for i, v in enumerate(float(v.strip()) for v in xChannel.text.split(',')):
-                        j = i % 8
-                        if j == 0 or j == 4 or j > 5:
-                            continue
-                        if j == 5:  # out tangent y
-                            if v == float('inf'):  # stepped tangents are implemented as out tangentY = positive infinity
-                                v = 'FLT_MAX'
-                        keyframes.append(v)
-                    assert len(keyframes) / 4.0 == int(len(keyframes) / 4), len(keyframes)
+                keyframes = []
+                # in tangent y, time, value & out tangent y of every key
+                for key in readChannel(xChannel)[:, 1:6].tolist():
+                    if key[4] == float('inf'):  # stepped tangents are implemented as out tangentY = positive infinity
+                        key[4] = 'FLT_MAX'
+                    keyframes.extend((key[0], key[1], key[2], key[4]))
                 while len(animations[n]) <= x:
                     animations[n].append(None)
                 assert animations[n][x] is None
@@ -0,0 +1,338 @@
+"""
+Utilities to capture rendered frames without stalling the GPU.
+
+PixelBufferRing reads frames back asynchronously, FrameWriterPool encodes & writes them on worker threads.
+CaptureSink subclasses decide where the frames end up, use createCaptureSink to create one by name.
+"""
+from pycompat import *
+import ctypes
+import struct
+import threading
+import subprocess
+import multiprocessing
+from collections import deque, OrderedDict
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_1_0 import glGetTexImage as _glGetTexImageRaw
+from qtutil import QImage
+
+
+class PixelBufferRing(object):
+    """
+    Reads textures back through a ring of pixel buffer objects.
+
+    read() only queues the transfer of a texture into the next free buffer and returns the frames that were queued
+    len(ring) - 1 reads earlier, so the GPU keeps rendering new frames while older ones are copied out.
+    skip() queues a black frame instead, it comes out in order with the frames read before it.
+    """
+
+    def __init__(self, width, height, size=3, pixelType=GL_UNSIGNED_BYTE):
+        self.width = width
+        self.height = height
+        self.pixelType = pixelType
+        # rows are read tightly packed
+        self.bytesPerLine = width * 3 * (4 if pixelType == GL_FLOAT else 1)
+        self.__byteSize = self.bytesPerLine * height
+        ids = (GLuint * size)()
+        glGenBuffers(size, ids)
+        self.__free = list(ids)
+        self.__pending = deque()
+        for bufferId in self.__free:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, bufferId)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.__byteSize, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def read(self, texture, userData=None):
+        """
+        Queue reading the given texture.
+        Returns a list of (bytes, userData) for the frames that finished reading.
+        """
+        finished = self.__finishSkipped([])
+        if not self.__free:
+            finished.append(self.__map(*self.__pending.popleft()))
+            self.__finishSkipped(finished)
+        bufferId = self.__free.pop()
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, bufferId)
+        texture.use()
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        # with a pack buffer bound the pointer is an offset into the buffer
+        _glGetTexImageRaw(GL_TEXTURE_2D, 0, GL_RGB, self.pixelType, ctypes.c_void_p(0))
+        glPixelStorei(GL_PACK_ALIGNMENT, 4)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.__pending.append((bufferId, userData))
+        return finished
+
+    def skip(self, userData=None):
+        """
+        Queue a black frame, for times where nothing is drawn. Returns the frames that finished reading like read().
+        """
+        self.__pending.append((None, userData))
+        return self.__finishSkipped([])
+
+    def __finishSkipped(self, finished):
+        # black frames need no transfer, they are done once the frames before them are
+        while self.__pending and self.__pending[0][0] is None:
+            finished.append(self.__map(*self.__pending.popleft()))
+        return finished
+
+    def flush(self):
+        """
+        Wait for all queued reads, returns a list of (bytes, userData).
+        """
+        finished = []
+        while self.__pending:
+            finished.append(self.__map(*self.__pending.popleft()))
+        return finished
+
+    def __map(self, bufferId, userData):
+        if bufferId is None:
+            return b'\0' * self.__byteSize, userData
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, bufferId)
+        pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.__byteSize, GL_MAP_READ_BIT)
+        # copy out so the buffer can be reused while the frame is being encoded
+        data = ctypes.string_at(pointer, self.__byteSize)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.__free.append(bufferId)
+        return data, userData
+
+    def delete(self):
+        ids = self.__free + [bufferId for bufferId, userData in self.__pending if bufferId is not None]
+        glDeleteBuffers(len(ids), (GLuint * len(ids))(*ids))
+        self.__free = []
+        self.__pending.clear()
+
+
+class FrameWriterPool(object):
+    """
+    Calls the given write function on worker threads.
+
+    submit() blocks when maxPending frames are waiting, so a slow disk or encoder
+    can not make us buffer the entire capture in memory.
+    close() waits for all frames to be written and raises the first error a worker ran into.
+    """
+
+    def __init__(self, write, numThreads=None, maxPending=None):
+        numThreads = numThreads or multiprocessing.cpu_count()
+        self.__write = write
+        self.__queue = Queue(maxsize=maxPending or numThreads * 2)
+        self.__errors = []
+        self.__threads = []
+        for i in range(numThreads):
+            thread = threading.Thread(target=self.__work)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def __work(self):
+        while True:
+            args = self.__queue.get()
+            if args is None:
+                return
+            try:
+                self.__write(*args)
+            except Exception as e:
+                self.__errors.append(e)
+
+    def submit(self, *args):
+        if self.__errors:
+            raise self.__errors[0]
+        self.__queue.put(args)
+
+    def close(self):
+        for thread in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        if self.__errors:
+            raise self.__errors[0]
+
+
+def writeExr(path, width, height, data):
+    """
+    Writes an uncompressed RGB float OpenEXR file.
+    Data is 32 bit float RGB pixels, bottom row first like GL returns them.
+    """
+    # planar B, G, R rows from top to bottom
+    pixels = numpy.frombuffer(data, dtype=numpy.float32).reshape(height, width, 3)
+    rows = numpy.ascontiguousarray(pixels[::-1, :, ::-1].transpose(0, 2, 1))
+
+    def attribute(name, typeName, value):
+        return name.encode('ascii') + b'\0' + typeName.encode('ascii') + b'\0' + struct.pack('<i', len(value)) + value
+
+    channels = b''.join(name + b'\0' + struct.pack('<iB3xii', 2, 0, 1, 1) for name in (b'B', b'G', b'R')) + b'\0'
+    window = struct.pack('<4i', 0, 0, width - 1, height - 1)
+    header = b''.join((struct.pack('<ii', 20000630, 2),
+                       attribute('channels', 'chlist', channels),
+                       attribute('compression', 'compression', b'\0'),
+                       attribute('dataWindow', 'box2i', window),
+                       attribute('displayWindow', 'box2i', window),
+                       attribute('lineOrder', 'lineOrder', b'\0'),
+                       attribute('pixelAspectRatio', 'float', struct.pack('<f', 1.0)),
+                       attribute('screenWindowCenter', 'v2f', struct.pack('<2f', 0.0, 0.0)),
+                       attribute('screenWindowWidth', 'float', struct.pack('<f', 1.0)),
+                       b'\0'))
+
+    rowSize = width * 3 * 4
+    start = len(header) + height * 8
+    offsets = struct.pack('<%sQ' % height, *(start + y * (rowSize + 8) for y in range(height)))
+    with open(path, 'wb') as fh:
+        fh.write(header)
+        fh.write(offsets)
+        for y in range(height):
+            fh.write(struct.pack('<ii', y, rowSize))
+            fh.write(rows[y].tobytes())
+
+
+class CaptureSink(object):
+    """
+    Receives captured frames in order, as tightly packed RGB rows starting at the bottom of the image.
+    pixelType tells the reader whether to provide 8 bit or 32 bit float channels.
+    """
+    pixelType = GL_UNSIGNED_BYTE
+
+    def open(self, width, height, fps):
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+    def write(self, frame, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class ImageSequenceSink(CaptureSink):
+    """
+    Saves every frame as a numbered image in the given directory, encoding on worker threads.
+    """
+
+    def __init__(self, directory, ext='png', prefix='dump'):
+        self.directory = directory
+        self.ext = ext
+        self.prefix = prefix
+        self.__writer = None
+
+    def open(self, width, height, fps):
+        super(ImageSequenceSink, self).open(width, height, fps)
+        self.directory.ensureExists(isFolder=True)
+        self.__writer = FrameWriterPool(self._save)
+
+    def write(self, frame, data):
+        self.__writer.submit(self.directory.join('%s_%s_%05d.%s' % (self.prefix, self.fps, frame, self.ext)), data)
+
+    def _save(self, path, data):
+        QImage(data, self.width, self.height, self.width * 3, QImage.Format_RGB888).mirrored(False, True).save(path)
+
+    def close(self):
+        self.__writer.close()
+
+
+class ExrSequenceSink(ImageSequenceSink):
+    """
+    Saves every frame as an uncompressed floating point OpenEXR image.
+    """
+    pixelType = GL_FLOAT
+
+    def __init__(self, directory, prefix='dump'):
+        super(ExrSequenceSink, self).__init__(directory, 'exr', prefix)
+
+    def _save(self, path, data):
+        writeExr(path, self.width, self.height, data)
+
+
+class RawPipeSink(CaptureSink):
+    """
+    Streams raw frames into the stdin of an ffmpeg process, no intermediate files are written.
+    The audio file, if given, is muxed in, shifted by audioOffset seconds.
+    """
+
+    def __init__(self, outputPath, ffmpeg='ffmpeg', outputArgs=('-c:v', 'libx264', '-pix_fmt', 'yuv420p'),
+                 videoFilter='vflip', audioPath=None, audioOffset=0.0):
+        self.outputPath = outputPath
+        self.ffmpeg = ffmpeg
+        self.outputArgs = list(outputArgs)
+        self.videoFilter = videoFilter
+        self.audioPath = audioPath
+        self.audioOffset = audioOffset
+        self.__process = None
+        self.__writer = None
+
+    def command(self):
+        return self.__command(['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%sx%s' % (self.width, self.height),
+                               '-r', str(self.fps), '-i', '-'])
+
+    def concatCommand(self, listPath):
+        """
+        Command encoding the video segments listed in the given ffmpeg concat file to the output instead.
+        """
+        return self.__command(['-f', 'concat', '-safe', '0', '-i', listPath])
+
+    def __command(self, inputArgs):
+        command = [self.ffmpeg, '-y', '-loglevel', 'error'] + inputArgs
+        if self.audioPath:
+            command += ['-itsoffset', str(self.audioOffset), '-i', self.audioPath, '-shortest']
+        # GL rows start at the bottom
+        command += ['-vf', self.videoFilter] + self.outputArgs + [self.outputPath]
+        return command
+
+    def open(self, width, height, fps):
+        super(RawPipeSink, self).open(width, height, fps)
+        try:
+            self.__process = subprocess.Popen(self.command(), stdin=subprocess.PIPE)
+        except OSError as e:
+            # FileNotFoundError on python 3
+            raise RuntimeError('Could not start the encoder "%s", is ffmpeg installed? %s' % (self.ffmpeg, e))
+        # a single thread keeps the frames in order
+        self.__writer = FrameWriterPool(self.__process.stdin.write, numThreads=1)
+
+    def write(self, frame, data):
+        self.__writer.submit(data)
+
+    def close(self):
+        try:
+            self.__writer.close()
+        finally:
+            try:
+                self.__process.stdin.close()
+            except (IOError, OSError):
+                # the encoder quit early, its exit code says why
+                pass
+            returnCode = self.__process.wait()
+        if returnCode:
+            raise RuntimeError('Encoder exited with code %s: %s' % (returnCode, subprocess.list2cmdline(self.command())))
+
+
+GIF_FILTER = 'vflip,fps=12,scale=360:-1:flags=lanczos,split[a][b];[a]palettegen[p];[b][p]paletteuse'
+
+CAPTURE_SINKS = OrderedDict((
+    ('jpg', 'JPEG sequence'),
+    ('png', 'PNG sequence'),
+    ('exr', 'EXR sequence (float)'),
+    ('mp4', 'H.264 video (ffmpeg)'),
+    ('gif', 'GIF (ffmpeg)'),
+))
+
+
+def createCaptureSink(name, directory, ffmpeg='ffmpeg', audioPath=None, audioOffset=0.0):
+    """
+    Create a sink by its key in CAPTURE_SINKS, writing into the given directory.
+    Audio only applies to the video sinks.
+    """
+    if name in ('jpg', 'png'):
+        return ImageSequenceSink(directory, name)
+    if name == 'exr':
+        return ExrSequenceSink(directory)
+    if name == 'mp4':
+        return RawPipeSink(directory.join('capture.mp4'), ffmpeg, audioPath=audioPath, audioOffset=audioOffset)
+    if name == 'gif':
+        return RawPipeSink(directory.join('capture.gif'), ffmpeg, (), GIF_FILTER)
+    raise ValueError('Unknown capture sink "%s", expected one of: %s' % (name, ', '.join(CAPTURE_SINKS)))
@@ -0,0 +1,51 @@
+"""
+Reading & writing of animation channels in scene files.
+
+A channel stores 8 numbers per key:
+in tangent x & y, time, value, out tangent x & y, tangent broken & tangent mode.
+
+By default they are written as comma separated text. Projects with a ChannelEncoding attribute
+on their root element ("float32" or "float64") store them as base64 packed little endian floats instead,
+which is a lot faster to load & save for large projects. Both are always readable.
+"""
+import base64
+import numpy
+
+KEY_SIZE = 8
+TEXT_ENCODING = 'text'
+CHANNEL_ENCODINGS = {'float32': '<f4', 'float64': '<f8'}
+
+
+def readChannel(xChannel):
+    """
+    The keys of a Channel element as a float64 array of shape (numKeys, KEY_SIZE).
+    """
+    encoding = xChannel.attrib.get('encoding', TEXT_ENCODING)
+    text = (xChannel.text or '').strip()
+    if not text:
+        values = numpy.zeros(0, dtype=numpy.float64)
+    elif encoding == TEXT_ENCODING:
+        values = numpy.fromstring(text, dtype=numpy.float64, sep=',')
+    else:
+        values = numpy.frombuffer(base64.b64decode(text), dtype=CHANNEL_ENCODINGS[encoding]).astype(numpy.float64)
+    assert len(values) % KEY_SIZE == 0, 'Channel "%s" has incomplete keys.' % xChannel.attrib.get('name')
+    return values.reshape(-1, KEY_SIZE)
+
+
+def writeChannel(xChannel, keys, encoding=TEXT_ENCODING):
+    """
+    Stores keys, a sequence of KEY_SIZE tuples, as the text of a Channel element.
+    """
+    if encoding == TEXT_ENCODING:
+        data = []
+        for key in keys:
+            data.extend(str(value) for value in key[:6])
+            # tangent broken & mode are read back as integers
+            data.append(str(int(key[6])))
+            data.append(str(int(key[7])))
+        xChannel.text = ','.join(data)
+        return
+
+    xChannel.attrib['encoding'] = encoding
+    packed = numpy.asarray(keys, dtype=CHANNEL_ENCODINGS[encoding]).reshape(-1)
+    xChannel.text = base64.b64encode(packed.tobytes()).decode('ascii')
@@ -1,17 +1,19 @@
 import cgmath
+from math import tan
 
-r = cgmath.Mat44.rotateY(-cameraData.rotate[1]) * cgmath.Mat44.rotateX(cameraData.rotate[0]) * cgmath.Mat44.rotateZ(cameraData.rotate[2])
-uniforms['uV'] = r[:]
-uniforms['uV'][12:15] = cameraData.translate
 
-from math import tan
-tfov = tan(uniforms.get('uFovBias', 0.5))
-buf = scene.frameBuffers[scene.passes[-1].targetBufferId]
-bufferWidth = buf.width()
-bufferHeight = buf.height()
-ar = bufferWidth / float(bufferHeight)
-xfov = (tfov * ar)
-uniforms['uFrustum'] = (-xfov, -tfov, 1.0, 0.0,
-                        xfov, -tfov, 1.0, 0.0,
-                        -xfov, tfov, 1.0, 0.0,
-                        xfov, tfov, 1.0, 0.0)
+def process(uniforms, camera, beats, scene):
+    r = cgmath.Mat44.rotateY(-camera.rotate[1]) * cgmath.Mat44.rotateX(camera.rotate[0]) * cgmath.Mat44.rotateZ(camera.rotate[2])
+    uniforms['uV'] = r[:]
+    uniforms['uV'][12:15] = camera.translate
+
+    tfov = tan(uniforms.get('uFovBias', 0.5))
+    buf = scene.frameBuffers[scene.passes[-1].targetBufferId]
+    bufferWidth = buf.width()
+    bufferHeight = buf.height()
+    ar = bufferWidth / float(bufferHeight)
+    xfov = (tfov * ar)
+    uniforms['uFrustum'] = (-xfov, -tfov, 1.0, 0.0,
+                            xfov, -tfov, 1.0, 0.0,
+                            -xfov, tfov, 1.0, 0.0,
+                            xfov, tfov, 1.0, 0.0)
@@ -1,5 +1,5 @@
 from pycompat import *
-import os, stat
+import os, stat, tempfile
 from qtutil import *
 from contextlib import contextmanager
 
@@ -145,6 +145,34 @@ class FilePath(str):
         with self.open(flag) as fh:
             yield fh
 
+    @contextmanager
+    def atomicEdit(self, flag='w'):
+        """
+        Like edit, but writes to a temporary file that replaces this file once it is complete,
+        so an error halfway never leaves a truncated file behind.
+        Every call gets its own temporary file, so processes writing the same file at once don't mix their contents,
+        the last one to finish wins.
+        """
+        handle, tmp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(self) + '.', dir=os.path.dirname(os.path.abspath(self)))
+        try:
+            with os.fdopen(handle, flag) as fh:
+                yield fh
+            # mkstemp creates files only the owner can read
+            os.chmod(tmp, stat.S_IREAD | stat.S_IWRITE | stat.S_IRGRP | stat.S_IROTH)
+            if self.exists():
+                os.chmod(self, stat.S_IREAD | stat.S_IWRITE | stat.S_IRGRP | stat.S_IROTH)
+            try:
+                os.replace(tmp, self)
+            except AttributeError:
+                # python 2, rename does not overwrite on windows
+                if self.exists():
+                    os.remove(self)
+                os.rename(tmp, self)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
     def content(self):
         with self.open() as fh:
             return fh.read()
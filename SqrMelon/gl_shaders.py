@@ -37,9 +37,9 @@ def compileProgram(*shaders, **named):
     """
     program = glCreateProgram()
     if named.get('separable'):
-        glProgramParameteri( program, separate_shader_objects.GL_PROGRAM_SEPARABLE, GL_TRUE )
+        glProgramParameteri( program, GL_PROGRAM_SEPARABLE, GL_TRUE )
     if named.get('retrievable'):
-        glProgramParameteri( program, get_program_binary.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE )
+        glProgramParameteri( program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE )
     for shader in shaders:
         glAttachShader(program, shader)
     program = ShaderProgram( program )
@@ -50,3 +50,91 @@ def compileProgram(*shaders, **named):
     for shader in shaders:
         glDeleteShader(shader)
     return program
+
+
+try:
+    from OpenGL.GL.KHR.parallel_shader_compile import glInitParallelShaderCompileKHR, glMaxShaderCompilerThreadsKHR, \
+        GL_COMPLETION_STATUS_KHR
+except ImportError:
+    # PyOpenGL predates the extension
+    glInitParallelShaderCompileKHR = None
+
+_parallelCompile = None
+
+
+def parallelCompileSupported():
+    """Whether GL_KHR_parallel_shader_compile is available, requires a current context."""
+    global _parallelCompile
+    if _parallelCompile is None:
+        _parallelCompile = bool(glInitParallelShaderCompileKHR is not None and glInitParallelShaderCompileKHR())
+        if _parallelCompile:
+            # let the driver decide how many threads to use
+            glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+    return _parallelCompile
+
+
+class PendingProgram(object):
+    """Program submitted for compilation and linking without waiting for the result.
+    With GL_KHR_parallel_shader_compile the driver works in the background and
+    isReady() can be polled every frame. Without it the first status query blocks,
+    just like compileProgram.
+    Takes the same keywords as compileProgram.
+    """
+
+    def __init__(self, vertCode, fragCode, **named):
+        self.vertCode = vertCode
+        self.fragCode = fragCode
+        self.__named = named
+        self.__shaders = []
+        self.__program = glCreateProgram()
+        if named.get('separable'):
+            glProgramParameteri(self.__program, GL_PROGRAM_SEPARABLE, GL_TRUE)
+        if named.get('retrievable'):
+            glProgramParameteri(self.__program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        for code, shaderType in ((vertCode, GL_VERTEX_SHADER), (fragCode, GL_FRAGMENT_SHADER)):
+            shader = glCreateShader(shaderType)
+            glShaderSource(shader, code)
+            glCompileShader(shader)
+            glAttachShader(self.__program, shader)
+            self.__shaders.append((shader, code, shaderType))
+        glLinkProgram(self.__program)
+
+    def isReady(self):
+        if not parallelCompileSupported():
+            return True
+        status = (GLint * 1)()
+        glGetProgramiv(self.__program, GL_COMPLETION_STATUS_KHR, status)
+        return bool(status[0])
+
+    def result(self):
+        """Waits for the program to link and returns it.
+        raises RuntimeError with the same arguments as compileShader and compileProgram on failure.
+        """
+        try:
+            for shader, code, shaderType in self.__shaders:
+                status = glGetShaderiv(shader, GL_COMPILE_STATUS)
+                if status != GL_TRUE:
+                    raise RuntimeError(
+                        'Shader compile failure (%s): %s' % (status, glGetShaderInfoLog(shader)),
+                        [code.encode('utf8')],
+                        shaderType,
+                    )
+            program = ShaderProgram(self.__program)
+            if self.__named.get('validate', True):
+                program.check_validate()
+            program.check_linked()
+        except RuntimeError:
+            glDeleteProgram(self.__program)
+            raise
+        finally:
+            for shader, code, shaderType in self.__shaders:
+                glDeleteShader(shader)
+            self.__shaders = []
+        return program
+
+    def delete(self):
+        """Deletes the program without waiting for it, for a compile that is no longer needed."""
+        for shader, code, shaderType in self.__shaders:
+            glDeleteShader(shader)
+        self.__shaders = []
+        glDeleteProgram(self.__program)
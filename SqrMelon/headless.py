@@ -0,0 +1,105 @@
+"""
+Command line renderer, captures a project's shots without the editor UI.
+
+Renders on an offscreen OpenGL 4.1 context through the regular Scene pipeline,
+evaluating shots & the project's animationprocessor.py like the editor's record tool does.
+
+Example:
+    python headless.py ../defaultproject/defaultproject.p64 --start 0 --end 16 --height 360 --output png
+
+On machines without a GPU pass --software to use Mesa's llvmpipe (or opengl32sw on Windows).
+Long captures can be spread over multiple processes with --processes, see renderfarm.py.
+The Qt platform defaults to "offscreen", when Qt uses EGL or OSMesa for it
+PYOPENGL_PLATFORM should be set to match.
+"""
+from pycompat import *
+import os
+import sys
+import argparse
+
+
+def _parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Render a SqrMelon project without the editor.')
+    parser.add_argument('project', help='Path to the project file.')
+    parser.add_argument('--start', type=float, default=None, help='Start time in beats, defaults to the start of the first shot.')
+    parser.add_argument('--end', type=float, default=None, help='End time in beats, defaults to the end of the last shot.')
+    parser.add_argument('--seconds', action='store_true', help='Interpret --start and --end as seconds instead of beats.')
+    parser.add_argument('--height', type=int, default=720, help='Vertical resolution.')
+    parser.add_argument('--width', type=int, default=None, help='Horizontal resolution, defaults to 16:9.')
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--output', default='png', help='Capture sink: jpg, png, exr, mp4 or gif.')
+    parser.add_argument('--directory', default=None, help='Output directory, defaults to the capture folder of the project.')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg executable for the video outputs.')
+    parser.add_argument('--audio', default=None, help='Soundtrack to mux into video outputs.')
+    parser.add_argument('--software', action='store_true', help='Force software OpenGL.')
+    parser.add_argument('--platform', default=None, help='Qt platform plugin, defaults to offscreen.')
+    parser.add_argument('--processes', type=int, default=1, help='Render on this many worker processes, 0 uses one per core.')
+    parser.add_argument('--chunk-size', type=int, default=None, help='Frames per work item when rendering on multiple processes.')
+    parser.add_argument('--retries', type=int, default=2, help='Times to retry a failed work item.')
+    return parser.parse_args(argv)
+
+
+def _setupEnvironment(args):
+    # must happen before Qt and the GL library are loaded
+    if args.platform:
+        os.environ['QT_QPA_PLATFORM'] = args.platform
+    else:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    if args.software:
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+        os.environ.setdefault('GALLIUM_DRIVER', 'llvmpipe')
+
+
+def main(argv=None):
+    args = _parseArgs(sys.argv[1:] if argv is None else argv)
+    _setupEnvironment(args)
+
+    # imported here so the environment set up above is picked up
+    from qtutil import QApplication, QCoreApplication, Qt
+    from fileutil import FilePath
+    from capture import createCaptureSink
+    from renderer import OffscreenContext, ProjectTimeline, HeadlessRenderer
+    from renderfarm import RenderFarm
+
+    distributed = args.processes != 1
+    if args.software:
+        QCoreApplication.setAttribute(Qt.AA_UseSoftwareOpenGL)
+    app = QApplication(sys.argv[:1])
+
+    projectPath = FilePath(args.project).abs()
+    if distributed:
+        # the workers do the drawing
+        renderer = ProjectTimeline(projectPath)
+    else:
+        renderer = HeadlessRenderer(projectPath, OffscreenContext())
+    start, end = renderer.timeRange()
+    if args.start is not None:
+        start = renderer.secondsToBeats(args.start) if args.seconds else args.start
+    if args.end is not None:
+        end = renderer.secondsToBeats(args.end) if args.seconds else args.end
+    width = args.width or (args.height * 16) // 9
+
+    directory = FilePath(args.directory).abs() if args.directory else renderer.projectDirectory().join('capture')
+    directory.ensureExists(isFolder=True)
+    sink = createCaptureSink(args.output, directory, args.ffmpeg, args.audio, -renderer.beatsToSeconds(start))
+
+    if distributed:
+        def progress(chunk, numChunks):
+            sys.stdout.write('\rChunk %s / %s' % (chunk, numChunks))
+            sys.stdout.flush()
+
+        farm = RenderFarm(projectPath, args.processes or None, args.chunk_size, args.retries, args.software, args.platform)
+        farm.render(renderer, start, end, args.fps, width, args.height, sink, progress)
+    else:
+        def progress(frame, numFrames):
+            sys.stdout.write('\rFrame %s / %s' % (frame + 1, numFrames))
+            sys.stdout.flush()
+
+        renderer.renderRange(start, end, args.fps, width, args.height, sink, progress)
+    sys.stdout.write('\n')
+    del app
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
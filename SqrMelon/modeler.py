@@ -6,7 +6,7 @@ from OpenGL.GLU import *
 import cgmath
 import mathutil
 import math
-from util import toPrettyXml, currentProjectFilePath
+from util import currentProjectFilePath
 from xml.etree import cElementTree
 from projutil import parseXMLWithIncludes
 from xmlutil import vec3ToXmlAttrib, xmlAttribToVec3
@@ -874,26 +874,15 @@ class ModelerViewport(QOpenGLWidget):
             self.modifierModeChanged.emit(self._modifierMode)
             self.update()
 
-    def saveState(self):
-        # save user camera position per scene
-        userFile = currentProjectFilePath().ensureExt('user')
-        if userFile.exists():
-            xUser = parseXMLWithIncludes(userFile)
-        else:
-            xUser = cElementTree.Element('user')
-
-        xMod = xUser.find('Modeler')
-        if xMod is None:
-            xMod = cElementTree.SubElement(xUser, 'Modeler')
-
+    def stateAttributes(self):
+        """
+        The attributes of the Modeler element in the .user file.
+        """
+        attributes = {'CameraTransform': ','.join(map(str, self._cameraTransform[:])),
+                      'CameraPivot': ','.join(map(str, self._cameraPivot[:]))}
         if not self._currentModel is None:
-            xMod.set('CurrentModel', str(self._models.models.index(self._currentModel)))
-
-        xMod.set('CameraTransform', ','.join(map(str, self._cameraTransform[:])))
-        xMod.set('CameraPivot', ','.join(map(str, self._cameraPivot[:])))
-
-        with userFile.edit() as fh:
-            fh.write(toPrettyXml(xUser))
+            attributes['CurrentModel'] = str(self._models.models.index(self._currentModel))
+        return attributes
 
     def loadState(self):
         # save user camera position per scene
@@ -1,6 +1,6 @@
 import cgmath
 from qtutil import *
-from util import toPrettyXml, currentProjectFilePath
+from util import currentProjectFilePath
 from xml.etree import cElementTree
 from projutil import parseXMLWithIncludes
 from xmlutil import vec3ToXmlAttrib, xmlAttribToVec3
@@ -412,16 +412,14 @@ class Models(QObject):
         self._models.insert(self._models.index(originalModel) + 1, newModel)
         self.postModelAdded.emit(newModel)
 
-    def saveToProject(self):
-        project = currentProjectFilePath()
-        root = parseXMLWithIncludes(project)
-
-        xModels = cElementTree.SubElement(root, 'Models')
+    def snapshot(self):
+        """
+        The models as a detached 'Models' element, to store in the project file.
+        """
+        xModels = cElementTree.Element('Models')
         for model in self._models:
             model.saveToElementTree(xModels)
-
-        with project.edit() as fh:
-            fh.write(toPrettyXml(root))
+        return xModels
 
     def loadFromProject(self):
         # Clear all
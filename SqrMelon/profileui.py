@@ -27,10 +27,10 @@ class _ProfileRenderer(QWidget):
         cursor = 0.0
         self.tooltipinfo.clear()
         for i, entry in enumerate(self.scene.profileLog):
-            label, seconds = entry
-            text = '%s %ims' % (label, round(seconds * 1000.0))
+            label, seconds, cpuSeconds, median, p95 = entry
+            text = '%s %.1fms' % (label, seconds * 1000.0)
             rect = QRectF(cursor * scale, 0, seconds * scale, self.height())
-            self.tooltipinfo[text] = rect
+            self.tooltipinfo['%s\ncpu %.2fms\nmedian %.1fms\n95%% %.1fms' % (text, cpuSeconds * 1000.0, median * 1000.0, p95 * 1000.0)] = rect
             painter.setPen(Qt.NoPen)
             painter.setBrush(QColor.fromRgb(*randomColor(i * 0.1357111317)))
             painter.drawRect(rect)
@@ -0,0 +1,185 @@
+"""
+Writing projects to disk on a background thread.
+
+The GUI thread only copies what is saved into a ProjectSnapshot, see ShotManager.snapshot & Models.snapshot.
+A SaveWorker serializes & writes snapshots in the order they are submitted, so playback does not stall on saving.
+
+Autosaves write a complete snapshot into a timestamped folder under the project's .autosave folder instead,
+mirroring the project layout, and only the newest few of those are kept.
+"""
+from pycompat import *
+import os
+import time
+import shutil
+import threading
+import traceback
+from xml.etree import cElementTree
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from qtutil import *
+from fileutil import FilePath
+from shots import saveSceneShots, applyUserCameras
+from util import toPrettyXml, parseXMLWithIncludes
+
+AUTOSAVE_FOLDER = '.autosave'
+AUTOSAVE_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+
+class ProjectSnapshot(object):
+    """
+    Everything a save writes, copied on the GUI thread.
+    Given a backupDirectory the files are written there instead of over the project.
+    """
+
+    def __init__(self, projectPath, shots, timerAttributes, xModels, modelerAttributes, backupDirectory=None, announce=True):
+        self.projectPath = projectPath
+        # shots.ShotsSnapshot
+        self.shots = shots
+        # project root attributes, see Timer.projectAttributes
+        self.timerAttributes = timerAttributes
+        # detached Models element, see Models.snapshot
+        self.xModels = xModels
+        # see ModelerViewport.stateAttributes
+        self.modelerAttributes = modelerAttributes
+        self.backupDirectory = backupDirectory
+        # whether the user asked for this save & wants to hear back
+        self.announce = announce
+
+    def isBackup(self):
+        return self.backupDirectory is not None
+
+    def outputPath(self, path):
+        """
+        Where a file of the project is written to.
+        """
+        if self.backupDirectory is None:
+            return path
+        return self.backupDirectory.join(path.relativeTo(self.projectPath.parent()))
+
+
+def _writeXml(path, root):
+    path.parent().ensureExists(isFolder=True)
+    with path.atomicEdit() as fh:
+        fh.write(toPrettyXml(root))
+
+
+def writeProject(snapshot):
+    """
+    Writes the scenes, project file & .user file of a snapshot.
+    """
+    for sceneFile, sceneName, shots in snapshot.shots.scenes:
+        outputPath = snapshot.outputPath(sceneFile)
+        outputPath.parent().ensureExists(isFolder=True)
+        saveSceneShots(sceneFile, sceneName, shots, snapshot.shots.channelEncoding, outputPath)
+
+    # update the project in place, its root holds more settings than the ones we save
+    projectPath = snapshot.projectPath
+    text = projectPath.content() if projectPath.exists() else ''
+    xProject = cElementTree.fromstring(text) if text.strip() else cElementTree.Element('Project')
+    xProject.attrib.update(snapshot.timerAttributes)
+    for xModels in xProject.findall('Models'):
+        xProject.remove(xModels)
+    xProject.append(snapshot.xModels)
+    _writeXml(snapshot.outputPath(projectPath), xProject)
+
+    userFile = projectPath.ensureExt('user')
+    if userFile.exists():
+        xUser = parseXMLWithIncludes(userFile)
+        changed = snapshot.isBackup()
+    else:
+        xUser = cElementTree.Element('user')
+        changed = True
+    changed = applyUserCameras(xUser, snapshot.shots.cameras) or changed
+    xMod = xUser.find('Modeler')
+    if xMod is None:
+        xMod = cElementTree.SubElement(xUser, 'Modeler')
+    for key, value in snapshot.modelerAttributes.items():
+        if xMod.attrib.get(key, None) != value:
+            xMod.attrib[key] = value
+            changed = True
+    if changed:
+        _writeXml(snapshot.outputPath(userFile), xUser)
+
+
+def autosaveDirectory(projectPath):
+    """
+    Folder for a new autosave of the given project.
+    """
+    return projectPath.parent().join(AUTOSAVE_FOLDER, time.strftime(AUTOSAVE_TIME_FORMAT))
+
+
+def rotateBackups(projectPath, keep):
+    """
+    Deletes all but the newest keep autosaves of the given project.
+    """
+    folder = projectPath.parent().join(AUTOSAVE_FOLDER)
+    if not folder.exists():
+        return
+    # the timestamps sort chronologically
+    backups = sorted(name for name in os.listdir(folder) if os.path.isdir(folder.join(name)))
+    for name in backups[:max(0, len(backups) - keep)]:
+        shutil.rmtree(folder.join(name), ignore_errors=True)
+
+
+class SaveWorker(QObject):
+    """
+    Writes submitted snapshots on a background thread, one at a time.
+    saved & failed are emitted from that thread, connected slots on QObjects run on their own thread.
+    """
+    saved = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, backupsToKeep=10, parent=None):
+        super(SaveWorker, self).__init__(parent)
+        self.backupsToKeep = backupsToKeep
+        self.__queue = Queue()
+        self.__lock = threading.Lock()
+        self.__pending = 0
+        # traceback of the last failed write since wait() was called
+        self.__lastError = None
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def submit(self, snapshot):
+        with self.__lock:
+            self.__pending += 1
+        self.__queue.put(snapshot)
+
+    def isIdle(self):
+        with self.__lock:
+            return not self.__pending
+
+    def wait(self):
+        """
+        Blocks until all submitted snapshots are written.
+        Returns the traceback of the last write that failed since the previous wait(), or None.
+        failed is emitted for it as well, but its slots may never run if the event loop is done.
+        """
+        self.__queue.join()
+        with self.__lock:
+            error, self.__lastError = self.__lastError, None
+        return error
+
+    def __run(self):
+        while True:
+            snapshot = self.__queue.get()
+            try:
+                writeProject(snapshot)
+                if snapshot.isBackup():
+                    rotateBackups(snapshot.projectPath, self.backupsToKeep)
+            except Exception:
+                error = traceback.format_exc()
+                with self.__lock:
+                    self.__lastError = error
+                self.failed.emit(error)
+            else:
+                self.saved.emit(snapshot)
+            finally:
+                with self.__lock:
+                    self.__pending -= 1
+                self.__queue.task_done()
@@ -7,8 +7,13 @@ PROJ_EXT = '.p64'
 TEMPLATE_EXT = '.xml'
 SCENE_EXT = '.xml'
 
+# project of a process rendering without the editor, which must not change the project the editor opens next
+_projectOverride = None
+
 
 def currentProjectFilePath():
+    if _projectOverride is not None:
+        return _projectOverride
     if not gSettings.contains('currentproject'):
         return None
     return FilePath(gSettings.value('currentproject'))
@@ -18,6 +23,14 @@ def setCurrentProjectFilePath(value):
     gSettings.setValue('currentproject', str(value))
 
 
+def overrideCurrentProjectFilePath(value):
+    """
+    Makes value the current project of this process only, without storing it in the user settings.
+    """
+    global _projectOverride
+    _projectOverride = None if value is None else FilePath(value)
+
+
 def currentProjectDirectory():
     # AttributeError if no current project
     return currentProjectFilePath().parent()
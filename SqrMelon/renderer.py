@@ -0,0 +1,210 @@
+"""
+Rendering of project frames without the editor, see headless.py for the command line interface.
+"""
+from pycompat import *
+from xml.etree import cElementTree
+
+from qtutil import *
+from OpenGL.GL import *
+from animationhook import AnimationProcessor
+from capture import PixelBufferRing
+from fileutil import FilePath
+from models import Models
+from overlays import loadImage
+from scene import Scene, CameraTransform
+from shots import loadAllShots, ShotIndex
+from util import SCENE_EXT, overrideCurrentProjectFilePath, currentScenesDirectory
+
+
+class OffscreenContext(object):
+    """
+    OpenGL 4.1 core context on an offscreen surface.
+    Stands in for the SceneView, which Scene expects to be able to make current.
+    """
+
+    def __init__(self):
+        glFormat = QSurfaceFormat()
+        glFormat.setVersion(4, 1)
+        glFormat.setProfile(QSurfaceFormat.CoreProfile)
+        self.__surface = QOffscreenSurface()
+        self.__surface.setFormat(glFormat)
+        self.__surface.create()
+        self.__context = QOpenGLContext()
+        self.__context.setFormat(glFormat)
+        if not self.__context.create():
+            raise RuntimeError('Could not create an OpenGL 4.1 core context.')
+        self.makeCurrent()
+
+    def makeCurrent(self):
+        self.__context.makeCurrent(self.__surface)
+
+    def doneCurrent(self):
+        self.__context.doneCurrent()
+
+
+class ProjectTimeline(object):
+    """
+    The shots and tempo of a project, all that is needed to map a time range to frames without a GL context.
+    Makes the given project the current project of this process, the editor's current project is left alone.
+    """
+
+    def __init__(self, projectPath):
+        overrideCurrentProjectFilePath(projectPath)
+        self.__projectPath = projectPath
+        self.__beatsPerSecond = 2.0
+        xProject = cElementTree.fromstring(projectPath.content())
+        self.__beatsPerSecond = float(xProject.attrib.get('TimerBPS', self.__beatsPerSecond))
+        self.__shots = loadAllShots()
+        self.__shotIndex = ShotIndex(self.__shots)
+
+    def projectDirectory(self):
+        return self.__projectPath.parent()
+
+    def shots(self):
+        return self.__shots
+
+    def shotAtTime(self, beats):
+        """
+        :rtype: shots.Shot
+        """
+        return self.__shotIndex.shotAtTime(beats)
+
+    def secondsToBeats(self, seconds):
+        return seconds * self.__beatsPerSecond
+
+    def beatsToSeconds(self, beats):
+        return beats / self.__beatsPerSecond
+
+    def timeRange(self):
+        """
+        Start and end in beats spanning all enabled shots.
+        """
+        shots = [shot for shot in self.__shots if shot.enabled]
+        if not shots:
+            return 0.0, 0.0
+        return min(shot.start for shot in shots), max(shot.end for shot in shots)
+
+    def frameRange(self, start, end, fps):
+        """
+        Frame numbers covering the given range in beats, frame N is at N / fps seconds.
+        """
+        startFrame = int(self.beatsToSeconds(start) * fps)
+        return range(startFrame, startFrame + int(self.beatsToSeconds(end) * fps - startFrame))
+
+    def frameBeats(self, frame, fps):
+        return self.secondsToBeats(frame / float(fps))
+
+    def sceneFirstFrames(self, frames, fps):
+        """
+        Maps scene names to the first of the given frames that shows them.
+        """
+        firstFrames = {}
+        for frame in frames:
+            shot = self.shotAtTime(self.frameBeats(frame, fps))
+            if shot is not None and shot.sceneName not in firstFrames:
+                firstFrames[shot.sceneName] = frame
+        return firstFrames
+
+
+class HeadlessRenderer(ProjectTimeline):
+    """
+    Renders frames of a project: picks the shot, evaluates its curves, runs the project's animationprocessor.py
+    and draws the shot's scene, the same way the editor's record tool does.
+    """
+
+    def __init__(self, projectPath, context):
+        super(HeadlessRenderer, self).__init__(projectPath)
+        self.__context = context
+        Scene.sceneView = context
+        Scene.interactive = False
+
+        self.__models = Models()
+        self.__models.loadFromProject()
+        self.__processor = AnimationProcessor.get(self.projectDirectory())
+        # scenes that have drawn their static passes
+        self.__drawnScenes = set()
+
+        # the editor exposes these to every scene as well
+        self.__textures = {}
+        textureFolder = FilePath(__file__).join('..', 'Textures').abs()
+        if textureFolder.exists():
+            for texture in textureFolder.iter():
+                if texture.ext() in ('.png', '.bmp', '.tga'):
+                    self.__textures[texture.name()] = loadImage(textureFolder.join(texture))
+
+    def prepareFrame(self, beats, width, height):
+        """
+        Everything needed to draw the frame at the given time: the scene, sized to width & height,
+        its uniforms after running the animationprocessor.py & the shot textures.
+        Returns None if no shot is active.
+        """
+        shot = self.shotAtTime(beats)
+        if shot is None:
+            return None
+        self.__drawnScenes.add(shot.sceneName)
+        sceneFile = currentScenesDirectory().join(shot.sceneName).ensureExt(SCENE_EXT)
+        scene = Scene.getScene(sceneFile, self.__models)
+        scene.setSize(width, height)
+
+        uniforms = shot.evaluate(beats)
+        cameraData = CameraTransform(*(uniforms.get('uOrigin', [0.0, 0.0, 0.0]) + uniforms.get('uAngles', [0.0, 0.0, 0.0])))
+        self.__processor.process(uniforms, cameraData, beats, scene)
+
+        for name in self.__textures:
+            uniforms[name] = self.__textures[name]._id
+        return scene, uniforms, shot.textures
+
+    def renderFrame(self, beats, width, height):
+        """
+        Draws the frame at the given time, returns the texture holding the result or None if no shot is active.
+        """
+        frame = self.prepareFrame(beats, width, height)
+        if frame is None:
+            return None
+        scene, uniforms, textures = frame
+        if not scene.render(self.beatsToSeconds(beats), beats, uniforms, textures):
+            return None
+        return scene.colorBuffers[-1][0]
+
+    def renderFrames(self, frames, fps, width, height, sink, progress=None, warmupFrames=None):
+        """
+        Render the given frame numbers into an opened sink, frames without an active shot come out black.
+        progress is called with the index & count of frames.
+
+        Static passes are drawn only by the first frame a scene renders. When rendering part of a capture,
+        warmupFrames (see sceneFirstFrames) says which frame drew them in the full capture,
+        so they are drawn from that frame first and come out the same as in a single pass.
+        """
+        self.__context.makeCurrent()
+        reader = PixelBufferRing(width, height, pixelType=sink.pixelType)
+        frames = list(frames)
+        for i, frame in enumerate(frames):
+            if progress is not None:
+                progress(i, len(frames))
+            beats = self.frameBeats(frame, fps)
+            if warmupFrames:
+                shot = self.shotAtTime(beats)
+                if shot is not None and shot.sceneName not in self.__drawnScenes:
+                    warmupFrame = warmupFrames.get(shot.sceneName, frame)
+                    if warmupFrame != frame:
+                        self.renderFrame(self.frameBeats(warmupFrame, fps), width, height)
+            texture = self.renderFrame(beats, width, height)
+            if texture is None:
+                finished = reader.skip(frame)
+            else:
+                finished = reader.read(texture, frame)
+            for data, readFrame in finished:
+                sink.write(readFrame, data)
+        for data, readFrame in reader.flush():
+            sink.write(readFrame, data)
+        reader.delete()
+
+    def renderRange(self, start, end, fps, width, height, sink, progress=None):
+        """
+        Render a time range in beats into the given sink, opening & closing it.
+        """
+        sink.open(width, height, fps)
+        try:
+            self.renderFrames(self.frameRange(start, end, fps), fps, width, height, sink, progress)
+        finally:
+            sink.close()
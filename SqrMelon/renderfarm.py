@@ -0,0 +1,288 @@
+"""
+Renders a capture on several worker processes, each with its own offscreen GL context.
+
+The frames are split into chunks which are handed out to the workers as they become idle.
+A worker keeps its scenes, so shaders are compiled once per process, not once per chunk.
+Chunks that fail, or whose worker crashed, are retried on a fresh worker process.
+
+Image sequences are written by the workers directly. Video captures are rendered into lossless
+segments per chunk, which are encoded to the final output in order once all chunks are done.
+
+The workers run this file with --worker and receive their chunks as JSON lines on stdin.
+"""
+from pycompat import *
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import traceback
+import subprocess
+import multiprocessing
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# workers prefix their replies so driver or shader log output can not be mistaken for them
+_REPLY_PREFIX = '@@chunk'
+# lossless intermediate for video segments, flipped & encoded when stitching
+SEGMENT_EXT = '.mkv'
+SEGMENT_ARGS = ('-c:v', 'ffv1')
+
+
+class _Chunk(object):
+    def __init__(self, index, frames):
+        self.index = index
+        self.frames = frames
+        self.attempts = 0
+        self.error = None
+
+
+def splitFrames(frames, chunkSize):
+    """
+    Split a list of frame numbers into consecutive chunks of at most chunkSize frames.
+    """
+    return [frames[i:i + chunkSize] for i in range(0, len(frames), chunkSize)]
+
+
+class RenderFarm(object):
+    """
+    Renders frames of a project on numProcesses worker processes.
+    software & platform are passed on to the workers, see headless.py.
+    """
+
+    def __init__(self, projectPath, numProcesses=None, chunkSize=None, maxRetries=2, software=False, platform=None):
+        self.projectPath = projectPath
+        self.numProcesses = numProcesses or multiprocessing.cpu_count()
+        self.chunkSize = chunkSize
+        self.maxRetries = maxRetries
+        self.software = software
+        self.platform = platform
+        self.__lock = threading.Lock()
+        self.__queue = Queue()
+        self.__outstanding = 0
+
+    def __workerCommand(self):
+        command = [sys.executable, os.path.abspath(__file__), '--worker', str(self.projectPath)]
+        if self.software:
+            command.append('--software')
+        if self.platform:
+            command += ['--platform', self.platform]
+        return command
+
+    def render(self, timeline, start, end, fps, width, height, sink, progress=None):
+        """
+        Render a time range in beats into the given sink.
+        timeline is the renderer.ProjectTimeline of the project, used to divide the work.
+        progress is called with the number of finished & total chunks.
+        """
+        from capture import RawPipeSink
+
+        # frames without a shot come out black, so videos stay as long as the range and in sync with the audio
+        frames = list(timeline.frameRange(start, end, fps))
+        chunkSize = self.chunkSize or max(1, min(240, len(frames) // (self.numProcesses * 4)))
+        chunks = [_Chunk(index, chunkFrames) for index, chunkFrames in enumerate(splitFrames(frames, chunkSize))]
+        if not chunks:
+            return
+
+        task = {'fps': fps, 'width': width, 'height': height,
+                'warmup': timeline.sceneFirstFrames(frames, fps)}
+        segmentDirectory = None
+        if isinstance(sink, RawPipeSink):
+            segmentDirectory = tempfile.mkdtemp(prefix='sqrmelon_segments_')
+            task['ffmpeg'] = sink.ffmpeg
+            task['segments'] = segmentDirectory
+        else:
+            sink.directory.ensureExists(isFolder=True)
+            task['output'] = sink.ext
+            task['directory'] = str(sink.directory)
+
+        try:
+            self.__run(chunks, task, progress)
+            if segmentDirectory is not None:
+                self.__stitch(chunks, segmentDirectory, sink)
+        finally:
+            if segmentDirectory is not None:
+                shutil.rmtree(segmentDirectory, ignore_errors=True)
+
+    def __run(self, chunks, task, progress):
+        self.__outstanding = len(chunks)
+        for chunk in chunks:
+            self.__queue.put(chunk)
+
+        state = {'finished': 0}
+
+        def onFinished():
+            with self.__lock:
+                state['finished'] += 1
+                if progress is not None:
+                    progress(state['finished'], len(chunks))
+
+        threads = []
+        for i in range(min(self.numProcesses, len(chunks))):
+            thread = threading.Thread(target=self.__serve, args=(task, onFinished))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        failed = [chunk for chunk in chunks if chunk.error is not None]
+        if failed:
+            raise RuntimeError('%s chunk(s) failed to render, first error:\n%s' % (len(failed), failed[0].error))
+
+    def __nextChunk(self):
+        # retries are queued again while other workers are still busy, so only stop when nothing is outstanding
+        while True:
+            try:
+                return self.__queue.get(timeout=0.1)
+            except Empty:
+                with self.__lock:
+                    if not self.__outstanding:
+                        return None
+
+    def __serve(self, task, onFinished):
+        process = None
+        while True:
+            chunk = self.__nextChunk()
+            if chunk is None:
+                break
+            if process is None:
+                process = subprocess.Popen(self.__workerCommand(), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                           universal_newlines=True, bufsize=1)
+
+            error = self.__renderChunk(process, chunk, task)
+            if error is None:
+                with self.__lock:
+                    self.__outstanding -= 1
+                onFinished()
+                continue
+
+            # start over with a clean process, the GL state of this one can not be trusted anymore
+            self.__stop(process, kill=True)
+            process = None
+            chunk.attempts += 1
+            if chunk.attempts > self.maxRetries:
+                chunk.error = error
+                with self.__lock:
+                    self.__outstanding -= 1
+                continue
+            self.__queue.put(chunk)
+
+        if process is not None:
+            self.__stop(process)
+
+    @staticmethod
+    def __renderChunk(process, chunk, task):
+        """
+        Returns None on success or a description of the error.
+        """
+        message = dict(task)
+        message['index'] = chunk.index
+        message['frames'] = chunk.frames
+        try:
+            process.stdin.write(json.dumps(message) + '\n')
+            process.stdin.flush()
+        except (IOError, OSError):
+            return 'Worker exited with code %s' % process.poll()
+
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                return 'Worker exited with code %s' % process.wait()
+            if not line.startswith(_REPLY_PREFIX):
+                # worker logging
+                sys.stderr.write(line)
+                continue
+            reply = json.loads(line[len(_REPLY_PREFIX):])
+            if reply['index'] == chunk.index:
+                return reply.get('error', None)
+
+    @staticmethod
+    def __stop(process, kill=False):
+        if kill:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        else:
+            try:
+                process.stdin.close()
+            except (IOError, OSError):
+                pass
+        process.wait()
+
+    @staticmethod
+    def __stitch(chunks, segmentDirectory, sink):
+        listPath = os.path.join(segmentDirectory, 'segments.txt')
+        with open(listPath, 'w') as fh:
+            for chunk in chunks:
+                segment = _segmentPath(segmentDirectory, chunk.index)
+                fh.write("file '%s'\n" % segment.replace('\\', '/').replace("'", "'\\''"))
+        command = sink.concatCommand(listPath)
+        returnCode = subprocess.call(command)
+        if returnCode:
+            raise RuntimeError('Encoder exited with code %s: %s' % (returnCode, subprocess.list2cmdline(command)))
+
+
+def _segmentPath(segmentDirectory, index):
+    return os.path.join(segmentDirectory, 'segment_%05d%s' % (index, SEGMENT_EXT))
+
+
+def _reply(index, error=None):
+    reply = {'index': index}
+    if error is not None:
+        reply['error'] = error
+    sys.stdout.write(_REPLY_PREFIX + json.dumps(reply) + '\n')
+    sys.stdout.flush()
+
+
+def _workerMain(argv):
+    import argparse
+    from headless import _setupEnvironment
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('project')
+    parser.add_argument('--software', action='store_true')
+    parser.add_argument('--platform', default=None)
+    args = parser.parse_args(argv)
+    _setupEnvironment(args)
+
+    from qtutil import QApplication, QCoreApplication, Qt
+    from fileutil import FilePath
+    from capture import createCaptureSink, RawPipeSink
+    from renderer import OffscreenContext, HeadlessRenderer
+
+    if args.software:
+        QCoreApplication.setAttribute(Qt.AA_UseSoftwareOpenGL)
+    app = QApplication(sys.argv[:1])
+    renderer = HeadlessRenderer(FilePath(args.project).abs(), OffscreenContext())
+
+    for line in iter(sys.stdin.readline, ''):
+        task = json.loads(line)
+        if 'segments' in task:
+            sink = RawPipeSink(_segmentPath(task['segments'], task['index']), task['ffmpeg'], SEGMENT_ARGS, 'null')
+        else:
+            sink = createCaptureSink(task['output'], FilePath(task['directory']))
+        try:
+            sink.open(task['width'], task['height'], task['fps'])
+            try:
+                renderer.renderFrames(task['frames'], task['fps'], task['width'], task['height'], sink,
+                                      warmupFrames=task['warmup'])
+            finally:
+                sink.close()
+        except Exception:
+            _reply(task['index'], traceback.format_exc())
+            continue
+        _reply(task['index'])
+
+    del app
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_workerMain(sys.argv[1:]))
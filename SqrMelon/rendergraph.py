@@ -0,0 +1,235 @@
+"""
+Compiles the passes of a template into the order they are drawn in & the frame buffers they need.
+
+Buffers are addressed the way Scene always did: the n-th buffer gets the n-th entry of the buffer metadata
+and a target buffer id of -1 draws into the last buffer, which is also what gets captured.
+
+Culling: only passes whose output can reach the displayed buffer are drawn. Liveness does not look at
+the order within a frame, so buffers read before they are written (feedback from the previous frame) keep
+their writers alive too.
+
+Aliasing: a transient buffer, one that is written & then only read within the same frame, shares its frame buffer
+with other transient buffers of the same size, format & layout whose lifetimes do not overlap. A buffer that shares
+its frame buffer is cleared by the first pass drawing into it each frame, so no other buffer's content leaks through.
+Buffers that are displayed, drawn by static, 3D or drawcommand passes, or read before they are written, are never shared.
+"""
+from collections import OrderedDict
+
+# color formats a pass can ask for with its format attribute, as OpenGL internal formats
+TARGET_FORMATS = {'rgba8': 0x8058,
+                  'rgb10a2': 0x8059,
+                  'r11g11b10f': 0x8C3A,
+                  'r16f': 0x822D,
+                  'rg16f': 0x822F,
+                  'rgba16f': 0x881A,
+                  'r32f': 0x822E,
+                  'rg32f': 0x8230,
+                  'rgba32f': 0x8814}
+DEFAULT_FORMAT = 'rgba32f'
+
+
+def composeBuffers(passes):
+    """
+    Buffer metadata from the passes, a list of (numOutputBuffers, downSampleFactor, resolution, tile, format, depth).
+    All passes drawing into a buffer must agree on its format, passes without one use the format of the others.
+    A buffer has a depth attachment unless all passes drawing into it opt out.
+    """
+    numBuffers = -1
+    bufferData = OrderedDict()
+    for passData in passes:
+        if passData.targetBufferId not in bufferData:
+            bufferData[passData.targetBufferId] = passData.numOutputBuffers, passData.downSampleFactor, passData.resolution, \
+                                                  passData.tile, passData.format, passData.depth
+        else:
+            numOutputBuffers, downSampleFactor, resolution, tile, format, depth = bufferData[passData.targetBufferId]
+
+            numOutputBuffers = max(numOutputBuffers, passData.numOutputBuffers)
+
+            if passData.downSampleFactor is not None:
+                if downSampleFactor is not None:
+                    assert passData.downSampleFactor == downSampleFactor
+                else:
+                    downSampleFactor = passData.downSampleFactor
+
+            if passData.resolution is not None:
+                if downSampleFactor is not None:
+                    assert passData.resolution == resolution
+                else:
+                    resolution = passData.resolution
+
+            if passData.format is not None:
+                if format is not None:
+                    assert passData.format == format, 'Passes drawing into the same buffer use different formats.'
+                else:
+                    format = passData.format
+
+            depth = depth or passData.depth
+
+            bufferData[passData.targetBufferId] = numOutputBuffers, downSampleFactor, resolution, tile, format, depth
+
+        numBuffers = max(passData.targetBufferId, numBuffers)
+    numBuffers += 2
+    bufferData[numBuffers - 1] = 1, 1, None, False, None, True
+    return [(numOutputBuffers, downSampleFactor, resolution, tile, format or DEFAULT_FORMAT, depth)
+            for numOutputBuffers, downSampleFactor, resolution, tile, format, depth in bufferData.values()]
+
+
+def bufferSize(descriptor, width, height):
+    """
+    Size of a buffer with the given metadata, for a scene of the given size.
+    """
+    downSampleFactor, resolution = descriptor[1:3]
+    if resolution is not None:
+        width, height = resolution
+    elif downSampleFactor is not None:
+        width, height = width // downSampleFactor, height // downSampleFactor
+    return max(1, width), max(1, height)
+
+
+def _aliasKey(descriptor):
+    # descriptors that always result in the same size & layout
+    numOutputBuffers, downSampleFactor, resolution, tile, format, depth = descriptor
+    if resolution is not None:
+        return numOutputBuffers, tuple(resolution), None, tile, format, depth
+    return numOutputBuffers, None, downSampleFactor or 1, tile, format, depth
+
+
+class RenderGraph(object):
+    """
+    Drawing order & buffer allocation of a list of scene.PassData.
+    """
+
+    def __init__(self, passes):
+        self.__passes = passes
+        self.buffers = composeBuffers(passes)
+        # buffers each pass writes & reads, resolved the same way as indexing the buffer lists
+        self.__targets = [self.__bufferIndex(passData.targetBufferId) for passData in passes]
+        self.__inputs = [[self.__bufferIndex(inpt[0]) for inpt in passData.inputBufferIds if isinstance(inpt, tuple)]
+                         for passData in passes]
+        self.__schedules = {}
+        self.allocation, self.__shared = self.__alias()
+        self.__retained = self.__retainedBuffers()
+
+    def __bufferIndex(self, bufferId):
+        if bufferId < 0:
+            return len(self.buffers) + bufferId
+        return bufferId
+
+    def outputBuffers(self):
+        """
+        Buffers displayed or captured after a full frame.
+        """
+        outputs = {len(self.buffers) - 1}
+        if self.__passes:
+            outputs.add(self.__targets[-1])
+        return outputs
+
+    def __alias(self):
+        """
+        Returns the frame buffer slot of every buffer & the set of buffers that share their slot.
+        """
+        numBuffers = len(self.buffers)
+        persistent = self.outputBuffers()
+        firstWrite = {}
+        lastUse = {}
+        for i, passData in enumerate(self.__passes):
+            target = self.__targets[i]
+            for inputIndex in self.__inputs[i]:
+                if inputIndex not in firstWrite:
+                    # read before written, holds the previous frame
+                    persistent.add(inputIndex)
+                lastUse[inputIndex] = i
+            if not passData.realtime or passData.is3d or passData.drawCommand is not None:
+                persistent.add(target)
+            firstWrite.setdefault(target, i)
+            lastUse[target] = i
+
+        allocation = [None] * numBuffers
+        slots = []
+        transient = sorted((firstWrite[index], index) for index in firstWrite
+                           if index not in persistent and 0 <= index < numBuffers)
+        # lifetime end & alias key of every shared slot
+        openSlots = []
+        for start, index in transient:
+            key = _aliasKey(self.buffers[index])
+            for slotInfo in openSlots:
+                if slotInfo[1] == key and slotInfo[0] < start:
+                    slotInfo[0] = lastUse[index]
+                    allocation[index] = slotInfo[2]
+                    slots[slotInfo[2]].append(index)
+                    break
+            else:
+                allocation[index] = len(slots)
+                openSlots.append([lastUse[index], key, len(slots)])
+                slots.append([index])
+
+        for index in range(numBuffers):
+            if allocation[index] is None:
+                allocation[index] = len(slots)
+                slots.append([index])
+
+        shared = set()
+        for members in slots:
+            if len(members) > 1:
+                shared.update(members)
+        return allocation, shared
+
+    def __retainedBuffers(self):
+        # see retainedSlots
+        retained = set()
+        written = set()
+        for i, passData in enumerate(self.__passes):
+            retained.update(inputIndex for inputIndex in self.__inputs[i] if inputIndex not in written)
+            if not passData.realtime or passData.is3d:
+                retained.add(self.__targets[i])
+            written.add(self.__targets[i])
+        return retained
+
+    def retainedSlots(self):
+        """
+        Frame buffer slots whose content outlives a frame: drawn by static or 3D passes, or read before they are written.
+        These are never shared, all other slots are drawn again every frame.
+        """
+        return set(self.allocation[index] for index in self.__retained if 0 <= index < len(self.allocation))
+
+    def numSlots(self):
+        return max(self.allocation) + 1 if self.allocation else 0
+
+    def schedule(self, debugPassId=None):
+        """
+        The passes to draw, in order, as (pass index, clear) tuples. When clear is set the pass
+        draws first into a shared buffer this frame and must clear it.
+        With a debug pass only the passes leading up to it are drawn.
+        """
+        if debugPassId in self.__schedules:
+            return self.__schedules[debugPassId]
+
+        if debugPassId is None:
+            lastPass = len(self.__passes) - 1
+            needed = self.outputBuffers()
+        else:
+            lastPass = debugPassId
+            needed = {self.__targets[debugPassId]}
+
+        live = set()
+        changed = True
+        while changed:
+            changed = False
+            for i in range(lastPass, -1, -1):
+                if i in live or self.__targets[i] not in needed:
+                    continue
+                live.add(i)
+                needed.update(self.__inputs[i])
+                changed = True
+
+        result = []
+        cleared = set()
+        for i in range(lastPass + 1):
+            if i not in live:
+                continue
+            target = self.__targets[i]
+            clear = target in self.__shared and target not in cleared
+            cleared.add(target)
+            result.append((i, clear))
+        self.__schedules[debugPassId] = result
+        return result
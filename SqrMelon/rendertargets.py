@@ -0,0 +1,132 @@
+"""
+Render targets shared by all scenes.
+
+A render target is a frame buffer with its color & depth textures. Scenes acquire one for every frame buffer
+they draw into (see Scene.setSize) and release them when they are resized or no longer shown,
+so resizing back & forth or switching between scenes reuses textures instead of allocating new ones.
+
+Released targets are kept until more than maxUnusedBytes of them are unused, then the least recently released go.
+"""
+from pycompat import *
+from collections import OrderedDict
+from OpenGL.GL import *
+from OpenGL.GL.EXT import texture_filter_anisotropic
+from buffers import FrameBuffer, Texture
+
+# bytes per pixel of the color formats in rendergraph.TARGET_FORMATS
+FORMAT_BYTES = {'rgba8': 4,
+                'rgb10a2': 4,
+                'r11g11b10f': 4,
+                'r16f': 2,
+                'rg16f': 4,
+                'rgba16f': 8,
+                'r32f': 4,
+                'rg32f': 8,
+                'rgba32f': 16}
+DEPTH_BYTES = 4
+
+
+class RenderTarget(object):
+    """
+    A frame buffer & its textures, key is (width, height, numOutputBuffers, format, tile, depth).
+    """
+
+    def __init__(self, key):
+        self.key = key
+        # handed out by the pool & not released yet
+        self.inUse = False
+        width, height, numOutputBuffers, format, tile, depth = key
+        self.frameBuffer = FrameBuffer(width, height)
+        self.depthBuffer = None
+        if depth:
+            self.depthBuffer = Texture(Texture.FORMAT_D32F, width, height)
+            self.frameBuffer.initDepth(self.depthBuffer)
+        self.colorBuffers = []
+        for i in range(numOutputBuffers):
+            self.colorBuffers.append(Texture(Texture.FORMATS[format], width, height, tile=tile))
+            self.frameBuffer.addTexture(self.colorBuffers[-1])
+        # static passes turn on mip mapping, users after them expect the initial filtering
+        self.colorBuffers[0].use()
+        self.__filters = glGetTexParameteriv(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER), glGetTexParameteriv(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER)
+
+    def byteSize(self):
+        width, height, numOutputBuffers, format, tile, depth = self.key
+        return width * height * (numOutputBuffers * FORMAT_BYTES[format] + (DEPTH_BYTES if depth else 0))
+
+    def reset(self):
+        """
+        Restores filtering & clears the contents, so a reused target is indistinguishable from a new one.
+        """
+        for texture in self.colorBuffers:
+            texture.use()
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, self.__filters[0])
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, self.__filters[1])
+            glTexParameterf(GL_TEXTURE_2D, texture_filter_anisotropic.GL_TEXTURE_MAX_ANISOTROPY_EXT, 1.0)
+        self.frameBuffer.use()
+        glClearColor(0.0, 0.0, 0.0, 0.0)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        FrameBuffer.clear()
+
+    def delete(self):
+        self.frameBuffer.delete()
+        for texture in self.colorBuffers:
+            texture.delete()
+        if self.depthBuffer is not None:
+            self.depthBuffer.delete()
+
+
+class RenderTargetPool(object):
+    """
+    Hands out render targets by key, reusing released ones.
+    Every acquire gets a target of its own, it is only handed out again after it was released.
+    """
+
+    def __init__(self, maxUnusedBytes=256 * 1024 * 1024):
+        self.maxUnusedBytes = maxUnusedBytes
+        # released targets per key & all of them from least to most recently released
+        self.__unused = {}
+        self.__released = OrderedDict()
+        self.__unusedBytes = 0
+
+    def acquire(self, width, height, numOutputBuffers, format, tile, depth):
+        """
+        :rtype: RenderTarget
+        """
+        key = width, height, numOutputBuffers, format, tile, depth
+        targets = self.__unused.get(key)
+        if targets:
+            target = targets.pop()
+            del self.__released[target]
+            self.__unusedBytes -= target.byteSize()
+        else:
+            target = RenderTarget(key)
+        target.reset()
+        target.inUse = True
+        return target
+
+    def release(self, target):
+        assert target.inUse, 'Render target released twice.'
+        target.inUse = False
+        self.__unused.setdefault(target.key, []).append(target)
+        self.__released[target] = None
+        self.__unusedBytes += target.byteSize()
+        self.__trim(self.maxUnusedBytes)
+
+    def unusedBytes(self):
+        return self.__unusedBytes
+
+    def clear(self):
+        """
+        Deletes all released targets.
+        """
+        self.__trim(0)
+
+    def __trim(self, maxBytes):
+        while self.__unusedBytes > maxBytes and self.__released:
+            target = self.__released.popitem(last=False)[0]
+            self.__unused[target.key].remove(target)
+            self.__unusedBytes -= target.byteSize()
+            target.delete()
+
+
+gRenderTargetPool = RenderTargetPool()
@@ -1,18 +1,25 @@
+import os
 import re
 import time
-from collections import OrderedDict
+import hashlib
+import struct
+import functools
+from collections import OrderedDict, deque
 from fileutil import FileSystemWatcher, FilePath
 from profileui import Profiler
 from multiplatformutil import canValidateShaders
 
-from OpenGL.GL import shaders
+from OpenGL import GL
 from OpenGL.GL.EXT import texture_filter_anisotropic
 
 from heightfield import loadHeightfield
+from rendergraph import RenderGraph, bufferSize, TARGET_FORMATS
+from rendertargets import gRenderTargetPool
 from buffers import *
 from qtutil import *
 from util import currentProjectFilePath, parseXMLWithIncludes, currentProjectDirectory, templatePathFromScenePath, currentModelsDirectory
-from gl_shaders import compileProgram
+from gl_shaders import PendingProgram
+from shadercache import gProgramBinaryCache
 
 class TexturePool(object):
     """
@@ -70,7 +77,9 @@ class PassData(object):
                  drawCommand=None,
                  is3d=False,
                  name=None,
-                 inputBufferUniformOverrideNames={}):
+                 inputBufferUniformOverrideNames={},
+                 format=None,
+                 depth=True):
         self.vertStitches = vertStitches
         self.fragStitches = fragStitches
         self.uniforms = uniforms
@@ -82,6 +91,7 @@ class PassData(object):
         self.tile = tile
         self.downSampleFactor = downSampleFactor
         self.numOutputBuffers = numOutputBuffers
+        # compiled code object, see _compileDrawCommand
         self.drawCommand = drawCommand
         if is3d:
             assert not realtime, '3D textures can not be updated in real time.'
@@ -89,11 +99,72 @@ class PassData(object):
         self.is3d = is3d
         self.name = name
         self.inputBufferUniformOverrideNames = inputBufferUniformOverrideNames
+        # color format name of the target buffer, see rendergraph.TARGET_FORMATS, None for the default
+        self.format = format
+        # whether the target buffer needs a depth attachment
+        self.depth = depth
 
 
-def _deserializePasses(sceneFile, models):
+# names a pass's drawcommand can use besides its locals, see _compileDrawCommand
+_drawCommandGlobals = None
+
+
+def _compileDrawCommand(source, templatePath, passIndex):
+    """
+    Compiles the drawcommand attribute of a template pass, so syntax errors surface when the template is loaded.
+
+    The code runs in place of drawing the full screen rectangle, with the pass's program, inputs & uniforms bound.
+    It can use these globals:
+        the OpenGL.GL functions & constants
+        cgmath, math, time & ctypes
+        Texture, Texture3D, FrameBuffer & FullScreenRectSingleton
+    and these locals:
+        scene       the Scene being drawn
+        passIndex   the index of the pass in scene.passes
+        passData    the PassData being drawn
+        buffers     the color buffers of the pass's frame buffer, None when the pass draws to the screen
+        uniforms    the uniforms of the frame
+    self & i are still provided for older templates, as aliases of scene & passIndex.
+    """
+    try:
+        return compile(source, '%s, pass %s drawcommand' % (templatePath, passIndex), 'exec')
+    except SyntaxError as e:
+        raise ValueError('Invalid drawcommand in pass %s of "%s": %s' % (passIndex, templatePath, e))
+
+
+def _runDrawCommand(code, scene, passIndex, uniforms):
+    global _drawCommandGlobals
+    if _drawCommandGlobals is None:
+        import math
+        import ctypes
+        import cgmath
+        _drawCommandGlobals = dict((name, value) for name, value in vars(GL).items() if not name.startswith('_'))
+        _drawCommandGlobals.update({'cgmath': cgmath,
+                                    'math': math,
+                                    'time': time,
+                                    'ctypes': ctypes,
+                                    'Texture': Texture,
+                                    'Texture3D': Texture3D,
+                                    'FrameBuffer': FrameBuffer,
+                                    'FullScreenRectSingleton': FullScreenRectSingleton})
+    passData = scene.passes[passIndex]
+    buffers = None
+    if passData.targetBufferId != -1:
+        buffers = scene.colorBuffers[passData.targetBufferId]
+    # names the code assigns end up in the locals, which are new for every call
+    exec(code, _drawCommandGlobals, {'scene': scene,
+                                     'passIndex': passIndex,
+                                     'passData': passData,
+                                     'buffers': buffers,
+                                     'uniforms': uniforms,
+                                     'self': scene,
+                                     'i': passIndex})
+
+
+def _deserializePasses(sceneFile, models, ioTemplateAttributes=None):
     """
     :type sceneFile: FilePath
+    :param dict ioTemplateAttributes: if given, receives the attributes of the template root element
     :rtype: list[PassData]
     """
     assert isinstance(sceneFile, FilePath)
@@ -104,6 +175,8 @@ def _deserializePasses(sceneFile, models):
     xTemplate = parseXMLWithIncludes(templatePath)
     passes = []
     frameBufferMap = {}
+    if ioTemplateAttributes is not None:
+        ioTemplateAttributes.update(xTemplate.attrib)
 
     # # Start with adding the models here as passes. Stored by their model name
     # for model in models.models:
@@ -209,9 +282,24 @@ def _deserializePasses(sceneFile, models):
             for xUniform in xElement:
                 uniforms[xUniform.attrib['name']] = [float(x.strip()) for x in xUniform.attrib['value'].split(',')]
 
+        format = xPass.attrib.get('format', None)
+        if format is not None:
+            format = format.lower()
+            if format not in TARGET_FORMATS:
+                raise ValueError('Unknown format "%s" in pass %s of "%s", expected one of: %s' % (
+                    xPass.attrib['format'], len(passes), templatePath, ', '.join(sorted(TARGET_FORMATS))))
+
+        # passes that don't depth test can leave the depth buffer out
+        depth = xPass.attrib.get('depth', 'true').lower() not in ('false', '0')
+
+        drawCommand = None
+        if 'drawcommand' in xPass.attrib:
+            drawCommand = _compileDrawCommand(xPass.attrib['drawcommand'], templatePath, len(passes))
+
         passes.append(
             PassData(vertStitches, fragStitches, uniforms, inputs, frameBufferMap.get(buffer, -1), realtime, size, tile, 
-            		 factor, outputs, xPass.attrib.get('drawcommand', None), is3d, xPass.attrib.get('name', None), inputsUniformOverrideNames))
+            		 factor, outputs, drawCommand, is3d, xPass.attrib.get('name', None), inputsUniformOverrideNames,
+                     format, depth))
     return passes
 
 
@@ -245,43 +333,535 @@ class CameraTransform(object):
         self.data[3:6] = rotate
 
 
+class UniformLocations(dict):
+    """
+    Uniform location table of a single program.
+    glGetUniformLocation is called only the first time a name is looked up,
+    unused uniforms are cached as -1 as well.
+    """
+
+    def __init__(self, program):
+        super(UniformLocations, self).__init__()
+        self.program = program
+
+    def __missing__(self, name):
+        location = glGetUniformLocation(self.program, name)
+        self[name] = location
+        return location
+
+
 class _ShaderPool(object):
     def __init__(self):
         self.__cache = {}
+        self.__pending = {}
+        # number of passes waiting for each pending program
+        self.__pendingUsers = {}
+        self.__uniformLocations = {}
 
-    def compileProgram(self, vertCode, fragCode):
+    def __register(self, vertCode, fragCode, program):
+        self.__cache[(vertCode, fragCode)] = program
+        self.__uniformLocations[int(program)] = UniformLocations(program)
+
+    def submitProgram(self, vertCode, fragCode):
         """
-        A compileProgram version that ensures we don't recompile unnecessarily.
+        A compileProgram version that does not wait for the driver.
+        Returns the program if it is cached, else a PendingProgram to hand to finishProgram once it isReady().
         """
-        program = self.__cache.get((vertCode, fragCode), None)
+        key = vertCode, fragCode
+        program = self.__cache.get(key, None)
         if program:
             return program
-        program = compileProgram(
-            shaders.compileShader(vertCode, GL_VERTEX_SHADER),
-            shaders.compileShader(fragCode, GL_FRAGMENT_SHADER),
-            validate=canValidateShaders()
-        )
-        self.__cache[(vertCode, fragCode)] = program
+        pending = self.__pending.get(key, None)
+        if pending is not None:
+            self.__pendingUsers[key] += 1
+            return pending
+        program = gProgramBinaryCache.load(vertCode, fragCode)
+        if program is not None:
+            self.__register(vertCode, fragCode, program)
+            return program
+        pending = PendingProgram(vertCode, fragCode, validate=canValidateShaders(), retrievable=True)
+        self.__pending[key] = pending
+        self.__pendingUsers[key] = 1
+        return pending
+
+    def discardProgram(self, pending):
+        """
+        Gives up on a PendingProgram from submitProgram, it is deleted once no other pass waits for it.
+        """
+        key = pending.vertCode, pending.fragCode
+        if self.__pending.get(key, None) is not pending:
+            # finished already, the program is in use
+            return
+        self.__pendingUsers[key] -= 1
+        if self.__pendingUsers[key]:
+            return
+        del self.__pending[key]
+        del self.__pendingUsers[key]
+        pending.delete()
+
+    def finishProgram(self, pending):
+        """
+        Returns the linked program of a PendingProgram, raises RuntimeError on compile errors.
+        """
+        key = pending.vertCode, pending.fragCode
+        program = self.__cache.get(key, None)
+        if program:
+            # finished earlier on behalf of another pass
+            return program
+        try:
+            program = pending.result()
+        finally:
+            self.__pending.pop(key, None)
+            self.__pendingUsers.pop(key, None)
+        gProgramBinaryCache.store(program, pending.vertCode, pending.fragCode)
+        self.__register(pending.vertCode, pending.fragCode, program)
         return program
 
+    def compileProgram(self, vertCode, fragCode):
+        """
+        A compileProgram version that ensures we don't recompile unnecessarily.
+        """
+        program = self.submitProgram(vertCode, fragCode)
+        if isinstance(program, PendingProgram):
+            program = self.finishProgram(program)
+        return program
+
+    def clear(self):
+        """
+        Forgets the linked programs so the next submit compiles them again.
+        The programs are not deleted, scenes may still draw with them.
+        """
+        self.__cache = {}
+
+    def uniformLocations(self, program):
+        """
+        :rtype: UniformLocations
+        """
+        key = int(program)
+        locations = self.__uniformLocations.get(key, None)
+        if locations is None:
+            locations = UniformLocations(program)
+            self.__uniformLocations[key] = locations
+        return locations
+
 
 gShaderPool = _ShaderPool()
 
 
-def _loadGLSLWithIncludes(glslPath, ioIncludePaths):
-    assert isinstance(glslPath, FilePath)
-    search = re.compile(r'(?![^/*]*\*/)^[\t ]*(#include "[a-z0-9_]+")[\t ]*$', re.MULTILINE | re.IGNORECASE | re.DOTALL)
+def _setUniformVector(fn, location, value):
+    fn(location, *value)
+
+
+def _setUniformMatrix(fn, location, data, value):
+    # fill a preallocated ctypes array instead of creating a new one every frame
+    data[:] = value
+    fn(location, 1, False, data)
+
+
+def _setUniformArray(fn, location, value):
+    fn(location, len(value), value)
+
+
+class UniformBindingPlan(object):
+    """
+    Pre-resolved uniform setters for a single pass.
+
+    The GL function to call for an animated uniform is picked once based on the type and size of the value,
+    with the uniform location bound in. Uploading a frame's uniforms is then a dictionary lookup and a GL call per uniform.
+    Uniforms the program does not use are skipped entirely.
+    """
+    _VECTOR_SETTERS = (glUniform1f, glUniform2f, glUniform3f, glUniform4f)
+    _MATRIX_SETTERS = {9: glUniformMatrix3fv, 16: glUniformMatrix4fv}
+
+    def __init__(self, program, constantUniforms, uniformBlock=None):
+        self.program = program
+        self.locations = gShaderPool.uniformLocations(program)
+        self.usesUniformBlock = uniformBlock is not None and uniformBlock.attach(program)
+        self.__setters = {}
+        self.__constants = []
+        for name in constantUniforms:
+            location = self.locations[name]
+            if location == -1:
+                continue
+            value = constantUniforms[name]
+            if isinstance(value, float):
+                value = [value]
+            self.__constants.append((functools.partial(_setUniformVector, self._VECTOR_SETTERS[len(value) - 1], location), value))
+
+    def __resolve(self, name, value):
+        """
+        Returns (type, size, isTexture, setter) for the given uniform.
+        """
+        location = self.locations[name]
+        if isinstance(value, (int, long)):
+            return type(value), None, True, None if location == -1 else location
+        if isinstance(value, float):
+            return type(value), None, False, None if location == -1 else functools.partial(glUniform1f, location)
+
+        size = len(value)
+        if location == -1:
+            setter = None
+        elif size in self._MATRIX_SETTERS:
+            setter = functools.partial(_setUniformMatrix, self._MATRIX_SETTERS[size], location, (ctypes.c_float * size)())
+        elif size in (1, 2, 3, 4):
+            setter = functools.partial(_setUniformVector, self._VECTOR_SETTERS[size - 1], location)
+        else:
+            # has to be a c-type array
+            typeName = type(value).__name__
+            if typeName.startswith('c_float') or typeName.startswith('c_double'):
+                setter = functools.partial(_setUniformArray, glUniform1fv, location)
+            elif typeName.startswith('c_u'):
+                setter = functools.partial(_setUniformArray, glUniform1uiv, location)
+            else:
+                setter = functools.partial(_setUniformArray, glUniform1iv, location)
+        return type(value), size, False, setter
+
+    def bind(self, uniforms, textureUnit):
+        """
+        Upload the given uniforms, integer uniforms are bound as textures starting at the given texture unit.
+        Returns the next free texture unit.
+        """
+        setters = self.__setters
+        for name in uniforms:
+            value = uniforms[name]
+            entry = setters.get(name, None)
+            if entry is None or entry[0] is not type(value) or (entry[1] is not None and entry[1] != len(value)):
+                entry = self.__resolve(name, value)
+                setters[name] = entry
+            setter = entry[3]
+            if setter is None:
+                continue
+            if entry[2]:
+                glActiveTexture(GL_TEXTURE0 + textureUnit)
+                glBindTexture(GL_TEXTURE_2D, value)
+                glUniform1i(setter, textureUnit)
+                textureUnit += 1
+            else:
+                setter(value)
+        return textureUnit
+
+    def bindConstants(self):
+        for setter, value in self.__constants:
+            setter(value)
+
+
+class AnimationUniformBlock(object):
+    """
+    Packs the animation uniforms into a single std140 uniform buffer once per frame.
+
+    Templates opt in by naming the block on the template root, e.g. <template uniformblock="Animation">,
+    and declaring it in a shared header without an instance name:
+
+        layout(std140) uniform Animation { float uSeconds; float uBeats; vec3 uOrigin; vec3 uAngles; ... };
+
+    Every program declaring the block gets it bound to the same binding point. Members are plain uniforms to GL
+    so their locations are -1 and UniformBindingPlan skips them. Because the block is shared by all passes,
+    per-pass values such as uResolution must stay outside of it. The layout is queried from the first program
+    that uses the block, so all passes should declare it identically.
+    """
+    BINDING_POINT = 0
+    # components per column (or per vector) and number of columns
+    _TYPES = {GL_FLOAT: (1, 1),
+              GL_FLOAT_VEC2: (2, 1),
+              GL_FLOAT_VEC3: (3, 1),
+              GL_FLOAT_VEC4: (4, 1),
+              GL_FLOAT_MAT3: (3, 3),
+              GL_FLOAT_MAT4: (4, 4)}
+
+    def __init__(self, name):
+        self.name = name
+        self.__buffer = None
+        self.__data = None
+        self.__members = None
+
+    def reset(self):
+        """
+        Forget the layout, call when programs got rebuilt so the block declaration may have changed.
+        """
+        self.__members = None
+
+    def attach(self, program):
+        """
+        Bind the block of the given program to our binding point.
+        Returns False if the program does not use the block.
+        """
+        blockIndex = glGetUniformBlockIndex(program, self.name.encode('ascii'))
+        if blockIndex == GL_INVALID_INDEX:
+            return False
+        glUniformBlockBinding(program, blockIndex, AnimationUniformBlock.BINDING_POINT)
+        return True
+
+    def __queryLayout(self, program):
+        blockIndex = glGetUniformBlockIndex(program, self.name.encode('ascii'))
+        if blockIndex == GL_INVALID_INDEX:
+            return False
+
+        result = (GLint * 1)()
+        glGetActiveUniformBlockiv(program, blockIndex, GL_UNIFORM_BLOCK_DATA_SIZE, result)
+        size = result[0]
+        glGetActiveUniformBlockiv(program, blockIndex, GL_UNIFORM_BLOCK_ACTIVE_UNIFORMS, result)
+        count = result[0]
+        indices = (GLint * count)()
+        glGetActiveUniformBlockiv(program, blockIndex, GL_UNIFORM_BLOCK_ACTIVE_UNIFORM_INDICES, indices)
+        indices = (GLuint * count)(*indices)
+        offsets = (GLint * count)()
+        glGetActiveUniformsiv(program, count, indices, GL_UNIFORM_OFFSET, offsets)
+        arrayStrides = (GLint * count)()
+        glGetActiveUniformsiv(program, count, indices, GL_UNIFORM_ARRAY_STRIDE, arrayStrides)
+        matrixStrides = (GLint * count)()
+        glGetActiveUniformsiv(program, count, indices, GL_UNIFORM_MATRIX_STRIDE, matrixStrides)
+
+        self.__members = {}
+        for i in range(count):
+            name, arraySize, glType = glGetActiveUniform(program, indices[i])
+            if isinstance(name, bytes):
+                name = name.decode('ascii')
+            if name.endswith('[0]'):
+                name = name[:-3]
+            if glType not in AnimationUniformBlock._TYPES:
+                print('Warning, uniform block member %s has an unsupported type and is ignored.' % name)
+                continue
+            components, columns = AnimationUniformBlock._TYPES[glType]
+            if columns > 1:
+                stride, chunks = matrixStrides[i], columns
+            else:
+                stride, chunks = arrayStrides[i], arraySize
+            # one (offset, value slice, struct format) per vector, matrix column or array element
+            fmt = '%sf' % components
+            self.__members[name] = components * chunks, tuple((offsets[i] + j * stride, slice(j * components, (j + 1) * components), fmt)
+                                                              for j in range(chunks))
+
+        if self.__buffer is None or self.__buffer.size() != size:
+            self.__buffer = UniformBuffer(size)
+            self.__data = (ctypes.c_ubyte * size)()
+        return True
+
+    def update(self, uniforms, program):
+        """
+        Pack the given uniforms and upload them, the layout is queried from the given program when unknown.
+        Returns False if the layout is unknown and the program does not use the block either.
+        """
+        if self.__members is None and not self.__queryLayout(program):
+            return False
+
+        data = self.__data
+        for name, (size, chunks) in self.__members.items():
+            value = uniforms.get(name, None)
+            if value is None:
+                continue
+            if isinstance(value, (int, long, float)):
+                value = (value,)
+            if len(value) != size:
+                continue
+            for offset, span, fmt in chunks:
+                struct.pack_into(fmt, data, offset, *value[span])
+
+        self.__buffer.upload(data)
+        self.__buffer.bindBase(AnimationUniformBlock.BINDING_POINT)
+        return True
+
+
+_INCLUDE_PATTERN = re.compile(r'(?![^/*]*\*/)^[\t ]*(#include "[a-z0-9_]+")[\t ]*$', re.MULTILINE | re.IGNORECASE | re.DOTALL)
+# path: (mtime, size, content, [(code, include path or None), ...])
+_glslCache = {}
+
+
+def invalidateGLSLCache(path):
+    """
+    Forget the parsed content of a file, the modification time & size check misses changes within the file system's time resolution.
+    """
+    _glslCache.pop(ShaderDependencyGraph.key(path), None)
+
+
+def _parseGLSL(glslPath):
+    """
+    Returns the content of the given file and its code split at the #include directives.
+    Files are only read and parsed again when their modification time or size changed.
+    """
+    try:
+        info = os.stat(glslPath)
+    except OSError as e:
+        raise IOError(str(e))
+    key = ShaderDependencyGraph.key(glslPath)
+    entry = _glslCache.get(key, None)
+    if entry is not None and entry[0] == info.st_mtime and entry[1] == info.st_size:
+        return entry[2], entry[3]
+
     text = glslPath.content()
-    for res in list(search.finditer(text)):
+    segments = []
+    cursor = 0
+    for res in _INCLUDE_PATTERN.finditer(text):
         inc = res.group(1)
         idx = inc.find('"') + 1
         name = inc[idx:inc.find('"', idx + 1)]
-        path = glslPath.join('..', name).abs().lower()
+        segments.append((text[cursor:res.start(1)], glslPath.join('..', name).abs().lower()))
+        cursor = res.end(1)
+    segments.append((text[cursor:], None))
+    _glslCache[key] = info.st_mtime, info.st_size, text, segments
+    return text, segments
+
+
+def _expandGLSL(glslPath, ioIncludePaths, ioFileContents, ioParts):
+    text, segments = _parseGLSL(glslPath)
+    if ioFileContents is not None:
+        ioFileContents[glslPath] = text
+    for code, path in segments:
+        ioParts.append(code)
+        if path is None:
+            continue
         assert path not in ioIncludePaths, 'Recursive or duplicate include "%s" found while parsing "%s"' % (
             path, glslPath)
         ioIncludePaths.add(path)
-        text = '\n'.join([text[:res.start(1)], _loadGLSLWithIncludes(path, ioIncludePaths), text[res.end(1):]])
-    return text
+        ioParts.append('\n')
+        _expandGLSL(path, ioIncludePaths, ioFileContents, ioParts)
+        ioParts.append('\n')
+
+
+def _loadGLSLWithIncludes(glslPath, ioIncludePaths, ioFileContents=None):
+    """
+    Returns the code of the given file with all #include directives expanded.
+    ioFileContents optionally receives the unexpanded content of every file read, by path.
+    """
+    assert isinstance(glslPath, FilePath)
+    parts = []
+    _expandGLSL(glslPath, ioIncludePaths, ioFileContents, parts)
+    return ''.join(parts)
+
+
+class ShaderDependencyGraph(object):
+    """
+    Maps every GLSL file a scene uses, including #include-d files, to the indices of the passes depending on it.
+
+    Files are keyed by normalized absolute path and remember a hash of their content,
+    so saving a file without changing it does not trigger a rebuild.
+    """
+
+    def __init__(self):
+        self.__dependents = {}
+        self.__dependencies = {}
+        self.__hashes = {}
+
+    @staticmethod
+    def key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def setDependencies(self, passIndex, paths):
+        for key in self.__dependencies.pop(passIndex, ()):
+            self.__dependents[key].discard(passIndex)
+        keys = set(self.key(path) for path in paths)
+        self.__dependencies[passIndex] = keys
+        for key in keys:
+            self.__dependents.setdefault(key, set()).add(passIndex)
+
+    def dependents(self, path):
+        """
+        :rtype: set[int]
+        """
+        return set(self.__dependents.get(self.key(path), ()))
+
+    def updateContent(self, path, content):
+        """
+        Returns True if the content differs from the content last seen for this file.
+        """
+        key = self.key(path)
+        digest = hashlib.sha1(content.encode('utf8')).digest()
+        if self.__hashes.get(key, None) == digest:
+            return False
+        self.__hashes[key] = digest
+        return True
+
+
+class TimerQueryRing(object):
+    """
+    Measures GPU time per pass with GL_TIMESTAMP queries, without stalling the pipeline.
+
+    Queries of the last numFrames frames are kept in flight, results are only read once the GPU reports them available,
+    frames whose results are not available by the time their slot is reused are dropped.
+    Pass times are the difference between the timestamp after the pass and the timestamp before it,
+    a rolling history per pass label provides the median and 95th percentile.
+    """
+
+    def __init__(self, numFrames=4, historySize=120):
+        self.__historySize = historySize
+        # per frame slot: a query pool and the (label, cpuSeconds) for each query after the first
+        self.__queries = [[] for _ in range(numFrames)]
+        self.__labels = [[] for _ in range(numFrames)]
+        self.__pending = [False] * numFrames
+        self.__slot = 0
+        self.__used = 0
+        self.__history = {}
+        self.__result = []
+
+    def __query(self):
+        queries = self.__queries[self.__slot]
+        if self.__used == len(queries):
+            ids = (GLuint * 8)()
+            glGenQueries(8, ids)
+            queries.extend(ids)
+        query = queries[self.__used]
+        self.__used += 1
+        glQueryCounter(query, GL_TIMESTAMP)
+
+    def beginFrame(self):
+        self.__collect()
+        self.__slot = (self.__slot + 1) % len(self.__queries)
+        # never wait for the GPU, if this slot's frame is still not done we lose it
+        self.__pending[self.__slot] = False
+        self.__labels[self.__slot] = []
+        self.__used = 0
+        self.__query()
+
+    def markPass(self, label, cpuSeconds):
+        """
+        Call after submitting a pass, cpuSeconds is the time spent submitting it.
+        """
+        self.__labels[self.__slot].append((label, cpuSeconds))
+        self.__query()
+
+    def endFrame(self):
+        self.__pending[self.__slot] = True
+
+    def __collect(self):
+        # oldest frame first, so the newest available result ends up in self.__result
+        available = (GLint * 1)()
+        result = (GLuint64 * 1)()
+        for i in range(1, len(self.__queries) + 1):
+            slot = (self.__slot + i) % len(self.__queries)
+            if not self.__pending[slot]:
+                continue
+            labels = self.__labels[slot]
+            queries = self.__queries[slot][:len(labels) + 1]
+            glGetQueryObjectiv(queries[-1], GL_QUERY_RESULT_AVAILABLE, available)
+            if not available[0]:
+                # later frames can't be done either
+                break
+            self.__pending[slot] = False
+            timestamps = []
+            for query in queries:
+                glGetQueryObjectui64v(query, GL_QUERY_RESULT, result)
+                timestamps.append(result[0])
+            self.__publish(labels, timestamps)
+
+    def __publish(self, labels, timestamps):
+        self.__result = []
+        for i, (label, cpuSeconds) in enumerate(labels):
+            gpuSeconds = (timestamps[i + 1] - timestamps[i]) * 1e-9
+            history = self.__history.get(label, None)
+            if history is None:
+                history = deque(maxlen=self.__historySize)
+                self.__history[label] = history
+            history.append(gpuSeconds)
+            ordered = sorted(history)
+            median = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            self.__result.append((label, gpuSeconds, cpuSeconds, median, p95))
+
+    def result(self):
+        """
+        Timings of the most recent frame the GPU finished,
+        a list of (label, gpuSeconds, cpuSeconds, medianGpuSeconds, p95GpuSeconds).
+        """
+        return self.__result
 
 
 class FullScreenRectSingleton(object):
@@ -309,6 +889,8 @@ class Scene(object):
     STATIC_VERT = '#version 410\nout vec2 vUV;void main(){gl_Position=vec4(step(1,gl_VertexID)*step(-2,-gl_VertexID)*2-1,gl_VertexID-gl_VertexID%2-1,0,1);vUV=gl_Position.xy*.5+.5;}'
     PASS_THROUGH_FRAG = '#version 410\nin vec2 vUV;uniform vec4 uColor;uniform sampler2D uImages[1];out vec4 outColor0;void main(){outColor0=uColor*texture(uImages[0], vUV);}'
     sceneView = None
+    # when False compile errors & missing files are printed instead of shown in a dialog
+    interactive = True
 
     @classmethod
     def drawColorBufferToScreen(cls, colorBuffer, viewport, color=(1.0, 1.0, 1.0, 1.0)):
@@ -319,7 +901,7 @@ class Scene(object):
 
         colorBuffer.use()
 
-        glUniform1i(glGetUniformLocation(passThrough, 'uImages[0]'), 0)
+        glUniform1i(gShaderPool.uniformLocations(passThrough)['uImages[0]'], 0)
         glViewport(*viewport)
 
         FullScreenRectSingleton.instance().draw()
@@ -338,7 +920,7 @@ class Scene(object):
     def usePassThroughProgram(cls, color=(1.0, 1.0, 1.0, 1.0)):
         passThrough = cls.getPassThroughProgram()
         glUseProgram(passThrough)
-        glUniform4f(glGetUniformLocation(passThrough, 'uColor'), *color)
+        glUniform4f(gShaderPool.uniformLocations(passThrough)['uColor'], *color)
         return passThrough
 
     @classmethod
@@ -360,10 +942,30 @@ class Scene(object):
         self._debugPassId = None
 
         self.shaders = []
+        self.__bindingPlans = {}
+        self.__uniformBlock = None
         self.frameBuffers = []
         self.colorBuffers = []
+        # borrowed from gRenderTargetPool, one per frame buffer slot of the render graph
+        self.__renderTargets = []
+        # (label, gpuSeconds, cpuSeconds, medianGpuSeconds, p95GpuSeconds) per pass
         self.profileLog = []
+        self.__timerQueries = None
         self.profileInfoChanged = Signal()
+        self.programsChanged = Signal()
+
+        self.__pendingPrograms = {}
+        self.__dependencyGraph = ShaderDependencyGraph()
+        self.__changedPaths = set()
+        # coalesce bursts of file change notifications, the file may still be written when the first one arrives
+        self.__rebuildTimer = QTimer()
+        self.__rebuildTimer.setSingleShot(True)
+        self.__rebuildTimer.setInterval(10)
+        self.__rebuildTimer.timeout.connect(self.__rebuildChangedPaths)
+        # finish background compiles while nothing is being drawn
+        self.__compileTimer = QTimer()
+        self.__compileTimer.setInterval(10)
+        self.__compileTimer.timeout.connect(self.__onCompileTimer)
 
         self.__filePath = sceneFile
         self.fileSystemWatcher_scene = FileSystemWatcher()
@@ -408,10 +1010,22 @@ class Scene(object):
                 return
             self.fileSystemWatcher_scene.addPath(path)
 
-        self.passes = _deserializePasses(self.__filePath, self._models)
+        # a scene that is not shown only keeps its static buffers, see releaseBuffers
+        released = None in self.__renderTargets
+        templateAttributes = {}
+        self.passes = _deserializePasses(self.__filePath, self._models, templateAttributes)
+        self.__renderGraph = RenderGraph(self.passes)
+        self.__bindingPlans = {}
+        # pass indices may have changed
+        self.shaders = []
+        self.__discardPendingPrograms()
+        self.__dependencyGraph = ShaderDependencyGraph()
+        self.__uniformBlock = None
+        if 'uniformblock' in templateAttributes:
+            self.__uniformBlock = AnimationUniformBlock(templateAttributes['uniformblock'])
 
         self.fileSystemWatcher = FileSystemWatcher()
-        self.fileSystemWatcher.fileChanged.connect(self._rebuild)
+        self.fileSystemWatcher.fileChanged.connect(self.__queueRebuild)
         watched = set()
         for passData in self.passes:
             newStitches = (set(passData.vertStitches) | set(passData.fragStitches)) - watched
@@ -419,58 +1033,86 @@ class Scene(object):
                 self.fileSystemWatcher.addPaths(list(newStitches))
                 watched |= newStitches
 
+        # the buffers follow from the passes
+        if self.__w and self.__h:
+            w, h = self.__w, self.__h
+            self.__w = self.__h = 0
+            self.setSize(w, h)
+            if released:
+                self.releaseBuffers()
+
         self._rebuild(None)
         self.__cameraData = None
 
+    def __queueRebuild(self, path):
+        self.__changedPaths.add(path)
+        self.__rebuildTimer.start()
+
+    def __rebuildChangedPaths(self):
+        paths, self.__changedPaths = self.__changedPaths, set()
+        for path in paths:
+            self._rebuild(path)
+
     def _rebuild(self, path, index=None):
+        """
+        Submits all passes affected by the given path, or all passes if no path is given, for compilation.
+        Passes keep drawing with their current program until the new one is linked, see _pollPrograms.
+        """
         Scene.sceneView.makeCurrent()
 
         if path:
             path = FilePath(path)
-            time.sleep(0.01)
             if not path.exists():
                 # the scene has been deleted, stop watching it
                 return
             self.fileSystemWatcher.addPath(path)
-            path = path.abs()
+            try:
+                content = path.content()
+            except IOError:
+                return
+            if not self.__dependencyGraph.updateContent(path, content):
+                # saved without changes
+                return
+            invalidateGLSLCache(path)
+            affected = self.__dependencyGraph.dependents(path)
 
+        swapped = False
         for i, passData in enumerate(self.passes):
-            vert = True
-            frag = True
-
             # make sure the changed path is in our dependencies
-            if path:
-                if not path in (stitch.abs() for stitch in passData.vertStitches):
-                    vert = False
-                if not path in (stitch.abs() for stitch in passData.fragStitches):
-                    frag = False
-                if not vert and not frag:
-                    continue
+            if path and i not in affected:
+                continue
 
             if index is not None and index != i:
                 continue
 
             includePaths = set()
+            fileContents = {}
             errors = []
 
             vertCode = []
             for stitch in passData.vertStitches:
                 try:
-                    vertCode.append(_loadGLSLWithIncludes(stitch, includePaths))
+                    vertCode.append(_loadGLSLWithIncludes(stitch, includePaths, fileContents))
                 except IOError as e:
                     errors.append(stitch.abs())
 
             fragCode = []
             for stitch in passData.fragStitches:
                 try:
-                    fragCode.append(_loadGLSLWithIncludes(stitch, includePaths))
+                    fragCode.append(_loadGLSLWithIncludes(stitch, includePaths, fileContents))
                 except IOError as e:
                     errors.append(stitch.abs())
 
+            self.__dependencyGraph.setDependencies(i, list(fileContents.keys()) + passData.vertStitches + passData.fragStitches)
+            for filePath, content in fileContents.items():
+                self.__dependencyGraph.updateContent(filePath, content)
+
             if errors:
-                QMessageBox.critical(None, 'Missing files',
-                                     'A template or scene could not be loaded & is missing the following files:\n\n%s' % '\n'.join(
-                                         errors))
+                message = 'A template or scene could not be loaded & is missing the following files:\n\n%s' % '\n'.join(errors)
+                if Scene.interactive:
+                    QMessageBox.critical(None, 'Missing files', message)
+                else:
+                    print(message)
                 return
 
             if includePaths:
@@ -485,51 +1127,124 @@ class Scene(object):
 
             fragCode = '\n'.join(fragCode)
 
-            try:
-                program = gShaderPool.compileProgram(vertCode, fragCode)
-
-            except RuntimeError as e:
-                self.shaders = []
-                errors = e.args[0].split('\n')
-                try:
-                    code = e.args[1][0].decode('ascii').split('\n')
-                except IndexError:
-                    print(e.args)
-                    print('pass: ' + (passData.name or ''))
-                    print('fragCode:')
-                    print(fragCode)
-                    return
-                # html escape output
-                errors = [Qt.escape(ln) for ln in errors]
-                code = [Qt.escape(ln) for ln in code]
-                log = []
-                for error in errors:
-                    try:
-                        lineNumber = int(error.split(' : ', 1)[0].rsplit('(')[-1].split(')')[0])
-                    except:
-                        continue
-                    lineNumber -= 1
-                    log.append('<p><font color="red">%s</font><br/>%s<br/><font color="#081">%s</font><br/>%s</p>' % (
-                        error, '<br/>'.join(code[lineNumber - 5:lineNumber]), code[lineNumber],
-                        '<br/>'.join(code[lineNumber + 1:lineNumber + 5])))
-                self.__errorDialogText.setHtml('<pre>' + '\n'.join(log) + '</pre>')
-                self.__errorDialog.setGeometry(100, 100, 800, 600)
-                self.__errorDialog.exec_()
-                return
-
-            while len(self.shaders) <= i:
-                self.shaders.append(0)
-            self.shaders[i] = program
+            program = gShaderPool.submitProgram(vertCode, fragCode)
+            # any older pending compile is outdated
+            self.__discardPendingProgram(i)
+            if isinstance(program, PendingProgram):
+                self.__pendingPrograms[i] = program
+            else:
+                self.__setProgram(i, program)
+                swapped = True
 
-            # 3D texture dirties, let's reset it's buffers too
-            if self.passes[i].is3d and self.colorBuffers:
-                for j, buffer in enumerate(self.colorBuffers[i]):
-                    if isinstance(buffer, Texture3D):
-                        self.colorBuffers[i][j] = buffer.original
-                        self.__passDirtyState[i] = True
+        # passes that have nothing to draw with can not wait for the background compile
+        self._pollPrograms(waitForMissing=True)
 
         self.__passDirtyState = [True] * len(self.passes)
         self.__errorDialog.close()
+        if swapped:
+            self.programsChanged.emit()
+
+    def __discardPendingProgram(self, i):
+        pending = self.__pendingPrograms.pop(i, None)
+        if pending is not None:
+            gShaderPool.discardProgram(pending)
+
+    def __discardPendingPrograms(self):
+        for i in list(self.__pendingPrograms):
+            self.__discardPendingProgram(i)
+
+    def __setProgram(self, i, program):
+        while len(self.shaders) <= i:
+            self.shaders.append(0)
+        self.shaders[i] = program
+
+        if self.__uniformBlock is not None:
+            self.__uniformBlock.reset()
+
+        # 3D texture dirties, let's reset it's buffers too
+        if self.passes[i].is3d and self.colorBuffers:
+            buffers = self.colorBuffers[self.passes[i].targetBufferId]
+            if any(isinstance(buffer, Texture3D) for buffer in buffers):
+                self.__deleteTexture3Ds(buffers)
+                self.__passDirtyState[i] = True
+
+    def __onCompileTimer(self):
+        Scene.sceneView.makeCurrent()
+        self._pollPrograms()
+
+    def _pollPrograms(self, waitForMissing=False, waitForAll=False):
+        """
+        Swaps in the programs that finished compiling, emits programsChanged if any did.
+        When waitForMissing is set this blocks for the passes that do not have a program yet,
+        when waitForAll is set this blocks until every pending program is linked.
+        """
+        if not self.__pendingPrograms:
+            return
+
+        changed = False
+        for i, pending in list(self.__pendingPrograms.items()):
+            if self.__pendingPrograms.get(i, None) is not pending:
+                # handled while the error dialog of another pass was open
+                continue
+            hasProgram = i < len(self.shaders) and self.shaders[i] != 0
+            if not waitForAll and not pending.isReady() and (hasProgram or not waitForMissing):
+                continue
+            del self.__pendingPrograms[i]
+            try:
+                program = gShaderPool.finishProgram(pending)
+            except RuntimeError as e:
+                if hasProgram:
+                    # keep drawing with the previous program
+                    self.__showCompileError(e, self.passes[i], pending.fragCode)
+                    continue
+                # nothing to draw this pass with, the scene is broken until the next rebuild
+                self.shaders = []
+                self.__discardPendingPrograms()
+                changed = False
+                self.__showCompileError(e, self.passes[i], pending.fragCode)
+                break
+            self.__setProgram(i, program)
+            changed = True
+
+        if self.__pendingPrograms:
+            self.__compileTimer.start()
+        else:
+            self.__compileTimer.stop()
+
+        if changed:
+            self.__passDirtyState = [True] * len(self.passes)
+            self.programsChanged.emit()
+
+    def __showCompileError(self, e, passData, fragCode):
+        errors = e.args[0].split('\n')
+        try:
+            code = e.args[1][0].decode('ascii').split('\n')
+        except IndexError:
+            print(e.args)
+            print('pass: ' + (passData.name or ''))
+            print('fragCode:')
+            print(fragCode)
+            return
+        if not Scene.interactive:
+            print('Failed to compile pass: ' + (passData.name or str(self.passes.index(passData))))
+            print('\n'.join(errors))
+            return
+        # html escape output
+        errors = [Qt.escape(ln) for ln in errors]
+        code = [Qt.escape(ln) for ln in code]
+        log = []
+        for error in errors:
+            try:
+                lineNumber = int(error.split(' : ', 1)[0].rsplit('(')[-1].split(')')[0])
+            except:
+                continue
+            lineNumber -= 1
+            log.append('<p><font color="red">%s</font><br/>%s<br/><font color="#081">%s</font><br/>%s</p>' % (
+                error, '<br/>'.join(code[lineNumber - 5:lineNumber]), code[lineNumber],
+                '<br/>'.join(code[lineNumber + 1:lineNumber + 5])))
+        self.__errorDialogText.setHtml('<pre>' + '\n'.join(log) + '</pre>')
+        self.__errorDialog.setGeometry(100, 100, 800, 600)
+        self.__errorDialog.exec_()
 
     def setCameraData(self, data):
         self.__cameraData = data
@@ -554,70 +1269,97 @@ class Scene(object):
 
     def setSize(self, w, h):
         if w == self.__w and h == self.__h:
+            if None in self.__renderTargets:
+                # shown again after releaseBuffers
+                Scene.sceneView.makeCurrent()
+                self.__acquireTargets()
             return
         self.__w = w
         self.__h = h
 
-        # compose buffer metadata
-        numBuffers = -1
-        bufferData = OrderedDict()
-        for passData in self.passes:
-            if passData.targetBufferId not in bufferData:
-                bufferData[
-                    passData.targetBufferId] = passData.numOutputBuffers, passData.downSampleFactor, passData.resolution, passData.tile
-            else:
-                numOutputBuffers, downSampleFactor, resolution, tile = bufferData[passData.targetBufferId]
-
-                numOutputBuffers = max(numOutputBuffers, passData.numOutputBuffers)
-
-                if passData.downSampleFactor is not None:
-                    if downSampleFactor is not None:
-                        assert passData.downSampleFactor == downSampleFactor
-                    else:
-                        downSampleFactor = passData.downSampleFactor
-
-                if passData.resolution is not None:
-                    if downSampleFactor is not None:
-                        assert passData.resolution == resolution
-                    else:
-                        resolution = passData.resolution
-
-                bufferData[passData.targetBufferId] = numOutputBuffers, downSampleFactor, resolution, tile
-
-            numBuffers = max(passData.targetBufferId, numBuffers)
-        numBuffers += 2
-        bufferData[numBuffers - 1] = 1, 1, None, False
-
-        self.frameBuffers = []
-        self.colorBuffers = []
-        for value in bufferData.values():
-            if value[2] is not None:
-                w, h = value[2]
-            elif value[1] is not None:
-                w, h = self.__w // value[1], self.__h // value[1]
-            else:
-                w, h = self.__w, self.__h
+        Scene.sceneView.makeCurrent()
+        # released first, so buffers that keep their size get the same targets back
+        for target in self.__renderTargets:
+            if target is not None:
+                gRenderTargetPool.release(target)
+        for buffers in self.colorBuffers:
+            if buffers is not None:
+                self.__deleteTexture3Ds(buffers)
+
+        # buffers with disjoint lifetimes share a frame buffer, see rendergraph.py
+        self.__renderTargets = [None] * self.__renderGraph.numSlots()
+        self.frameBuffers = [None] * len(self.__renderGraph.buffers)
+        self.colorBuffers = [None] * len(self.__renderGraph.buffers)
+        self.__acquireTargets()
 
-            w = max(1, w)
-            h = max(1, h)
+        self.__passDirtyState = [True] * len(self.passes)
 
-            self.frameBuffers.append(FrameBuffer(w, h))
-            self.frameBuffers[-1].initDepth(Texture(Texture.FORMAT_D32F, w, h))
-            self.colorBuffers.append([])
-            for j in range(value[0]):
-                self.colorBuffers[-1].append(Texture(Texture.FORMAT_RGBA32F, w, h, tile=value[3]))
-                self.frameBuffers[-1].addTexture(self.colorBuffers[-1][-1])
+    def __acquireTargets(self):
+        # fill the slots that have no render target
+        missing = set(slot for slot, target in enumerate(self.__renderTargets) if target is None)
+        for index, descriptor in enumerate(self.__renderGraph.buffers):
+            slot = self.__renderGraph.allocation[index]
+            if slot not in missing:
+                continue
+            if self.__renderTargets[slot] is None:
+                numOutputBuffers, downSampleFactor, resolution, tile, format, depth = descriptor
+                w, h = bufferSize(descriptor, self.__w, self.__h)
+                self.__renderTargets[slot] = gRenderTargetPool.acquire(w, h, numOutputBuffers, format, tile, depth)
+            self.frameBuffers[index] = self.__renderTargets[slot].frameBuffer
+            # 3D passes swap their textures in this list
+            self.colorBuffers[index] = list(self.__renderTargets[slot].colorBuffers)
 
-        self.__passDirtyState = [True] * len(self.passes)
+    @staticmethod
+    def __deleteTexture3Ds(buffers):
+        # 3D passes own the textures they swapped in, the 2D originals belong to the render target
+        for j, buffer in enumerate(buffers):
+            if isinstance(buffer, Texture3D):
+                buffers[j] = buffer.original
+                buffer.delete()
+
+    def releaseBuffers(self):
+        """
+        Returns the frame buffers that are drawn every frame to the pool while the scene is not shown.
+        Static & 3D pass outputs are kept, so showing the scene again at the same size does not draw them again.
+        """
+        if not self.__renderTargets:
+            return
+        Scene.sceneView.makeCurrent()
+        retained = self.__renderGraph.retainedSlots()
+        for slot, target in enumerate(self.__renderTargets):
+            if target is None or slot in retained:
+                continue
+            gRenderTargetPool.release(target)
+            self.__renderTargets[slot] = None
+        for index in range(len(self.__renderGraph.buffers)):
+            if self.__renderGraph.allocation[index] not in retained:
+                self.frameBuffers[index] = None
+                self.colorBuffers[index] = None
+
+    def __schedule(self):
+        # in debug mode we view a pass on the screen, so no later passes may overwrite its buffers
+        return self.__renderGraph.schedule(None if self._debugPassId is None else self._debugPassId[0])
+
+    def _bindingPlan(self, passId):
+        """
+        :rtype: UniformBindingPlan
+        """
+        plan = self.__bindingPlans.get(passId, None)
+        if plan is None or plan.program != self.shaders[passId]:
+            # first use or the program got rebuilt
+            plan = UniformBindingPlan(self.shaders[passId], self.passes[passId].uniforms, self.__uniformBlock)
+            self.__bindingPlans[passId] = plan
+        return plan
 
     def _bindInputs(self, passId, additionalTextureUniforms=None):
+        locations = self._bindingPlan(passId).locations
         j2d = 0
         j3d = 0
 
         j = 0
 
         # pull all textures in advance to avoid custom mip map shaders overriding the currently set up inputs
-        program = glGetIntegerv(GL_CURRENT_PROGRAM)
+        program = self.shaders[passId]
         for j, inpt in enumerate(self.passes[passId].inputBufferIds):
             if isinstance(inpt, str):
                 TexturePool.fetchAndUse(inpt)
@@ -632,7 +1374,7 @@ class Scene(object):
             if isinstance(inpt, str):
                 # input is texture file name
                 TexturePool.fetchAndUse(inpt)
-                glUniform1i(glGetUniformLocation(self.shaders[passId], 'uImages[%s]' % j2d), j)
+                glUniform1i(locations['uImages[%s]' % j2d], j)
                 j2d += 1
                 continue
 
@@ -650,7 +1392,7 @@ class Scene(object):
                 else:
                     uniformName = 'uImages[%s]' % j2d
                     j2d += 1
-            uniformId = glGetUniformLocation(self.shaders[passId], uniformName)
+            uniformId = locations[uniformName]
             if uniformId != -1:
                 glUniform1i(uniformId, j)
 
@@ -659,7 +1401,7 @@ class Scene(object):
                 j += 1
                 glActiveTexture(GL_TEXTURE0 + j)
                 TexturePool.fetchAndUse(additionalTextureUniforms[name])
-                glUniform1i(glGetUniformLocation(self.shaders[passId], name), j)
+                glUniform1i(locations[name], j)
 
         return j + 1
 
@@ -668,18 +1410,23 @@ class Scene(object):
             glActiveTexture(GL_TEXTURE0 + j)
             glBindTexture(GL_TEXTURE_2D, 0)
 
-    def drawToScreen(self, seconds, beats, uniforms, viewport, additionalTextureUniforms=None):
+    def render(self, seconds, beats, uniforms, additionalTextureUniforms=None):
+        """
+        Draw all passes into their frame buffers without presenting the result.
+        Returns False when there is nothing to show because of compiler errors.
+        """
+        self._pollPrograms()
         if not self.shaders:
             # compiler errors
-            return
+            return False
 
         # clear all frame buffers from Z before draw
         glEnable(GL_DEPTH_TEST)
         toClear = []
-        for i, passData in enumerate(self.passes):
+        for i, clear in self.__schedule():
             if not self.__passDirtyState[i]:
                 continue
-            toClear.append(passData.targetBufferId)
+            toClear.append(self.passes[i].targetBufferId)
         for i in sorted(list(set(toClear))):
             self.frameBuffers[i].use()
             glClear(GL_DEPTH_BUFFER_BIT)
@@ -687,6 +1434,11 @@ class Scene(object):
         maxActiveInputs = max(1,
                               self.draw(seconds, beats, uniforms, additionalTextureUniforms=additionalTextureUniforms))
         self._unbindInputs(maxActiveInputs)
+        return True
+
+    def drawToScreen(self, seconds, beats, uniforms, viewport, additionalTextureUniforms=None):
+        if not self.render(seconds, beats, uniforms, additionalTextureUniforms):
+            return
 
         glDisable(GL_DEPTH_TEST)
         if self._debugPassId is None:
@@ -697,20 +1449,22 @@ class Scene(object):
         glEnable(GL_DEPTH_TEST)
 
     def draw(self, seconds, beats, uniforms, additionalTextureUniforms=None):
+        self._pollPrograms()
         if not self.shaders:
             # compiler errors
-            return
+            return 0
 
         isProfiling = Profiler.instance and Profiler.instance.isVisible() and Profiler.instance.isProfiling() and self._debugPassId is None
+        startT = time.perf_counter()
         if isProfiling:
-            self.profileLog = []
-            glFinish()
-            startT = time.perf_counter()
-        else:
-            startT = time.perf_counter()
+            if self.__timerQueries is None:
+                self.__timerQueries = TimerQueryRing()
+            self.__timerQueries.beginFrame()
 
         maxActiveInputs = 0
-        for i, passData in enumerate(self.passes):
+        uniformBlockPending = self.__uniformBlock is not None
+        for i, clear in self.__schedule():
+            passData = self.passes[i]
             if not self.__passDirtyState[i]:
                 continue
 
@@ -733,56 +1487,33 @@ class Scene(object):
 
             if i >= len(self.shaders) or self.shaders[i] == 0:
                 self._rebuild(None, index=i)
+                if i >= len(self.shaders) or self.shaders[i] == 0:
+                    # compiler errors, the scene is broken until the next rebuild
+                    break
 
-            # make sure we don't take into account previous GL calls when measuring time
             if isProfiling:
-                glFinish()
                 beforeT = time.perf_counter()
 
             self.frameBuffers[passData.targetBufferId].use()
+            if clear:
+                # this buffer shares its frame buffer, don't show what the previous user left
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
             glUseProgram(self.shaders[i])
 
             activeInputs = self._bindInputs(i, additionalTextureUniforms)
 
-            fn = (glUniform1f, glUniform2f, glUniform3f, glUniform4f)
-            for name in uniforms:
-                if isinstance(uniforms[name], (int, long)):
-                    glActiveTexture(GL_TEXTURE0 + activeInputs)
-                    glBindTexture(GL_TEXTURE_2D, uniforms[name])
-                    glUniform1i(glGetUniformLocation(self.shaders[i], name), activeInputs)
-                    activeInputs += 1
-                elif isinstance(uniforms[name], float):
-                    fn[0](glGetUniformLocation(self.shaders[i], name), uniforms[name])
-                elif len(uniforms[name]) == 9:
-                    glUniformMatrix3fv(glGetUniformLocation(self.shaders[i], name), 1, False,
-                                       (ctypes.c_float * 9)(*uniforms[name]))
-                elif len(uniforms[name]) == 16:
-                    glUniformMatrix4fv(glGetUniformLocation(self.shaders[i], name), 1, False,
-                                       (ctypes.c_float * 16)(*uniforms[name]))
-                elif len(uniforms[name]) in (1, 2, 3, 4):
-                    fn[len(uniforms[name]) - 1](glGetUniformLocation(self.shaders[i], name), *uniforms[name])
-                else:
-                    # has to be a c-type array
-                    typeName = type(uniforms[name]).__name__
-                    if typeName.startswith('c_float') or typeName.startswith('c_double'):
-                        glUniform1fv(glGetUniformLocation(self.shaders[i], name), len(uniforms[name]), uniforms[name])
-                    elif typeName.startswith('c_u'):
-                        glUniform1uiv(glGetUniformLocation(self.shaders[i], name), len(uniforms[name]), uniforms[name])
-                    else:
-                        glUniform1iv(glGetUniformLocation(self.shaders[i], name), len(uniforms[name]), uniforms[name])
-
-            for name in passData.uniforms:
-                if isinstance(passData.uniforms[name], float):
-                    fn[0](glGetUniformLocation(self.shaders[i], name), passData.uniforms[name])
-                else:
-                    fn[len(passData.uniforms[name]) - 1](glGetUniformLocation(self.shaders[i], name),
-                                                         *passData.uniforms[name])
+            plan = self._bindingPlan(i)
+            if uniformBlockPending and plan.usesUniformBlock:
+                # shared by all passes, so upload once per frame
+                uniformBlockPending = not self.__uniformBlock.update(uniforms, self.shaders[i])
+            activeInputs = plan.bind(uniforms, activeInputs)
+            plan.bindConstants()
 
             maxActiveInputs = max(maxActiveInputs, activeInputs)
 
             if self.passes[i].drawCommand is not None:
-                exec(self.passes[i].drawCommand)
+                _runDrawCommand(self.passes[i].drawCommand, self, i, uniforms)
             else:
                 if not self.passes[i].is3d:
                     FullScreenRectSingleton.instance().draw()
@@ -798,7 +1529,7 @@ class Scene(object):
                     # Render multiple slices
                     for slice in range(0, self.passes[i].resolution[0]):
                         # Set slice shader var
-                        sliceUni = glGetUniformLocation(self.shaders[i], "uSlice")
+                        sliceUni = plan.locations['uSlice']
                         glUniform1f(sliceUni, float(slice))
 
                         # Render slice to 2d framebuffer
@@ -833,18 +1564,13 @@ class Scene(object):
 
                     glGenerateMipmap(mode)
 
-            # make sure all graphics calls are finished processing in GL land before we measure time
             if isProfiling:
-                glFinish()
-                afterT = time.perf_counter()
-                self.profileLog.append((passData.name or str(i), afterT - beforeT))
-
-            if self._debugPassId is not None and i == self._debugPassId[0]:
-                # debug mode, we want to view this pass on the screen, avoid overwriting it's buffers with future passes
-                break
+                self.__timerQueries.markPass(passData.name or str(i), time.perf_counter() - beforeT)
 
         if isProfiling:
-            glFinish()
+            # GPU times lag a few frames behind
+            self.__timerQueries.endFrame()
+            self.profileLog = self.__timerQueries.result()
         # inform the profiler a new result is ready
         endT = time.perf_counter()
         self.profileInfoChanged.emit(endT - startT)
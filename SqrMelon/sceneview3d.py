@@ -4,9 +4,12 @@ import time
 from overlays import loadImage
 from util import gSettings, currentProjectDirectory
 from scene import Scene
+from animationhook import AnimationProcessor
 from OpenGL.GL import *
 
 _noSignalImage = None
+# wait for resizing to settle before reallocating the scene's buffers
+RESIZE_DELAY_MS = 150
 
 
 class SceneView(QGLWidget):
@@ -47,6 +50,10 @@ class SceneView(QGLWidget):
         self.setFocusPolicy(Qt.StrongFocus)
         self._textures = {}
         self._prevTime = time.time()
+        self.__resizeTimer = QTimer()
+        self.__resizeTimer.setSingleShot(True)
+        self.__resizeTimer.setInterval(RESIZE_DELAY_MS)
+        self.__resizeTimer.timeout.connect(self.__applySize)
 
     def setPreviewRes(self, widthOverride, heightOverride, scale):
         if widthOverride is not None:
@@ -96,9 +103,17 @@ class SceneView(QGLWidget):
                 self._scene.fileSystemWatcher.fileChanged.disconnect(self.repaint)
             except:
                 pass
+            try:
+                self._scene.programsChanged.disconnect(self.repaint)
+            except:
+                pass
+
+            # hand its realtime buffers to the next scene, static & 3D pass outputs are kept
+            self._scene.releaseBuffers()
 
         if scene:
             scene.fileSystemWatcher.fileChanged.connect(self.repaint)
+            scene.programsChanged.connect(self.repaint)
 
         # resize color buffers used by scene
         self._scene = scene
@@ -152,15 +167,11 @@ class SceneView(QGLWidget):
                     height)
 
         if self._scene:
-            uniforms = self._animator.evaluate(self._timer.time)
-            textureUniforms = self._animator.additionalTextures(self._timer.time)
+            evaluation = self._animator.evaluateFrame(self._timer.time)
+            uniforms = evaluation.uniforms()
+            textureUniforms = evaluation.textures()
 
-            cameraData = self._cameraData
-            scene = self._scene
-            modifier = currentProjectDirectory().join('animationprocessor.py')
-            if modifier.exists():
-                beats = self._timer.time
-                execfile(modifier, globals(), locals())
+            AnimationProcessor.get(currentProjectDirectory()).process(uniforms, self._cameraData, self._timer.time, self._scene)
 
             for name in self._textures:
                 uniforms[name] = self._textures[name]._id
@@ -192,7 +203,7 @@ class SceneView(QGLWidget):
                 Scene.drawColorBufferToScreen(image, viewport, color)
                 glDisable(GL_BLEND)
 
-    def __onResize(self):
+    def __onResize(self, immediate=True):
         w = self.width()
         h = self.height()
         if self._previewRes[0]:
@@ -202,12 +213,22 @@ class SceneView(QGLWidget):
         w = int(w * self._previewRes[2])
         h = int(h * self._previewRes[2])
         self._size = self.calculateAspect(w, h)[0:2]
+        if immediate:
+            self.__applySize()
+        else:
+            # meanwhile the current buffers are stretched to fit
+            self.__resizeTimer.start()
+        self.repaint()
+
+    def __applySize(self):
+        self.__resizeTimer.stop()
         if self._scene:
+            self.makeCurrent()
             self._scene.setSize(*self._size)
-        self.repaint()
+            self.repaint()
 
     def resizeGL(self, w, h):
-        self.__onResize()
+        self.__onResize(immediate=False)
 
     def keyPressEvent(self, keyEvent):
         super(SceneView, self).keyPressEvent(keyEvent)
@@ -0,0 +1,161 @@
+"""
+Persistent cache of linked shader program binaries.
+
+Programs are stored per project, keyed by a hash of the stitched vertex and fragment code
+and the GL driver identification, so switching drivers or GPUs simply misses the cache.
+"""
+from pycompat import *
+import os
+import struct
+import hashlib
+import ctypes
+from OpenGL.GL import *
+from gl_shaders import ShaderProgram
+from projutil import currentProjectDirectory
+
+CACHE_FOLDER_NAME = '.shadercache'
+CACHE_EXT = '.bin'
+# header preceding the binary blob: the binary format enum
+_HEADER = struct.Struct('<I')
+
+
+class ProgramBinaryCache(object):
+    """
+    Stores glGetProgramBinary blobs on disk.
+    The least recently used files are evicted once the cache grows beyond maxBytes.
+    While enabled is False nothing is loaded or stored.
+    """
+
+    def __init__(self, maxBytes=256 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.enabled = True
+        self.__driver = None
+
+    def __driverKey(self):
+        # only valid with a current context, so resolve on first use
+        if self.__driver is None:
+            parts = []
+            for name in (GL_VENDOR, GL_RENDERER, GL_VERSION):
+                value = glGetString(name) or b''
+                if not isinstance(value, bytes):
+                    value = value.encode('utf8')
+                parts.append(value)
+            self.__driver = b'\0'.join(parts)
+        return self.__driver
+
+    @staticmethod
+    def directory():
+        try:
+            return currentProjectDirectory().join(CACHE_FOLDER_NAME)
+        except AttributeError:
+            # no current project
+            return None
+
+    def __path(self, vertCode, fragCode):
+        if not self.enabled:
+            return None
+        directory = self.directory()
+        if directory is None:
+            return None
+        digest = hashlib.sha1(self.__driverKey())
+        for code in (vertCode, fragCode):
+            digest.update(b'\0')
+            digest.update(code.encode('utf8'))
+        return directory.join(digest.hexdigest() + CACHE_EXT)
+
+    def load(self, vertCode, fragCode):
+        """
+        Returns a linked program for the given code or None if it is not cached or the driver rejected the binary.
+        """
+        path = self.__path(vertCode, fragCode)
+        if path is None or not path.exists():
+            return None
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+        except (IOError, OSError):
+            return None
+        if len(data) <= _HEADER.size:
+            self.__discard(path)
+            return None
+
+        binaryFormat, = _HEADER.unpack_from(data)
+        blob = data[_HEADER.size:]
+        program = glCreateProgram()
+        glProgramBinary(program, binaryFormat, blob, len(blob))
+        status = (GLint * 1)()
+        glGetProgramiv(program, GL_LINK_STATUS, status)
+        if not status[0]:
+            # driver update or corrupt file, fall back to compiling from source
+            glDeleteProgram(program)
+            self.__discard(path)
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return ShaderProgram(program)
+
+    def store(self, program, vertCode, fragCode):
+        """
+        Saves the binary of a linked program, the program must be created with the retrievable hint.
+        """
+        path = self.__path(vertCode, fragCode)
+        if path is None or path.exists():
+            return
+
+        size = (GLint * 1)()
+        glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH, size)
+        if not size[0]:
+            return
+        length = (GLsizei * 1)()
+        binaryFormat = (GLenum * 1)()
+        blob = (ctypes.c_ubyte * size[0])()
+        glGetProgramBinary(program, size[0], length, binaryFormat, blob)
+
+        path.parent().ensureExists(True)
+        try:
+            # workers compiling the same program store the same key at once, each writes its own temporary file
+            with path.atomicEdit('wb') as fh:
+                fh.write(_HEADER.pack(binaryFormat[0]))
+                fh.write(bytearray(blob)[:length[0]])
+        except (IOError, OSError):
+            # atomicEdit removed its temporary file
+            return
+
+        self.__evict()
+
+    @staticmethod
+    def __discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __evict(self):
+        directory = self.directory()
+        entries = []
+        total = 0
+        for name in os.listdir(directory):
+            if not name.endswith(CACHE_EXT):
+                continue
+            path = directory.join(name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+
+        # oldest first
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            self.__discard(path)
+            total -= size
+
+
+gProgramBinaryCache = ProgramBinaryCache()
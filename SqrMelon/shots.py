@@ -3,7 +3,11 @@ import icons
 from fileutil import FilePath
 from textures import TextureManager
 from animationgraph.curvedata import Curve, Key
+from channelio import readChannel, writeChannel, TEXT_ENCODING
 from collections import OrderedDict
+import bisect
+import heapq
+import numpy
 from scene import Scene
 from xml.etree import cElementTree
 from util import randomColor, parseXMLWithIncludes, toPrettyXml, SCENE_EXT, currentProjectFilePath, \
@@ -56,6 +60,8 @@ class Shot(object):
         self.items[0].setData(self, Qt.UserRole + 1)
         self._enabled = True
         self._pinned = False
+        self.__layoutNames = None
+        self.__layout = None
         self.items[0].setIcon(icons.get('Checked Checkbox-48'))
 
     @property
@@ -88,39 +94,73 @@ class Shot(object):
             else:
                 self.items[0].setIcon(icons.get('Checked Checkbox-48'))
 
-    def evaluate(self, time):
-        time -= self.start
-        time *= self.speed
-        time -= self.preroll
-        data = {}
-        for name in self.curves:
-            value = self.curves[name].evaluate(time)
+    def __channelLayout(self):
+        """
+        Groups the channels into uniforms, e.g. uOrigin.x, uOrigin.y & uOrigin.z into uOrigin.
+        Returns a list of (uniform name, channel names), channel names is None for scalar channels.
+        Only recomputed when channels are added, removed or renamed.
+        """
+        names = tuple(self.curves)
+        if names == self.__layoutNames:
+            return self.__layout
+
+        groups = OrderedDict()
+        for name in names:
             if '.' in name:
                 name, channel = name.split('.', 1)
-                if name in data:
-                    data[name][channel] = value
-                else:
-                    data[name] = {channel: value}
+                assert groups.get(name, set()) is not None
+                groups.setdefault(name, set()).add(channel)
+            else:
+                assert name not in groups
+                groups[name] = None
+
+        layout = []
+        for name, channels in groups.items():
+            if channels is None:
+                layout.append((name, None))
+                continue
+            if 'w' in channels:
+                size = 4
+            elif 'z' in channels:
+                size = 3
+            elif 'y' in channels:
+                size = 2
+            else:
+                size = 1
+            layout.append((name, ['%s.%s' % (name, channel) for channel in 'xyzw'[:size]]))
+
+        self.__layoutNames = names
+        self.__layout = layout
+        return layout
+
+    def evaluate(self, time):
+        time = (time - self.start) * self.speed - self.preroll
+        curves = self.curves
+        data = {}
+        for name, channels in self.__channelLayout():
+            if channels is None:
+                data[name] = curves[name].evaluate(time)
             else:
-                assert name not in data
-                data[name] = value
-        for name in data:
-            if data[name].__class__.__name__ == 'dict':
-                v = data[name]
-                if 'w' in v:
-                    data[name] = [v['x'],
-                                  v['y'],
-                                  v['z'],
-                                  v['w']]
-                elif 'z' in v:
-                    data[name] = [v['x'],
-                                  v['y'],
-                                  v['z']]
-                elif 'y' in v:
-                    data[name] = [v['x'],
-                                  v['y']]
-                else:
-                    data[name] = [v['x']]
+                data[name] = [curves[channel].evaluate(time) for channel in channels]
+        return data
+
+    def revision(self):
+        """
+        Changes whenever anything that is saved for this shot changes.
+        """
+        return (tuple(item.text() for item in self.items), self._enabled,
+                tuple((name, curve.version()) for name, curve in self.curves.items()),
+                tuple((name, str(path)) for name, path in self.textures.items()))
+
+    def sampleMany(self, times):
+        """
+        Evaluate every channel of this shot at an array of global times in one go.
+        Returns an OrderedDict of channel name to a NumPy array of values.
+        """
+        times = (numpy.asarray(times, dtype=numpy.float64) - self.start) * self.speed - self.preroll
+        data = OrderedDict()
+        for name in self.curves:
+            data[name] = self.curves[name].sampleMany(times)
         return data
 
     def bake(self):
@@ -247,13 +287,11 @@ def _deserializeSceneShots(sceneName):
         for xEntry in xShot:
             if xEntry.tag.lower() == 'channel':
                 curveName = xEntry.attrib['name']
-                keys = []
-                if xEntry.text:
-                    keys = xEntry.text.split(',')
                 curve = Curve()
-                for i in range(0, len(keys), 8):
-                    curve.addKeyWithTangents(tangentBroken=int(keys[i + 6]), tangentMode=int(keys[i + 7]),
-                                             *[float(x) for x in keys[i:i + 6]])
+                # sort & compute tangents once, instead of after every key
+                with curve.batchEdit():
+                    for key in readChannel(xEntry).tolist():
+                        curve.addKeyWithTangents(tangentBroken=int(key[6]), tangentMode=int(key[7]), *key[:6])
                 curves[curveName] = curve
 
             if xEntry.tag.lower() == 'texture':
@@ -265,29 +303,180 @@ def _deserializeSceneShots(sceneName):
         yield shot
 
 
-def _saveSceneShots(sceneName, shots):
-    sceneFile = currentScenesDirectory().join(sceneName.ensureExt(SCENE_EXT))
-    xScene = parseXMLWithIncludes(sceneFile)
+def loadAllShots():
+    """
+    Load the shots of every scene in the current project, without any UI.
+    :rtype: list[Shot]
+    """
+    shots = []
+    for sceneName in iterSceneNames():
+        shots.extend(_deserializeSceneShots(sceneName))
+    return shots
+
+
+def shotAtTime(shots, time):
+    """
+    The shot to show at the given time: a pinned shot or else the last enabled shot in the list spanning the time.
+    :type shots: collections.Iterable[Shot]
+    :rtype: Shot
+    """
+    candidate = None
+    for shot in shots:
+        if not shot.enabled:
+            continue
+        if shot.pinned:
+            return shot
+        if shot.start <= time < shot.end:
+            candidate = shot
+    return candidate
+
+
+class ShotIndex(object):
+    """
+    Answers shotAtTime for a fixed list of shots with a binary search.
+
+    The timeline is cut into intervals at every shot start and end,
+    for each interval the shot that shotAtTime would pick is resolved once up front.
+    Must be rebuilt when shots are added, removed, moved, enabled or pinned.
+    """
+
+    def __init__(self, shots):
+        self.__pinned = None
+        # interval i spans boundaries[i] to boundaries[i + 1] and shows winners[i]
+        self.__boundaries = []
+        self.__winners = []
+
+        spans = []
+        for order, shot in enumerate(shots):
+            if not shot.enabled:
+                continue
+            if shot.pinned:
+                self.__pinned = shot
+                return
+            start, end = shot.start, shot.end
+            if start < end:
+                spans.append((start, end, order, shot))
+        if not spans:
+            return
 
-    # save user camera position per scene
-    userFile = currentProjectFilePath().ensureExt('user')
-    if userFile.exists():
-        xUser = parseXMLWithIncludes(userFile)
-    else:
-        xUser = cElementTree.Element('user')
-    if sceneFile in Scene.cache:
-        cameraData = Scene.cache[sceneFile].cameraData()
-        if cameraData:
-            for xSub in xUser:
-                if xSub.tag == 'scene' and xSub.attrib['name'] == sceneName:
-                    xSub.attrib['camera'] = ','.join([str(x) for x in cameraData])
-                    break
-            else:
-                cElementTree.SubElement(xUser, 'scene',
-                                        {'name': sceneName, 'camera': ','.join([str(x) for x in cameraData])})
+        spans.sort(key=lambda span: span[0])
+        self.__boundaries = sorted(set([span[0] for span in spans] + [span[1] for span in spans]))
+        # sweep over the boundaries, keeping the shots spanning the current interval in a heap with the last shot on top
+        active = []
+        nextSpan = 0
+        for boundary in self.__boundaries:
+            while nextSpan < len(spans) and spans[nextSpan][0] <= boundary:
+                start, end, order, shot = spans[nextSpan]
+                heapq.heappush(active, (-order, end, shot))
+                nextSpan += 1
+            while active and active[0][1] <= boundary:
+                heapq.heappop(active)
+            self.__winners.append(active[0][2] if active else None)
 
-    with userFile.edit() as fh:
-        fh.write(toPrettyXml(xUser))
+    def shotAtTime(self, time):
+        """
+        :rtype: Shot
+        """
+        if self.__pinned is not None:
+            return self.__pinned
+        i = bisect.bisect_right(self.__boundaries, time) - 1
+        if i < 0:
+            return None
+        return self.__winners[i]
+
+
+class FrameEvaluation(object):
+    """
+    The active shot at a time with its uniforms & textures, evaluated together once.
+    """
+
+    def __init__(self, time, shot):
+        self.time = time
+        self.shot = shot
+        self.__uniforms = shot.evaluate(time) if shot is not None else {}
+
+    def uniforms(self):
+        """
+        A copy of the evaluated uniforms, callers modify them before drawing.
+        """
+        return dict((name, list(value) if isinstance(value, list) else value) for name, value in self.__uniforms.items())
+
+    def textures(self):
+        if self.shot is None:
+            return {}
+        return self.shot.textures
+
+
+def projectChannelEncoding():
+    """
+    How the current project stores animation channels, see channelio.
+    """
+    xProject = parseXMLWithIncludes(currentProjectFilePath())
+    return xProject.attrib.get('ChannelEncoding', TEXT_ENCODING)
+
+
+def applyUserCameras(xUser, cameras):
+    """
+    Store the user camera position per scene in the root of a .user file, given a dict of scene name to camera data.
+    Returns whether any camera changed.
+    """
+    changed = False
+    xScenes = {}
+    for xSub in xUser:
+        if xSub.tag == 'scene':
+            xScenes[xSub.attrib['name']] = xSub
+    for sceneName, cameraData in cameras.items():
+        camera = ','.join([str(x) for x in cameraData])
+        xSub = xScenes.get(sceneName, None)
+        if xSub is None:
+            cElementTree.SubElement(xUser, 'scene', {'name': sceneName, 'camera': camera})
+            changed = True
+        elif xSub.attrib.get('camera', None) != camera:
+            xSub.attrib['camera'] = camera
+            changed = True
+    return changed
+
+
+class ShotSnapshot(object):
+    """
+    A copy of everything that is saved of a shot, so it can be serialized on another thread.
+    """
+
+    def __init__(self, shot):
+        self.name = shot.name
+        self.sceneName = shot.sceneName
+        self.start = shot.start
+        self.end = shot.end
+        self.enabled = shot.enabled
+        self.speed = shot.speed
+        self.preroll = shot.preroll
+        self.channels = [(curveName, [(key.inTangent.x, key.inTangent.y, key.point().x, key.point().y,
+                                       key.outTangent.x, key.outTangent.y, key.tangentBroken, key.tangentMode)
+                                      for key in curve])
+                         for curveName, curve in shot.curves.items()]
+        self.textures = [(texName, str(path)) for texName, path in shot.textures.items()]
+
+
+class ShotsSnapshot(object):
+    """
+    Shot copies per scene & the user camera of every scene, see ShotManager.snapshot.
+    """
+
+    def __init__(self, scenes, revisions, cameras, channelEncoding):
+        # list of (scene file, scene name, list of ShotSnapshot)
+        self.scenes = scenes
+        # scene name to the revision the copies were taken at
+        self.revisions = revisions
+        self.cameras = cameras
+        self.channelEncoding = channelEncoding
+
+
+def saveSceneShots(sceneFile, sceneName, shots, channelEncoding=TEXT_ENCODING, outputPath=None):
+    """
+    Replace the shots in a scene file, all given shots (ShotSnapshot) must belong to the scene.
+    The result is written to outputPath instead when given.
+    """
+    xScene = parseXMLWithIncludes(sceneFile)
 
     # remove old shots
     r = []
@@ -296,12 +485,7 @@ def _saveSceneShots(sceneName, shots):
     for s in r:
         xScene.remove(s)
 
-    targets = []
     for shot in shots:
-        if shot.sceneName == sceneName:
-            targets.append(shot)
-
-    for shot in targets:
         xShot = cElementTree.SubElement(xScene, 'Shot', {'name': shot.name,
                                                          'scene': sceneName,
                                                          'start': str(shot.start),
@@ -309,23 +493,13 @@ def _saveSceneShots(sceneName, shots):
                                                          'enabled': str(shot.enabled),
                                                          'speed': str(shot.speed),
                                                          'preroll': str(shot.preroll)})
-        for curveName in shot.curves:
+        for curveName, keys in shot.channels:
             xChannel = cElementTree.SubElement(xShot, 'Channel', {'name': curveName, 'mode': 'hermite'})
-            data = []
-            for key in shot.curves[curveName]:
-                data.append(str(key.inTangent.x))
-                data.append(str(key.inTangent.y))
-                data.append(str(key.point().x))
-                data.append(str(key.point().y))
-                data.append(str(key.outTangent.x))
-                data.append(str(key.outTangent.y))
-                data.append(str(int(key.tangentBroken)))
-                data.append(str(key.tangentMode))
-            xChannel.text = ','.join(data)
-        for texName in shot.textures:
-            cElementTree.SubElement(xShot, 'Texture', {'name': texName, 'path': shot.textures[texName]})
-
-    with sceneFile.edit() as fh:
+            writeChannel(xChannel, keys, channelEncoding)
+        for texName, path in shot.textures:
+            cElementTree.SubElement(xShot, 'Texture', {'name': texName, 'path': path})
+
+    with FilePath(outputPath or sceneFile).atomicEdit() as fh:
         fh.write(toPrettyXml(xScene))
 
 
@@ -459,6 +633,16 @@ class ShotManager(QWidget):
         self.__table.setItemDelegateForColumn(3, delegate)
         mainLayout.addWidget(self.__table)
         self.__model = ShotItemModel()
+        # built on demand, edits can change several items before the shots are consistent again
+        self.__shotIndex = None
+        self.__frame = None
+        self.__frameKey = None
+        self.__savedRevisions = {}
+        self.__model.itemChanged.connect(self.__onShotsChanged)
+        self.__model.rowsInserted.connect(self.__onShotsChanged)
+        self.__model.rowsRemoved.connect(self.__onShotsChanged)
+        self.__model.rowsMoved.connect(self.__onShotsChanged)
+        self.__model.modelReset.connect(self.__onShotsChanged)
         shots = ShotModel()
         shots.setSourceModel(self.__model)
         self.__model.setColumnCount(7)
@@ -490,35 +674,40 @@ class ShotManager(QWidget):
     def onPinShot(self, pinShot):
         for shot in self.shots():
             shot.pinned = shot == pinShot
+        self.__onShotsChanged()
         self.shotPinned.emit(pinShot)
 
     @property
     def shotChanged(self):
         return self.__model.itemChanged
 
+    def __onShotsChanged(self, *args):
+        self.__shotIndex = None
+        self.__frame = None
+
     def shotAtTime(self, time):
-        candidate = None
-        for row in range(self.__model.rowCount()):
-            shot = self.__model.item(row).data(Qt.UserRole + 1)
-            if not shot.enabled:
-                continue
-            if shot.pinned:
-                return shot
-            if shot.start <= time < shot.end:
-                candidate = shot
-        return candidate
+        if self.__shotIndex is None:
+            self.__shotIndex = ShotIndex(self.shots())
+        return self.__shotIndex.shotAtTime(time)
+
+    def evaluateFrame(self, time):
+        """
+        Evaluates the active shot at the given time, reusing the previous result until the time, shots or curves change.
+        :rtype: FrameEvaluation
+        """
+        shot = self.shotAtTime(time)
+        # deleting a channel does not edit any curve
+        key = time, shot, Curve.generation(), len(shot.curves) if shot is not None else 0
+        if self.__frame is None or key != self.__frameKey:
+            self.__frame = FrameEvaluation(time, shot)
+            self.__frameKey = key
+        return self.__frame
 
     def additionalTextures(self, time):
-        shot = self.shotAtTime(time)
-        if not shot:
-            return {}
-        return shot.textures
+        return self.evaluateFrame(time).textures()
 
     def evaluate(self, time):
-        shot = self.shotAtTime(time)
-        if not shot:
-            return {}
-        return shot.evaluate(time)
+        return self.evaluateFrame(time).uniforms()
 
     def projectOpened(self):
         self.__loadAllShots()
@@ -536,6 +725,9 @@ class ShotManager(QWidget):
                 self.__model.appendRow(shot.items)
 
         self.__table.sortByColumn(2, Qt.AscendingOrder)
+        # what is on disk, to only save scenes that changed
+        self.__savedRevisions = dict((sceneName, self.__sceneRevision(shots))
+                                     for sceneName, shots in self.__shotsPerScene().items())
 
     def shots(self):
         for row in range(self.__model.rowCount()):
@@ -547,9 +739,47 @@ class ShotManager(QWidget):
         self.__table.clearSelection()
         self.__table.selectRow(idx.row())
 
-    def saveAllShots(self):
-        for sceneName in iterSceneNames():
-            _saveSceneShots(sceneName, self.shots())
+    def __shotsPerScene(self):
+        shotsPerScene = OrderedDict((sceneName, []) for sceneName in iterSceneNames())
+        for shot in self.shots():
+            if shot.sceneName in shotsPerScene:
+                shotsPerScene[shot.sceneName].append(shot)
+        return shotsPerScene
+
+    @staticmethod
+    def __sceneRevision(shots):
+        return tuple(shot.revision() for shot in shots)
+
+    def snapshot(self, changedOnly=True):
+        """
+        Copies the shots of every scene, or only of the scenes that changed since they were loaded or saved.
+        Hand the revisions of the snapshot to markSaved once it is written.
+        :rtype: ShotsSnapshot
+        """
+        scenes = []
+        revisions = {}
+        shotsPerScene = self.__shotsPerScene()
+        for sceneName, shots in shotsPerScene.items():
+            revision = self.__sceneRevision(shots)
+            if changedOnly and self.__savedRevisions.get(sceneName, ()) == revision:
+                continue
+            sceneFile = currentScenesDirectory().join(sceneName.ensureExt(SCENE_EXT))
+            scenes.append((sceneFile, sceneName, [ShotSnapshot(shot) for shot in shots]))
+            revisions[sceneName] = revision
+
+        cameras = {}
+        for sceneName in shotsPerScene:
+            sceneFile = currentScenesDirectory().join(sceneName.ensureExt(SCENE_EXT))
+            if sceneFile in Scene.cache:
+                cameraData = Scene.cache[sceneFile].cameraData()
+                if cameraData:
+                    cameras[sceneName] = tuple(cameraData)
+
+        channelEncoding = projectChannelEncoding() if scenes else TEXT_ENCODING
+        return ShotsSnapshot(scenes, revisions, cameras, channelEncoding)
+
+    def markSaved(self, revisions):
+        self.__savedRevisions.update(revisions)
 
     def __onCurrentChanged(self, current, previous):
         row = self.__table.model().mapToSource(current).row()
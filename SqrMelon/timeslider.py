@@ -14,7 +14,7 @@ from math import floor
 from xml.etree import cElementTree
 
 import icons
-from util import gSettings, toPrettyXml, currentProjectFilePath, currentProjectDirectory
+from util import gSettings, currentProjectFilePath, currentProjectDirectory
 
 
 class OSCClient(object):
@@ -171,7 +171,10 @@ class Timer(object):
         self.__osc.setBpm(int(round(self.__BPS * 60)))
         self.bpmChanged.emit(self.__BPS * 60.0)
 
-    def saveState(self):
+    def saveSettings(self):
+        """
+        Stores the playback range in the user settings, and the project timing as well for legacy projects.
+        """
         gSettings.setValue('TimerStartTime', self.__start)
         gSettings.setValue('TimerEndTime', self.__end)
         gSettings.setValue('TimerTime', self.__time)
@@ -182,13 +185,14 @@ class Timer(object):
             gSettings.setValue('TimerMinTime', self.__minTime)
             gSettings.setValue('TimerMaxTime', self.__maxTime)
             gSettings.setValue('TimerBPS', self.__BPS)
-            return
-        root = cElementTree.Element('Project')
-        root.attrib['TimerMinTime'] = str(self.__minTime)
-        root.attrib['TimerMaxTime'] = str(self.__maxTime)
-        root.attrib['TimerBPS'] = str(self.__BPS)
-        with project.edit() as fh:
-            fh.write(toPrettyXml(root))
+
+    def projectAttributes(self):
+        """
+        The timing attributes of the project file's root element.
+        """
+        return {'TimerMinTime': str(self.__minTime),
+                'TimerMaxTime': str(self.__maxTime),
+                'TimerBPS': str(self.__BPS)}
 
     def goToStart(self):
         self.time = self.__start